@@ -20,6 +20,7 @@
 
 
 from functools import lru_cache
+from collections import OrderedDict
 import sys
 import os
 import subprocess
@@ -31,14 +32,16 @@ import webbrowser
 import datetime
 import winreg
 
-import psutil
-from PIL import Image, ImageGrab, PngImagePlugin
+# psutil, PIL, а также copy, atexit, shutil, hashlib и threading импортируются внутри функций,
+# которые их используют, чтобы не замедлять запуск каждого процесса приложения
 
 from PyQt5.QtWidgets import (QMessageBox, QDesktopWidget, QApplication,
                                 QGraphicsBlurEffect, QGraphicsPixmapItem, QGraphicsScene, QMenu)
-from PyQt5.QtCore import (QRectF, QPoint, QSizeF, Qt, QPointF, QRect, QMimeData, QUrl)
+from PyQt5.QtCore import (QRectF, QPoint, QSizeF, Qt, QPointF, QRect, QMimeData, QUrl, QTimer, QSize,
+                                                                                QThread, pyqtSignal)
 from PyQt5.QtGui import (QPixmap, QImage, QRadialGradient, QColor, QGuiApplication, QPen, QCursor,
-                        QLinearGradient, QPainter, QImageReader, QVector2D, QPainterPath, QRegion, QTransform)
+                        QLinearGradient, QPainter, QImageReader, QVector2D, QPainterPath, QRegion, QTransform,
+                        QImageIOHandler)
 from PyQt5.QtSvg import  QSvgRenderer
 
 win32process = None
@@ -57,6 +60,14 @@ __all__ = (
     'check_scancode_for',
 
     'SettingsJson',
+    'PixmapsDiskCache',
+    'ThumbnailsDiskCache',
+    'AnimatedFrameSource',
+
+    'download_url_to_folder',
+
+    'sniff_image_format',
+    'ImageFilesScanner',
 
     'generate_metainfo',
     'generate_datetime_stamp',
@@ -94,6 +105,9 @@ __all__ = (
     'fit01',
 
     'load_image_respect_orientation',
+    'load_image_preview_respect_orientation',
+    'load_image_proxy_respect_orientation',
+    'load_image_region_respect_orientation',
     'is_webp_file_animated',
 
     'apply_blur_effect',
@@ -272,8 +286,13 @@ def check_scancode_for(event, data):
 
 class SettingsJson():
 
+    # серия изменений подряд записывается на диск одним разом спустя эту задержку
+    FLUSH_DELAY_MSEC = 500
+
     def init(self, Globals):
         self.debug_mode = Globals.DEBUG
+        # путь к файлу зависит от режима, поэтому перечитываем
+        self.file_was_read = False
 
     def __new__(cls):
         if not hasattr(cls, 'instance'):
@@ -281,6 +300,13 @@ class SettingsJson():
             cls.instance.debug_mode = False
             cls.instance.force_reading_from_file = True
             cls.instance.data = {}
+            cls.instance.file_mtime = None
+            cls.instance.file_was_read = False
+            cls.instance.pending_changes = {}
+            cls.instance.flush_timer = None
+            # несохранённые изменения не должны теряться при выходе из приложения
+            import atexit
+            atexit.register(cls.instance.flush)
         return cls.instance
 
     def set_reading_file_on_getting_value(self, value):
@@ -293,34 +319,515 @@ class SettingsJson():
             root = os.path.expanduser("~")
         return os.path.join(root, "oxxxy_settings.json")
 
+    def get_file_mtime(self):
+        try:
+            return os.stat(self.get_filepath()).st_mtime_ns
+        except OSError:
+            return None
+
     def set_data(self, key, value):
+        import copy
         self.read_data()
+        value = copy.deepcopy(value)
         self.data.update({key:value})
+        self.pending_changes.update({key:value})
+        self.schedule_flush()
+
+    def schedule_flush(self):
+        if QApplication.instance() is None:
+            self.flush()
+            return
+        if self.flush_timer is None:
+            self.flush_timer = QTimer()
+            self.flush_timer.setSingleShot(True)
+            self.flush_timer.setInterval(self.FLUSH_DELAY_MSEC)
+            self.flush_timer.timeout.connect(self.flush)
+        self.flush_timer.start()
+
+    def flush(self):
+        if self.flush_timer is not None:
+            self.flush_timer.stop()
+        if not self.pending_changes:
+            return
+        # пишем во временный файл и подменяем им основной,
+        # чтобы при падении посреди записи файл настроек не оказался обрезанным
         filepath = self.get_filepath()
-        if os.path.exists(filepath):
-            os.remove(filepath)
-        with open(filepath, 'w+', encoding="utf8") as file:
+        temp_filepath = f"{filepath}.tmp"
+        with open(temp_filepath, 'w+', encoding="utf8") as file:
             json.dump(self.data, file, indent=True)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_filepath, filepath)
+        self.file_mtime = self.get_file_mtime()
+        self.pending_changes.clear()
 
     def read_data(self):
-        filepath = self.get_filepath()
-        if not os.path.exists(filepath):
+        # файл перечитывается только если он был изменён извне
+        mtime = self.get_file_mtime()
+        if self.file_was_read and mtime == self.file_mtime:
+            return
+        self.file_was_read = True
+        self.file_mtime = mtime
+        if mtime is None:
             self.data = {}
         else:
-            with open(filepath, "r", encoding="utf8") as file:
+            with open(self.get_filepath(), "r", encoding="utf8") as file:
                 try:
                     self.data = json.load(file)
                 except Exception:
                     self.data = {}
+        # ещё не записанные изменения важнее прочитанного
+        self.data.update(self.pending_changes)
 
     def get_data(self, key, default_value={}):
-        if self.force_reading_from_file:
+        import copy
+        if self.force_reading_from_file or not self.file_was_read:
             self.read_data()
-        return self.data.get(key, default_value)
+        return copy.deepcopy(self.data.get(key, default_value))
+
+class PixmapsDiskCache():
+    """
+        On-disk cache of procedurally drawn pixmaps.
+        Cache folder is named after the version passed by the caller,
+        the version has to be bumped by hand whenever the drawing code changes
+    """
+
+    def __init__(self, name, version):
+        self.version = f'v{version}'
+        self.name_folder_path = os.path.join(os.path.expanduser("~"), "oxxxy_cache", name)
+        self.folder_path = os.path.join(self.name_folder_path, self.version)
+        self.folder_checked = False
+
+    def check_folder(self):
+        if self.folder_checked:
+            return
+        self.folder_checked = True
+        import shutil
+        # версии кэша от старого кода больше не понадобятся
+        if os.path.exists(self.name_folder_path):
+            for folder_name in os.listdir(self.name_folder_path):
+                if folder_name != self.version:
+                    shutil.rmtree(os.path.join(self.name_folder_path, folder_name), ignore_errors=True)
+        os.makedirs(self.folder_path, exist_ok=True)
+
+    def get_pixmap(self, key, width, height, draw_func, device_pixel_ratio=1.0):
+        filename = f"{key}_{width}x{height}@{device_pixel_ratio:g}x.png"
+        filepath = os.path.join(self.folder_path, filename)
+        if os.path.exists(filepath):
+            pixmap = QPixmap(filepath)
+            if not pixmap.isNull():
+                pixmap.setDevicePixelRatio(device_pixel_ratio)
+                return pixmap
+        pixmap = QPixmap(math.ceil(width*device_pixel_ratio), math.ceil(height*device_pixel_ratio))
+        pixmap.fill(Qt.transparent)
+        painter = QPainter()
+        painter.begin(pixmap)
+        painter.scale(device_pixel_ratio, device_pixel_ratio)
+        draw_func(painter)
+        painter.end()
+        try:
+            self.check_folder()
+            # через временный файл, чтобы параллельно запущенный процесс не прочитал недописанный файл
+            temp_filepath = f"{filepath}.{os.getpid()}.tmp"
+            if pixmap.save(temp_filepath, "PNG"):
+                os.replace(temp_filepath, filepath)
+        except OSError:
+            pass
+        pixmap.setDevicePixelRatio(device_pixel_ratio)
+        return pixmap
+
+class ThumbnailsDiskCache():
+    """
+        On-disk cache of image thumbnails shared by all processes of the app.
+        Key is built from absolute path, file size, mtime and target size,
+        so changed files get new thumbnails automatically.
+        Least recently used files are removed when the size cap is exceeded.
+        Can be used from worker threads, works with QImage only
+    """
+
+    MAX_SIZE_BYTES = 256*1024*1024
+    # после чистки кэш занимает не больше этой доли от допустимого размера
+    EVICTION_TARGET_RATIO = 0.8
+
+    def __init__(self, name):
+        import threading
+        self.folder_path = os.path.join(os.path.expanduser("~"), "oxxxy_cache", name)
+        self.lock = threading.Lock()
+        self.total_size = None
+
+    def get_filepath(self, filepath, size_key):
+        import hashlib
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        key = f"{os.path.abspath(filepath)}|{stat.st_size}|{stat.st_mtime_ns}|{size_key}"
+        digest = hashlib.md5(key.encode('utf8')).hexdigest()
+        return os.path.join(self.folder_path, digest[:2], f"{digest}.png")
+
+    def load(self, filepath, size_key):
+        cache_filepath = self.get_filepath(filepath, size_key)
+        if cache_filepath is None or not os.path.exists(cache_filepath):
+            return None
+        image = QImage(cache_filepath)
+        if image.isNull():
+            return None
+        try:
+            # время изменения файла кэша служит отметкой последнего использования для LRU
+            os.utime(cache_filepath)
+        except OSError:
+            pass
+        return image
+
+    def store(self, filepath, size_key, image):
+        import threading
+        cache_filepath = self.get_filepath(filepath, size_key)
+        if cache_filepath is None or image.isNull():
+            return
+        try:
+            os.makedirs(os.path.dirname(cache_filepath), exist_ok=True)
+            temp_filepath = f"{cache_filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+            if not image.save(temp_filepath, "PNG"):
+                return
+            os.replace(temp_filepath, cache_filepath)
+            file_size = os.path.getsize(cache_filepath)
+        except OSError:
+            return
+        with self.lock:
+            if self.total_size is None:
+                self.total_size = sum(size for path, size, mtime in self.list_cache_files())
+            else:
+                self.total_size += file_size
+            if self.total_size > self.MAX_SIZE_BYTES:
+                self.evict()
+
+    def list_cache_files(self):
+        if not os.path.exists(self.folder_path):
+            return
+        for subfolder in os.scandir(self.folder_path):
+            if not subfolder.is_dir():
+                continue
+            for entry in os.scandir(subfolder.path):
+                if entry.is_file() and entry.name.endswith('.png'):
+                    stat = entry.stat()
+                    yield entry.path, stat.st_size, stat.st_mtime
+
+    def evict(self):
+        target_size = self.MAX_SIZE_BYTES*self.EVICTION_TARGET_RATIO
+        files = sorted(self.list_cache_files(), key=lambda x: x[2])
+        self.total_size = sum(size for path, size, mtime in files)
+        for path, size, mtime in files:
+            if self.total_size <= target_size:
+                break
+            try:
+                os.remove(path)
+                self.total_size -= size
+            except OSError:
+                pass
+
+    def get_image(self, filepath, size_key, make_image_func):
+        image = self.load(filepath, size_key)
+        if image is None:
+            image = make_image_func()
+            if image is not None:
+                self.store(filepath, size_key, image)
+        return image
+
+class AnimatedFrameSource(QThread):
+    """
+        Frames of GIF and animated WebP decoded on demand in a worker thread.
+        Decoded frames are kept in a bounded LRU cache, the next few frames
+        after each requested one are prefetched.
+        Frames are QImage, the owner converts them to QPixmap in the GUI thread
+    """
+    frame_ready = pyqtSignal(int)
+
+    CACHE_SIZE = 32
+    PREFETCH_COUNT = 4
+    DEFAULT_DELAY = 100
+
+    def __init__(self, filepath, cache_size=CACHE_SIZE, prefetch_count=PREFETCH_COUNT):
+        import threading
+        super().__init__()
+        self.filepath = filepath
+        self.cache_size = max(cache_size, prefetch_count + 2)
+        self.prefetch_count = prefetch_count
+        reader = QImageReader(filepath)
+        self.frames_count = max(1, reader.imageCount())
+        self.frame_size = reader.size()
+        self.cache = OrderedDict()
+        self.delays = dict()
+        self.requested = []
+        self.stopped = False
+        # поток работает только пока есть запросы, чтобы не висеть при выходе из приложения
+        self.worker_active = False
+        self.condition = threading.Condition()
+        # читатель используется только рабочим потоком
+        self.reader = None
+        self.reader_position = 0
+
+    def frameCount(self):
+        return self.frames_count
+
+    def frame_delay(self, frame_number):
+        return self.delays.get(frame_number, self.DEFAULT_DELAY)
+
+    def request(self, frame_number):
+        with self.condition:
+            for n in range(frame_number, min(frame_number + self.prefetch_count + 1, self.frames_count)):
+                if n not in self.cache and n not in self.requested:
+                    self.requested.append(n)
+            self.condition.notify_all()
+            need_start = self.requested and not self.worker_active and not self.stopped
+            if need_start:
+                self.worker_active = True
+        if need_start:
+            # предыдущий запуск мог ещё не до конца выйти из run
+            self.wait()
+            self.start(QThread.LowPriority)
+
+    def get_frame(self, frame_number, wait=False):
+        image = None
+        with self.condition:
+            if frame_number in self.cache:
+                self.cache.move_to_end(frame_number)
+                image = self.cache[frame_number]
+        self.request(frame_number)
+        if image is None and wait:
+            with self.condition:
+                while frame_number not in self.cache and not self.stopped:
+                    self.condition.wait()
+                image = self.cache.get(frame_number, None)
+        return image
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.wait()
+
+    def read_next_frame(self):
+        if self.reader is None:
+            self.reader = QImageReader(self.filepath)
+            self.reader_position = 0
+        frame_number = self.reader_position
+        image = self.reader.read()
+        delay = self.reader.nextImageDelay()
+        self.reader_position += 1
+        with self.condition:
+            self.delays[frame_number] = delay if delay > 0 else self.DEFAULT_DELAY
+            self.cache[frame_number] = image
+            self.cache.move_to_end(frame_number)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            self.condition.notify_all()
+        self.frame_ready.emit(frame_number)
+
+    def run(self):
+        while True:
+            with self.condition:
+                if not self.requested or self.stopped:
+                    self.worker_active = False
+                    return
+                frame_number = self.requested.pop(0)
+                if frame_number in self.cache:
+                    continue
+            # кадры анимации зависят от предыдущих, поэтому для возврата назад
+            # приходится декодировать заново с начала файла
+            if frame_number < self.reader_position:
+                self.reader = None
+            while self.reader is None or self.reader_position <= frame_number:
+                if self.reader is not None and not self.reader.canRead():
+                    # кадров меньше, чем заявлено, ожидающих всё равно нужно отпустить
+                    with self.condition:
+                        self.cache[frame_number] = QImage()
+                        self.condition.notify_all()
+                    break
+                self.read_next_frame()
+
+DOWNLOAD_CHUNK_SIZE = 256*1024
+
+def download_url_to_folder(url, folder_path, name, timeout=30, is_cancelled=None):
+    # файл запрашивается один раз: расширение берётся из content-type того же ответа,
+    # а содержимое пишется на диск по частям, не собираясь целиком в памяти;
+    # при отмене, ошибке или если пришла не картинка возвращается None
+    import urllib.request
+    import http.client
+    try:
+        response = urllib.request.urlopen(url, timeout=timeout)
+    except http.client.InvalidURL:
+        try:
+            response = urllib.request.urlopen(url.replace(" ", "%20"), timeout=timeout)
+        except Exception:
+            return None
+    except Exception:
+        return None
+    with response:
+        mime_type = response.headers.get('content-type', '').split(";")[0].strip().lower()
+        if mime_type.startswith('image/'):
+            ext = mime_type.split("/")[-1]
+        elif mime_type in ['', 'application/octet-stream']:
+            # расширение определится по содержимому
+            ext = None
+        else:
+            # например, html-страница вместо картинки
+            return None
+        temp_filepath = os.path.join(folder_path, f'{name}.part')
+        try:
+            with open(temp_filepath, 'wb') as file:
+                while True:
+                    if is_cancelled is not None and is_cancelled():
+                        raise InterruptedError()
+                    chunk = response.read(DOWNLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    file.write(chunk)
+            if ext is None:
+                ext = sniff_image_format(temp_filepath)
+                if ext is None:
+                    raise ValueError('not an image')
+            filepath = os.path.join(folder_path, f'{name}.{ext}')
+            os.replace(temp_filepath, filepath)
+        except Exception:
+            if os.path.exists(temp_filepath):
+                os.remove(temp_filepath)
+            return None
+    return filepath
+
+IMAGE_FORMATS_SIGNATURES = (
+    (0, b'\x89PNG\r\n\x1a\n', 'png'),
+    (0, b'\xff\xd8\xff', 'jpg'),
+    (0, b'GIF87a', 'gif'),
+    (0, b'GIF89a', 'gif'),
+    (8, b'WEBP', 'webp'),
+    (0, b'BM', 'bmp'),
+    (0, b'II*\x00', 'tiff'),
+    (0, b'MM\x00*', 'tiff'),
+    (0, b'\x00\x00\x01\x00', 'ico'),
+    (4, b'ftypavif', 'avif'),
+    (4, b'ftypheic', 'heic'),
+)
+
+def sniff_image_format(filepath):
+    # формат определяется по первым байтам файла, а не по расширению
+    try:
+        with open(filepath, 'rb') as file:
+            header = file.read(16)
+    except OSError:
+        return None
+    for offset, signature, image_format in IMAGE_FORMATS_SIGNATURES:
+        if header[offset:offset+len(signature)] == signature:
+            if image_format == 'webp' and not header.startswith(b'RIFF'):
+                continue
+            return image_format
+    if filepath.lower().endswith('.svg'):
+        return 'svg'
+    return None
+
+class ImageFilesScanner():
+    """
+        Finds image files in folders with os.scandir, formats are checked by magic bytes.
+        Folder listings are cached on disk and reused while folder mtime is unchanged.
+        Results are yielded in batches, scanning can be cancelled between folders and batches
+    """
+
+    BATCH_SIZE = 64
+
+    def __init__(self, name):
+        import threading
+        self.cache_filepath = os.path.join(os.path.expanduser("~"), "oxxxy_cache", f"{name}.json")
+        self.listings = None
+        self.listings_changed = False
+        # сканер общий для фоновых потоков и главного потока
+        self.lock = threading.Lock()
+
+    def load_listings(self):
+        with self.lock:
+            if self.listings is not None:
+                return
+            self.listings = dict()
+            try:
+                with open(self.cache_filepath, 'r', encoding='utf8') as file:
+                    self.listings = json.load(file)
+            except (OSError, ValueError):
+                pass
+
+    def save_listings(self):
+        import threading
+        with self.lock:
+            if not self.listings_changed:
+                return
+            self.listings_changed = False
+            listings = dict(self.listings)
+        try:
+            os.makedirs(os.path.dirname(self.cache_filepath), exist_ok=True)
+            temp_filepath = f"{self.cache_filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_filepath, 'w', encoding='utf8') as file:
+                json.dump(listings, file)
+            os.replace(temp_filepath, self.cache_filepath)
+        except OSError:
+            pass
+
+    def list_folder(self, folder_path):
+        try:
+            mtime = os.stat(folder_path).st_mtime_ns
+        except OSError:
+            return [], []
+        with self.lock:
+            cached = self.listings.get(folder_path, None)
+        if cached and cached[0] == mtime:
+            return cached[1], cached[2]
+        images = []
+        subfolders = []
+        try:
+            with os.scandir(folder_path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir():
+                            subfolders.append(entry.path)
+                        elif entry.is_file() and sniff_image_format(entry.path):
+                            images.append(entry.path)
+                    except OSError:
+                        pass
+        except OSError:
+            return [], []
+        images.sort()
+        subfolders.sort()
+        with self.lock:
+            self.listings[folder_path] = [mtime, images, subfolders]
+            self.listings_changed = True
+        return images, subfolders
+
+    def scan(self, folder_path, recursive=True, is_cancelled=None, batch_size=BATCH_SIZE):
+        self.load_listings()
+        batch = []
+        folders = [os.path.normpath(folder_path)]
+        try:
+            while folders:
+                if is_cancelled and is_cancelled():
+                    return
+                images, subfolders = self.list_folder(folders.pop(0))
+                for image_path in images:
+                    batch.append(image_path)
+                    if len(batch) >= batch_size:
+                        yield batch
+                        batch = []
+                        if is_cancelled and is_cancelled():
+                            return
+                if recursive:
+                    folders.extend(subfolders)
+            if batch:
+                yield batch
+        finally:
+            self.save_listings()
+
+    def scan_all(self, folder_path, recursive=True):
+        return [image_path for batch in self.scan(folder_path, recursive=recursive) for image_path in batch]
 
 def generate_metainfo():
     if win32process:
         try:
+            import psutil
             user32 = ctypes.windll.user32
             hwnd = user32.GetForegroundWindow()
             length = user32.GetWindowTextLengthW(hwnd)
@@ -406,6 +913,7 @@ def get_creation_date(path_to_file):
             return stat.st_mtime
 
 def find_browser_exe_file(exe_filename="chrome.exe"):
+    import psutil
     exe_filepath = None
     for proc in psutil.process_iter():
         try:
@@ -431,6 +939,7 @@ def open_in_google_chrome(filepath):
         QMessageBox.critical(None, "Error", msg)
 
 def save_meta_info(metadata, filepath):
+    from PIL import Image, PngImagePlugin
     m0 = metadata[0]
     m1 = metadata[1]
     metastring = f"Screenshot metadata: {m0} {m1}"
@@ -454,6 +963,7 @@ def load_svg(path, scale_factor=20):
     return QPixmap.fromImage(rastered_image)
 
 def PIL_to_QImage(im):
+    from PIL import Image
     if isinstance(im, QImage):
         return None, im
     else:
@@ -470,6 +980,7 @@ def PIL_to_QImage(im):
         return QImage(data, im.size[0], im.size[1], QImage.Format_ARGB32)
 
 def make_screenshot_ImageGrab():
+    from PIL import ImageGrab
     return PIL_to_QImage(ImageGrab.grab(all_screens=True))
 
 def make_screenshot_pyqt(underMouse=False):
@@ -786,6 +1297,74 @@ def load_image_respect_orientation(filepath):
     img = imgReader.read()
     return QPixmap().fromImage(img)
 
+def load_image_preview_respect_orientation(filepath, preview_width):
+    # декодируется сразу уменьшенное изображение, для JPEG это делается
+    # средствами самого декодера (масштабирование DCT), поэтому полное изображение в память не попадает;
+    # возвращает QImage, его можно получать не в главном потоке
+    imgReader = QImageReader(filepath)
+    imgReader.setAutoTransform(True)
+    size = imgReader.size()
+    rotated = bool(imgReader.transformation() & QImageIOHandler.TransformationRotate90)
+    if rotated:
+        size.transpose()
+    if not size.isValid() or size.width() == 0:
+        # размер заранее неизвестен, поэтому декодируем как есть
+        img = imgReader.read()
+        if img.isNull():
+            return img, QSize()
+        size = img.size()
+        preview_height = int(size.height()*preview_width/size.width())
+        img = img.scaled(preview_width, preview_height,
+                                        Qt.KeepAspectRatioByExpanding, Qt.SmoothTransformation)
+        return img, size
+    preview_height = max(1, int(size.height()*preview_width/size.width()))
+    scaled_size = QSize(preview_width, preview_height)
+    if rotated:
+        # уменьшение применяется до поворота
+        scaled_size.transpose()
+    imgReader.setScaledSize(scaled_size)
+    img = imgReader.read()
+    return img, size
+
+def load_image_proxy_respect_orientation(filepath, max_side):
+    # уменьшенная копия для интерактивной работы, если изображение не больше max_side,
+    # то оно загружается как есть; вторым значением возвращается размер оригинала
+    imgReader = QImageReader(filepath)
+    imgReader.setAutoTransform(True)
+    size = imgReader.size()
+    if not size.isValid() or max(size.width(), size.height()) <= max_side:
+        img = imgReader.read()
+        return img, img.size()
+    rotated = bool(imgReader.transformation() & QImageIOHandler.TransformationRotate90)
+    if rotated:
+        size.transpose()
+    scaled_size = size.scaled(max_side, max_side, Qt.KeepAspectRatio)
+    if rotated:
+        scaled_size.transpose()
+    imgReader.setScaledSize(scaled_size)
+    img = imgReader.read()
+    return img, size
+
+def load_image_region_respect_orientation(filepath, region_rect, target_size=None):
+    # часть оригинала в полном разрешении (или сразу уменьшенная до target_size);
+    # region_rect задаётся в координатах уже повёрнутого согласно EXIF изображения
+    imgReader = QImageReader(filepath)
+    imgReader.setAutoTransform(True)
+    region_rect = QRect(region_rect)
+    if imgReader.transformation() == QImageIOHandler.TransformationNone:
+        # декодер сам вырезает нужную часть, всё изображение целиком в память не попадает
+        imgReader.setClipRect(region_rect)
+        if target_size is not None and target_size.width() < region_rect.width():
+            imgReader.setScaledSize(target_size)
+        return imgReader.read()
+    img = imgReader.read()
+    if img.isNull():
+        return img
+    img = img.copy(region_rect)
+    if target_size is not None and target_size.width() < region_rect.width():
+        img = img.scaled(target_size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+    return img
+
 def is_webp_file_animated(filepath):
     result = False
     file_h = open(filepath, "rb")
@@ -818,6 +1397,55 @@ def apply_blur_effect(src_pix, pix, blur_radius=5):
 
     return pix
 
+def get_rotated_rect_source_bounds(capture_pos, capture_rotation, capture_width, capture_height):
+    # прямоугольник в координатах исходника, который целиком накрывает повёрнутую рамку
+    angle = math.radians(capture_rotation)
+    cos = abs(math.cos(angle))
+    sin = abs(math.sin(angle))
+    bounds_width = capture_width*cos + capture_height*sin
+    bounds_height = capture_width*sin + capture_height*cos
+    bounds = QRectF(0, 0, bounds_width, bounds_height)
+    bounds.moveCenter(QPointF(capture_pos))
+    return bounds
+
+def resample_rotated_rect_numpy(numpy, image, source_offset, capture_pos, capture_rotation, w, h):
+    # билинейная выборка сразу для всех пикселей результата;
+    # каналы умножены на альфу, поэтому интерполировать их можно независимо
+    image = image.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+    ptr = image.constBits()
+    ptr.setsize(image.bytesPerLine()*image.height())
+    rows = numpy.frombuffer(ptr, numpy.uint8).reshape(image.height(), image.bytesPerLine())
+    source = rows[:, :image.width()*4].reshape(image.height(), image.width(), 4).astype(numpy.float32)
+    # рамка в один прозрачный пиксель, чтобы выборка за краями давала прозрачность
+    source = numpy.pad(source, ((1, 1), (1, 1), (0, 0)))
+
+    angle = math.radians(capture_rotation)
+    cos = math.cos(angle)
+    sin = math.sin(angle)
+    dx, dy = numpy.meshgrid(
+        numpy.arange(w, dtype=numpy.float32) + 0.5 - w/2,
+        numpy.arange(h, dtype=numpy.float32) + 0.5 - h/2,
+    )
+    # центры пикселей результата в координатах исходника (с учётом рамки в один пиксель)
+    source_x = capture_pos.x() - source_offset.x() + cos*dx - sin*dy + 0.5
+    source_y = capture_pos.y() - source_offset.y() + sin*dx + cos*dy + 0.5
+    x0 = numpy.floor(source_x)
+    y0 = numpy.floor(source_y)
+    fx = (source_x - x0)[..., None]
+    fy = (source_y - y0)[..., None]
+    max_x = source.shape[1] - 1
+    max_y = source.shape[0] - 1
+    x0 = numpy.clip(x0.astype(numpy.int32), 0, max_x)
+    y0 = numpy.clip(y0.astype(numpy.int32), 0, max_y)
+    x1 = numpy.clip(x0 + 1, 0, max_x)
+    y1 = numpy.clip(y0 + 1, 0, max_y)
+    top = source[y0, x0]*(1.0 - fx) + source[y0, x1]*fx
+    bottom = source[y1, x0]*(1.0 - fx) + source[y1, x1]*fx
+    result = numpy.ascontiguousarray(numpy.clip(top*(1.0 - fy) + bottom*fy + 0.5, 0, 255).astype(numpy.uint8))
+    output_image = QImage(result.data, w, h, w*4, QImage.Format_ARGB32_Premultiplied)
+    # copy, чтобы картинка не ссылалась на память массива
+    return QPixmap.fromImage(output_image.copy())
+
 def capture_rotated_rect_from_pixmap(pixmap, capture_pos, capture_rotation,
                                                                 capture_width, capture_height):
 
@@ -825,9 +1453,35 @@ def capture_rotated_rect_from_pixmap(pixmap, capture_pos, capture_rotation,
     # и, наверное, проблема не только в этой функции, но и в коде отрисовки
     w = math.ceil(capture_width)
     h = math.ceil(capture_height)
+    capture_pos = QPointF(capture_pos)
+
+    # без поворота и при попадании в целые пиксели это просто вырезка
+    if capture_rotation % 360 == 0:
+        top_left = capture_pos - QPointF(w/2, h/2)
+        crop_rect = QRect(round(top_left.x()), round(top_left.y()), w, h)
+        is_aligned = abs(top_left.x() - crop_rect.x()) < 0.001 and abs(top_left.y() - crop_rect.y()) < 0.001
+        if is_aligned and pixmap.rect().contains(crop_rect):
+            return pixmap.copy(crop_rect)
+
+    # дальше участвует только та часть исходника, которую накрывает повёрнутая рамка
+    bounds = get_rotated_rect_source_bounds(capture_pos, capture_rotation, w, h)
+    source_rect = bounds.toAlignedRect().adjusted(-1, -1, 1, 1).intersected(pixmap.rect())
+    if source_rect.isEmpty():
+        output_pixmap = QPixmap(w, h)
+        output_pixmap.fill(Qt.transparent)
+        return output_pixmap
+
+    try:
+        import numpy
+    except ModuleNotFoundError:
+        numpy = None
+    if numpy is not None:
+        image = pixmap.copy(source_rect).toImage()
+        return resample_rotated_rect_numpy(numpy, image, QPointF(source_rect.topLeft()),
+                                                            capture_pos, capture_rotation, w, h)
+
     output_pixmap = QPixmap(w, h)
     output_pixmap.fill(Qt.transparent)
-    capture_pos
     pr = QPainter()
     pr.begin(output_pixmap)
     pr.setRenderHint(QPainter.HighQualityAntialiasing, True)
@@ -835,7 +1489,7 @@ def capture_rotated_rect_from_pixmap(pixmap, capture_pos, capture_rotation,
     pr.setRenderHint(QPainter.SmoothPixmapTransform, True)
     pr.translate(w/2, h/2)
     pr.rotate(-capture_rotation)
-    pr.drawPixmap(-capture_pos, pixmap)
+    pr.drawPixmap(QPointF(source_rect.topLeft()) - capture_pos, pixmap, QRectF(source_rect))
     pr.end()
 
     return output_pixmap
@@ -0,0 +1,84 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+#  Author: Sergei Krumas (github.com/sergkrumas)
+#
+# ##### END GPL LICENSE BLOCK #####
+
+import sys
+import time
+import random
+
+from PyQt5.QtCore import QPointF
+from PyQt5.QtGui import QVector2D
+
+from elements_tools2024 import ArrowsTreeNodesGrid
+
+# Сравнивает поиск ближайшего узла дерева стрелок через сетку с простым перебором,
+# в том числе когда курсор очень далеко от всех узлов.
+# Если результаты расходятся или поиск дольше бюджета, то скрипт завершается с ненулевым кодом.
+
+NODES_COUNT = 500
+# узлы разбросаны по области такого размера
+NODES_AREA_SIZE = 5000
+# расстояния от области узлов до курсора
+CURSOR_DISTANCES = (0, 1000, 10000, 20000, 100000)
+LOOKUPS_COUNT = 100
+# бюджет на один поиск в миллисекундах
+LOOKUP_BUDGET_MSEC = 5.0
+
+class Node():
+    def __init__(self, position):
+        self.position = position
+
+def nearest_linear(nodes, pos):
+    return min(nodes, key=lambda node: QVector2D(pos - node.position).length())
+
+def scan(budget_msec=LOOKUP_BUDGET_MSEC):
+    random.seed(0)
+    nodes = [Node(QPointF(random.uniform(0, NODES_AREA_SIZE), random.uniform(0, NODES_AREA_SIZE)))
+                                                                    for _ in range(NODES_COUNT)]
+    grid = ArrowsTreeNodesGrid(nodes)
+    failed = False
+    for distance in CURSOR_DISTANCES:
+        cursors = [QPointF(NODES_AREA_SIZE + distance + random.uniform(0, 100),
+                                random.uniform(-distance, NODES_AREA_SIZE + distance))
+                                                                    for _ in range(LOOKUPS_COUNT)]
+        start_time = time.perf_counter()
+        found = [grid.nearest(pos) for pos in cursors]
+        lookup_msec = (time.perf_counter() - start_time)*1000/LOOKUPS_COUNT
+        mismatches = 0
+        for pos, node in zip(cursors, found):
+            expected = nearest_linear(nodes, pos)
+            if QVector2D(pos - node.position).length() != QVector2D(pos - expected.position).length():
+                mismatches += 1
+        print(f'расстояние {distance}: {lookup_msec:.3f} мс на поиск')
+        if mismatches:
+            failed = True
+            print(f'    [!] {mismatches} результатов не совпадают с перебором')
+        if lookup_msec > budget_msec:
+            failed = True
+            print(f'    [!] поиск дольше бюджета {budget_msec} мс')
+    if failed:
+        print('\nПроверка провалена')
+        sys.exit(1)
+    print('\nПроверка пройдена')
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        scan(budget_msec=float(sys.argv[1]))
+    else:
+        scan()
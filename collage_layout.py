@@ -0,0 +1,140 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+#  Author: Sergei Krumas (github.com/sergkrumas)
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Раскладка коллажей на чистых числах: на вход подаётся список соотношений сторон (ширина/высота),
+# на выходе список прямоугольников (x, y, width, height) в том же порядке.
+# Модуль ничего не знает про Qt и элементы редактора, поэтому его легко гонять отдельно.
+
+import math
+
+# ряд, который сжался ниже этой доли от целевой высоты, дальше не наращиваем:
+# каждая следующая картинка делает его только ниже
+MIN_ROW_HEIGHT_FACTOR = 0.5
+
+def get_row_height(prefix_sums, start, end, width, spacing):
+    free_width = width - spacing*(end - start - 1)
+    aspect_sum = prefix_sums[end] - prefix_sums[start]
+    if free_width <= 0 or aspect_sum <= 0:
+        return 0.0
+    return free_width/aspect_sum
+
+def justified_rows(aspect_ratios, width, row_height, spacing=0.0, justify_last_row=True,
+                                                                        max_row_length=None):
+    """
+        Splits the sequence into rows of the given width, so every row height
+        is as close as possible to row_height. Linear partition solved
+        with dynamic programming over prefix sums of aspect ratios.
+        Returns list of (start, end) ranges
+    """
+    count = len(aspect_ratios)
+    if count == 0:
+        return []
+    prefix_sums = [0.0]
+    for aspect_ratio in aspect_ratios:
+        prefix_sums.append(prefix_sums[-1] + aspect_ratio)
+    max_row_length = max_row_length or count
+
+    costs = [math.inf]*(count + 1)
+    breaks = [0]*(count + 1)
+    costs[0] = 0.0
+    min_height = row_height*MIN_ROW_HEIGHT_FACTOR
+    for start in range(count):
+        start_cost = costs[start]
+        start_sum = prefix_sums[start]
+        free_width = width + spacing
+        for end in range(start + 1, min(count, start + max_row_length) + 1):
+            # тело цикла развёрнуто вручную вместо get_row_height, это самое горячее место
+            free_width -= spacing
+            aspect_sum = prefix_sums[end] - start_sum
+            if free_width <= 0 or aspect_sum <= 0:
+                break
+            height = free_width/aspect_sum
+            if end == count and not justify_last_row and height > row_height:
+                # последний ряд не растягиваем, он выводится с целевой высотой
+                cost = start_cost
+            else:
+                deviation = (height - row_height)/row_height
+                cost = start_cost + deviation*deviation
+            if cost < costs[end]:
+                costs[end] = cost
+                breaks[end] = start
+            if height < min_height:
+                break
+
+    rows = []
+    end = count
+    while end > 0:
+        start = breaks[end]
+        rows.append((start, end))
+        end = start
+    rows.reverse()
+    return rows
+
+def layout_justified_rows(aspect_ratios, width, row_height, spacing=0.0, justify_last_row=True,
+                                                                        max_row_length=None):
+    rows = justified_rows(aspect_ratios, width, row_height, spacing=spacing,
+                    justify_last_row=justify_last_row, max_row_length=max_row_length)
+    prefix_sums = [0.0]
+    for aspect_ratio in aspect_ratios:
+        prefix_sums.append(prefix_sums[-1] + aspect_ratio)
+    rects = []
+    y = 0.0
+    for start, end in rows:
+        height = get_row_height(prefix_sums, start, end, width, spacing)
+        if end == len(aspect_ratios) and not justify_last_row:
+            height = min(height, row_height)
+        x = 0.0
+        for aspect_ratio in aspect_ratios[start:end]:
+            item_width = aspect_ratio*height
+            rects.append((x, y, item_width, height))
+            x += item_width + spacing
+        y += height + spacing
+    return rects
+
+def layout_columns(aspect_ratios, width, columns_count, spacing=0.0):
+    """
+        Masonry layout: columns of equal width, every next item goes
+        to the lowest column
+    """
+    columns_count = max(1, min(columns_count, len(aspect_ratios)))
+    column_width = (width - spacing*(columns_count - 1))/columns_count
+    columns_heights = [0.0]*columns_count
+    rects = []
+    for aspect_ratio in aspect_ratios:
+        column = columns_heights.index(min(columns_heights))
+        item_height = column_width/aspect_ratio
+        x = column*(column_width + spacing)
+        rects.append((x, columns_heights[column], column_width, item_height))
+        columns_heights[column] += item_height + spacing
+    return rects
+
+def get_grid_columns_count(items_count, rows_count, columns_count):
+    # число рядов переводится в число картинок в ряду, дальше и ряды, и колонки
+    # считаются от него одинаково; rows_count == 0 значит, что задано число колонок
+    if rows_count != 0:
+        return max(1, int(math.ceil(items_count/rows_count)))
+    return max(1, columns_count)
+
+def get_width_for_columns_count(aspect_ratios, row_height, columns_count):
+    # ширина, при которой в среднем ряду будет примерно columns_count картинок
+    if not aspect_ratios:
+        return 0.0
+    average_aspect_ratio = sum(aspect_ratios)/len(aspect_ratios)
+    return average_aspect_ratio*row_height*max(1, columns_count)
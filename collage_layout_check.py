@@ -0,0 +1,107 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+#  Author: Sergei Krumas (github.com/sergkrumas)
+#
+# ##### END GPL LICENSE BLOCK #####
+
+import sys
+
+from collage_layout import (layout_justified_rows, layout_columns, get_grid_columns_count,
+    get_width_for_columns_count)
+
+# Проверяет раскладку коллажей на нескольких образцах так же, как её вызывает elementsArrangeInGrid:
+# все картинки на месте, не перекрываются, ряды ровно по ширине, а число картинок в ряду
+# одинаково считается из заданного числа рядов и для рядов, и для колонок.
+# Если что-то не так, то скрипт завершается с ненулевым кодом.
+
+EPSILON = 1e-6
+
+# (название, соотношения сторон, ROWS, COLS, раскладка колонками)
+SAMPLES = (
+    ('одна картинка', [1.5], 0, 3, False),
+    ('колонки заданы числом', [1.0, 0.5, 2.0, 1.5, 0.75, 1.0, 1.33], 0, 3, False),
+    ('ряды заданы числом', [1.0, 0.5, 2.0, 1.5, 0.75, 1.0, 1.33], 2, 0, False),
+    ('колонки из числа рядов', [1.0, 0.5, 2.0, 1.5, 0.75, 1.0, 1.33], 2, 0, True),
+    ('колонки из числа колонок', [1.0, 0.5, 2.0, 1.5, 0.75, 1.0, 1.33], 0, 3, True),
+    ('узкие и широкие', [0.1, 10.0, 0.2, 5.0, 1.0]*20, 5, 0, False),
+)
+
+def layout(aspect_ratios, rows_count, columns_count, columns, row_height=100.0):
+    columns_count = get_grid_columns_count(len(aspect_ratios), rows_count, columns_count)
+    width = get_width_for_columns_count(aspect_ratios, row_height, columns_count)
+    if columns:
+        return layout_columns(aspect_ratios, width, columns_count), width, columns_count
+    return layout_justified_rows(aspect_ratios, width, row_height), width, columns_count
+
+def intersects(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    return ax + aw > bx + EPSILON and bx + bw > ax + EPSILON and \
+                                    ay + ah > by + EPSILON and by + bh > ay + EPSILON
+
+def check_sample(aspect_ratios, rows_count, columns_count, columns):
+    errors = []
+    rects, width, count = layout(aspect_ratios, rows_count, columns_count, columns)
+    if len(rects) != len(aspect_ratios):
+        errors.append(f'картинок {len(aspect_ratios)}, прямоугольников {len(rects)}')
+        return errors
+    for n, (aspect_ratio, (x, y, w, h)) in enumerate(zip(aspect_ratios, rects)):
+        if w <= 0 or h <= 0:
+            errors.append(f'#{n}: пустой прямоугольник')
+        elif abs(w/h - aspect_ratio) > EPSILON*max(1.0, aspect_ratio):
+            errors.append(f'#{n}: соотношение сторон {w/h:.4f} вместо {aspect_ratio:.4f}')
+        if x < -EPSILON or x + w > width + EPSILON:
+            errors.append(f'#{n}: выходит за ширину {width:.1f}')
+    for i in range(len(rects)):
+        for j in range(i + 1, len(rects)):
+            if intersects(rects[i], rects[j]):
+                errors.append(f'#{i} и #{j} перекрываются')
+    if columns:
+        columns_used = len(set(round(x, 3) for x, y, w, h in rects))
+        if columns_used != min(count, len(aspect_ratios)):
+            errors.append(f'колонок {columns_used} вместо {count}')
+    else:
+        rows = dict()
+        for x, y, w, h in rects:
+            rows.setdefault(round(y, 3), []).append(x + w)
+        for y, right_edges in rows.items():
+            if abs(max(right_edges) - width) > EPSILON*width:
+                errors.append(f'ряд на высоте {y}: ширина {max(right_edges):.1f} вместо {width:.1f}')
+    return errors
+
+def scan():
+    failed = False
+    for name, aspect_ratios, rows_count, columns_count, columns in SAMPLES:
+        errors = check_sample(aspect_ratios, rows_count, columns_count, columns)
+        print(f'{name}: {"ошибок нет" if not errors else "ошибки"}')
+        for error in errors:
+            failed = True
+            print(f'    [!] {error}')
+    # заданное число рядов даёт одинаковое число картинок в ряду для рядов и для колонок
+    for rows_count in range(1, 8):
+        rows_width = layout([1.0]*7, rows_count, 0, False)[1]
+        columns_width = layout([1.0]*7, rows_count, 0, True)[1]
+        if abs(rows_width - columns_width) > EPSILON:
+            failed = True
+            print(f'    [!] ROWS={rows_count}: ширина рядов {rows_width} и колонок {columns_width} разная')
+    if failed:
+        print('\nПроверка провалена')
+        sys.exit(1)
+    print('\nПроверка пройдена')
+
+if __name__ == '__main__':
+    scan()
@@ -0,0 +1,139 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+#  Author: Sergei Krumas (github.com/sergkrumas)
+#
+# ##### END GPL LICENSE BLOCK #####
+
+import os
+import sys
+import time
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from _utils import download_url_to_folder
+
+# Проверяет скачивание ссылок через download_url_to_folder на локальном http-сервере:
+# удачную закачку, ошибку HTTP, страницу вместо картинки и отмену посреди закачки.
+# После каждой проверки в папке не должно оставаться недокачанных файлов .part.
+# Если что-то не так, то скрипт завершается с ненулевым кодом.
+
+# минимальный PNG размером 1x1
+PNG_DATA = bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+    '1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082'
+)
+# медленная закачка: столько порций с паузой между ними
+SLOW_CHUNKS_COUNT = 50
+SLOW_CHUNK_DELAY_SEC = 0.1
+# отмена должна срабатывать быстрее, чем за это время
+CANCEL_BUDGET_SEC = 2.0
+
+slow_download_started = threading.Event()
+
+class Handler(BaseHTTPRequestHandler):
+
+    def send_data(self, content_type, data):
+        self.send_response(200)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/image.png':
+            self.send_data('image/png', PNG_DATA)
+        elif self.path == '/octet-stream':
+            self.send_data('application/octet-stream', PNG_DATA)
+        elif self.path == '/page.html':
+            self.send_data('text/html; charset=utf-8', b'<html><body>not an image</body></html>')
+        elif self.path == '/slow.png':
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.end_headers()
+            try:
+                for n in range(SLOW_CHUNKS_COUNT):
+                    self.wfile.write(PNG_DATA)
+                    self.wfile.flush()
+                    slow_download_started.set()
+                    time.sleep(SLOW_CHUNK_DELAY_SEC)
+            except OSError:
+                # клиент закрыл соединение после отмены
+                pass
+        else:
+            self.send_error(404)
+
+    def log_message(self, format, *args):
+        pass
+
+def check_download(url, folder_path, name, expected_filename, **kwargs):
+    errors = []
+    filepath = download_url_to_folder(url, folder_path, name, timeout=5, **kwargs)
+    if expected_filename is None:
+        if filepath is not None:
+            errors.append(f'ожидался отказ, а скачан {filepath}')
+    elif filepath is None:
+        errors.append('файл не скачан')
+    elif os.path.basename(filepath) != expected_filename:
+        errors.append(f'имя файла {os.path.basename(filepath)} вместо {expected_filename}')
+    else:
+        with open(filepath, 'rb') as file:
+            if file.read() != PNG_DATA:
+                errors.append('содержимое файла не совпадает')
+    leftovers = [f for f in os.listdir(folder_path) if f.endswith('.part')]
+    if leftovers:
+        errors.append(f'остались недокачанные файлы: {", ".join(leftovers)}')
+    return errors
+
+def scan():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    root_url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    def cancel_after_start():
+        return slow_download_started.is_set()
+
+    checks = (
+        ('картинка', '/image.png', 'image.png', {}),
+        ('картинка без типа', '/octet-stream', 'octet.png', {}),
+        ('ошибка HTTP', '/missing.png', None, {}),
+        ('страница вместо картинки', '/page.html', None, {}),
+        ('отмена', '/slow.png', None, {'is_cancelled': cancel_after_start}),
+    )
+    failed = False
+    with tempfile.TemporaryDirectory() as folder_path:
+        for title, path, expected_filename, kwargs in checks:
+            name = os.path.splitext(expected_filename or path.strip('/'))[0]
+            start_time = time.perf_counter()
+            errors = check_download(f'{root_url}{path}', folder_path, name, expected_filename, **kwargs)
+            duration = time.perf_counter() - start_time
+            if 'is_cancelled' in kwargs and duration > CANCEL_BUDGET_SEC:
+                errors.append(f'отмена заняла {duration:.1f} с')
+            print(f'{title}: {duration*1000:.0f} мс')
+            for error in errors:
+                failed = True
+                print(f'    [!] {error}')
+    server.shutdown()
+    if failed:
+        print('\nПроверка провалена')
+        sys.exit(1)
+    print('\nПроверка пройдена')
+
+if __name__ == '__main__':
+    scan()
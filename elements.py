@@ -24,7 +24,6 @@ import sys
 import os
 import json
 import time
-import cbor2
 
 from PyQt5.QtWidgets import (QMenu, QFileDialog, QApplication, QDesktopWidget)
 from PyQt5.QtCore import (QPoint, QPointF, QRect, Qt, QSize, QSizeF, QRectF, QFile, QDataStream,
@@ -35,13 +34,18 @@ from PyQt5.QtGui import (QPainterPath, QColor, QBrush, QPixmap, QPainter, QImage
 from _utils import (convex_hull, calculate_tangent_points, build_valid_rect, build_valid_rectF,
     get_nearest_point_on_rect, capture_rotated_rect_from_pixmap, squarize_rect, fit_rect_into_rect,
     constraint45Degree, get_bounding_pointsF, load_svg, is_webp_file_animated,
-                                                            apply_blur_effect, get_rect_corners)
+    apply_blur_effect, get_rect_corners, load_image_region_respect_orientation, AnimatedFrameSource)
 
+from collage_layout import (layout_justified_rows, layout_columns, get_grid_columns_count,
+    get_width_for_columns_count)
 from elements_transform import ElementsTransformMixin
 from elements_textedit import ElementsTextEditElementMixin
 from elements_tools2024 import Elements2024ToolsMixin, Element2024Mixin
 
 ZOOM_IN_REGION_DAFAULT_SCALE = 1.5
+# запас вокруг пометок при дорисовке их на фон: обводки, тени и наконечники стрелок
+# выходят за пределы области выделения
+FLATTEN_DIRTY_RECT_MARGIN = 50
 
 class ToolID():
     none = "none"
@@ -83,6 +87,11 @@ class CreateBackgroundOption():
     Reshoot = 2
     ContentToBackground = 3
 
+class PictureLOD():
+    full = 0
+    thumbnail = 1
+    color = 2
+
 class Element(Element2024Mixin):
 
     def __init__(self, oxxxy_element_type, elements_list, skip=False):
@@ -116,6 +125,17 @@ class Element(Element2024Mixin):
         self.backup_pixmap = None
         self.frame_info = None
         self.background_image = False
+        # видимая часть pixmap в виде кортежа (x, y, w, h), если картинка не вырезана из pixmap,
+        # а только ссылается на общий для нескольких элементов pixmap
+        self.pixmap_source_rect = None
+
+        # для картинок, загруженных уменьшенной копией: путь к оригиналу, его размер
+        # и видимая часть в координатах оригинала, всё это в виде кортежей
+        self.source_filepath = None
+        self.source_size = None
+        self.source_frame_rect = None
+        # номер кадра, если картинка взята из GIF или анимированного WebP
+        self.source_frame_index = None
 
         self.opacity = 1.0
         self.color = QColor(0, 0, 0)
@@ -130,6 +150,7 @@ class Element(Element2024Mixin):
         self.text_doc = None
         self.draw_transform = None
         self.proxy_pixmap = None
+        self.proxy_pixmap_key = None
 
         self.selection_path = None
 
@@ -229,8 +250,15 @@ class Element(Element2024Mixin):
         self.height = bb.height()
 
     def calc_local_data_picture(self):
-        self.width = self.pixmap.width()
-        self.height = self.pixmap.height()
+        if self.source_frame_rect is not None:
+            self.width = self.source_frame_rect[2]
+            self.height = self.source_frame_rect[3]
+        elif self.pixmap_source_rect is not None:
+            self.width = self.pixmap_source_rect[2]
+            self.height = self.pixmap_source_rect[3]
+        else:
+            self.width = self.pixmap.width()
+            self.height = self.pixmap.height()
 
     def calc_local_data(self):
         if self.oxxxy_type in [ToolID.line]:
@@ -438,6 +466,18 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
         self._ted = Element(ToolID.line, None, skip=True)
         self.modification_slots = []
         self.elements_modification_index = 0
+        # источники кадров прошлого проекта больше не нужны
+        for frame_source in getattr(self, 'animated_frame_sources', dict()).values():
+            try:
+                frame_source.frame_ready.disconnect()
+            except TypeError:
+                # кадры этого источника так никому и не понадобились
+                pass
+            frame_source.stop()
+        self.animated_frame_sources = dict()
+        # элементы, ждущие свой кадр: cacheKey заглушки -> номер кадра -> список элементов
+        self.animated_frame_placeholders = dict()
+        self.multiframing_frames_cache = dict()
         self.SelectionFilter = SelectionFilter
         self.selection_filter = self.SelectionFilter.content_only
         self._active_element = None #active element is the last selected element
@@ -448,12 +488,23 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
         self.elementsTextElementInitModule()
 
         self.show_sort_indexes_on_pixmaps = False
+        # упрощённая отрисовка мелких картинок включена только в режиме коллажа
+        self.collage_mode = False
+        # уровни детализации картинок при отрисовке на экране
+        self.pictures_lod_levels = dict()
+        self.pictures_lod_thumbnails = dict()
+        # состояние фона, которому в точности соответствует source_pixels
+        self.source_pixels_background_key = None
 
         self.modification_stamp = None
 
         self.capture_region_widget_enabled = True
         self.show_background = True
         self.dark_pictures = True
+        # объединённая область затемнения в координатах холста,
+        # пересобирается только при изменении набора или геометрии пометок затемнения
+        self.darkening_zone_cache_key = None
+        self.darkening_zone_cache = None
 
         self.wallpaper_env_value = 0
 
@@ -569,85 +620,83 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
             bckg_element.calc_local_data()
             bckg_element.position = QPointF(new_background_pixmap.width()/2, new_background_pixmap.height()/2) + offset
 
-    def elementsArrangeInGrid(self):
-
-        ROWS = self.Globals.ARRANGE_ROWS
-        COLS = self.Globals.ARRANGE_COLS
+        self.source_pixels_background_key = self.elementsGetBackgroundKey()
 
-        elements = self.elementsFilterElementsForSelection()
-        for el in elements:
-            el.scale_x = 1.0
-            el.scale_y = 1.0
+    def elementsGetBackgroundKey(self):
+        # по этому ключу видно, что фон с тех пор не двигали, не нарезали и не заменяли
+        key = []
+        for el in self.elementsFilter():
+            if el.background_image:
+                key.append((el.unique_index, el.pixmap.cacheKey(), el.pixmap_source_rect,
+                        el.position.x(), el.position.y(), el.scale_x, el.scale_y, el.rotation))
+        return tuple(key)
 
-        # выделенное может повлиять на команду elementsAutoCollagePicturesHor, а нам этого не надо
-        self.elementsSetSelected([])
+    def elementsArrangeInGrid(self, columns=False):
 
-        # вызываем для выравнивания по высоте:
-        # каждая картинка будет отмасштабирована до высоты картинки с наибольшей высотой
-        self.elementsAutoCollagePicturesHor()
+        ROWS = self.Globals.ARRANGE_ROWS
+        COLS = self.Globals.ARRANGE_COLS
 
         # фильтрация по типу выделения
         elements = self.elementsFilterElementsForSelection()
         elements = list(sorted(elements, key=lambda x: x.unique_index))
+        if not elements:
+            return
+        self.collage_mode = True
 
+        # все перестановки идут в одну запись истории
+        self.elementsStartModificationProcess('arranging')
+        elements = [self.elementsPrepareElementCopyForModifications(el) for el in elements]
+        self.elementsStopModificationProcess()
 
-        if ROWS != 0:
-            COLS = int(math.ceil(len(elements) / ROWS))
-
-        rows = []
-        current_row = []
-        for n, el in enumerate(elements):
-            if (n % COLS == 0) and n != 0:
-
-                rows.append(current_row)
-                current_row = []
-            current_row.append(el)
-
-        rows.append(current_row)
-
-        # calculating MAX_ROW_WIDTH
-        MAX_ROW_WIDTH = 0
-        for row in rows:
-            row_width = 0
-            for el in row:
-                b_rect = el.get_selection_area(canvas=self, apply_global_scale=False).boundingRect()
-                row_width += b_rect.width()
-            MAX_ROW_WIDTH = max(row_width, MAX_ROW_WIDTH)
-
-        # задание масштаба для каждого ряда
-        for row in rows:
-            row_width = 0
-            for el in row:
-                b_rect = el.get_selection_area(canvas=self, apply_global_scale=False).boundingRect()
-                row_width += b_rect.width()
-            row_scale_factor = MAX_ROW_WIDTH/row_width
-            for el in row:
-                el.scale_x *= row_scale_factor
-                el.scale_y *= row_scale_factor
-
-        # расположение
-        offset = QPointF(0, 0)
-        points = []
-        for row in rows:
-            for el in row:
-                b_rect = el.get_selection_area(canvas=self, apply_global_scale=False).boundingRect()
-                bi_width = b_rect.width()
-                bi_height = b_rect.height()
-                half_size = QPointF(bi_width/2, bi_height/2)
-                el.position = offset + half_size
+        # размеры в единичном масштабе с учётом поворота, считаем один раз для каждого элемента
+        base_sizes = []
+        arranged_elements = []
+        for el in elements:
+            scale_x, scale_y = el.scale_x, el.scale_y
+            # supporting image mirroring for both X and Y axes
+            el.scale_x = math.copysign(1.0, el.scale_x)
+            el.scale_y = math.copysign(1.0, el.scale_y)
+            b_rect = el.get_canvas_space_selection_area().boundingRect()
+            # масштаб элемента нулевой ширины или высоты из раскладки не вычислить, его не трогаем
+            if b_rect.width() <= 0 or b_rect.height() <= 0:
+                el.scale_x, el.scale_y = scale_x, scale_y
+                continue
+            base_sizes.append((b_rect.width(), b_rect.height()))
+            arranged_elements.append(el)
+        elements = arranged_elements
+        if not elements:
+            self.update()
+            return
+        aspect_ratios = [w/h for w, h in base_sizes]
 
-                offset += QPointF(bi_width, 0)
+        # за целевую высоту ряда берём высоту самой высокой картинки
+        row_height = max(h for w, h in base_sizes)
+        # и для рядов, и для колонок ширина считается от числа картинок в ряду
+        columns_count = get_grid_columns_count(len(elements), ROWS, COLS)
+        width = get_width_for_columns_count(aspect_ratios, row_height, columns_count)
 
-                points.append(el.position - half_size)
-                points.append(el.position + half_size)
+        if columns:
+            rects = layout_columns(aspect_ratios, width, columns_count)
+        else:
+            rects = layout_justified_rows(aspect_ratios, width, row_height)
 
-            offset.setX(0)
-            offset.setY(offset.y() + bi_height)
+        points = []
+        for el, (w, h), (x, y, rect_width, rect_height) in zip(elements, base_sizes, rects):
+            scale = rect_width / w
+            el.scale_x = math.copysign(scale, el.scale_x)
+            el.scale_y = math.copysign(scale, el.scale_y)
+            el.position = QPointF(x + rect_width/2, y + rect_height/2)
+            points.append(QPointF(x, y))
+            points.append(QPointF(x + rect_width, y + rect_height))
 
         self.input_POINT2, self.input_POINT1 = get_bounding_pointsF(points)
         self.capture_region_rect = build_valid_rectF(self.input_POINT1, self.input_POINT2)
 
-
+        self.elementsSetSelected(None)
+        tw = self.tools_window
+        if tw:
+            tw.forwards_backwards_update()
+        self.update_tools_window()
         self.prepare_selection_box_widget()
         self.update()
 
@@ -693,12 +742,14 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
                     y2/background_pixmap.height(),
                 )
 
+                # куски не копируют пиксели, а ссылаются на общую картинку,
+                # поэтому и в файл проекта она попадёт только один раз
                 self.elementsFramePicture(element=bckg_el,
                     frame_rect=frame_rect,
                     frame_info=frame_info,
-                    pixmap=bckg_el.pixmap,
+                    share_pixmap=True,
+                    set_selected=False,
                 )
-                bckg_el.backup_pixmap = None # зануляем, чтобы сохрание в файл не растягивалось на 100 лет
 
                 pos_x = x1 + col_width/2
                 pos_y = y1 + row_height/2
@@ -850,6 +901,10 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
         data.update({'hex_mask':                   self.hex_mask                                })
 
 
+        # сохранение режима коллажа
+        data.update({'collage_mode':               self.collage_mode                            })
+
+
         # сохранение области захвата
         if self.capture_region_rect is not None:
             r = self.capture_region_rect
@@ -875,6 +930,13 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
         # сохранение зума холста
         data.update({'canvas_scale':      tuple((self.canvas_scale_x, self.canvas_scale_y))     })
 
+        # одна и та же картинка может быть у многих элементов:
+        # у копий в истории действий и у кусков нарезанного фона, пишем её на диск один раз
+        saved_pixmaps = dict()
+        # у картинок, загруженных уменьшенной копией, в проект копируется и оригинал,
+        # иначе на другой машине или после переноса файла итог будет в низком разрешении
+        saved_sources = dict()
+
         slots_to_store = list()
         # сохранение слотов
         for slot in self.modification_slots:
@@ -917,6 +979,22 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
                     elif attr_name == '_saved_data' and isinstance(attr_value, tuple):
                         continue
 
+                    elif attr_name in ('proxy_pixmap', 'proxy_pixmap_key'):
+                        # кэш отрисовки текста пересоздаётся сам после загрузки
+                        continue
+
+                    elif attr_name == 'source_filepath' and attr_value is not None:
+                        attr_data = saved_sources.get(attr_value, None)
+                        if attr_data is None:
+                            attr_data = attr_value
+                            if os.path.exists(attr_value):
+                                import shutil
+                                ext = os.path.splitext(attr_value)[1]
+                                filename = f"source_{element.unique_index:04}{ext}"
+                                shutil.copy2(attr_value, os.path.join(folder_path, filename))
+                                attr_data = filename
+                            saved_sources[attr_value] = attr_data
+
                     elif isinstance(attr_value, (bool, int, float, str, tuple, list)):
                         attr_data = attr_value
 
@@ -930,9 +1008,12 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
                         attr_data = filename
 
                     elif isinstance(attr_value, QPixmap):
-                        filename = f"pixmap_{attr_name}_{element.unique_index:04}.png"
-                        filepath = os.path.join(folder_path, filename)
-                        attr_value.save(filepath)
+                        filename = saved_pixmaps.get(attr_value.cacheKey(), None)
+                        if filename is None:
+                            filename = f"pixmap_{attr_name}_{element.unique_index:04}.png"
+                            filepath = os.path.join(folder_path, filename)
+                            attr_value.save(filepath)
+                            saved_pixmaps[attr_value.cacheKey()] = filename
                         attr_data = filename
 
                     elif isinstance(attr_value, QColor):
@@ -956,6 +1037,7 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
 
         # ЗАПИСЬ В ФАЙЛ НА ДИСКЕ
         if self.Globals.ENABLE_CBOR2:
+            import cbor2
             data_to_write = cbor2.dumps(data)
             with open(project_filepath, "wb") as file:
                 file.write(data_to_write)
@@ -984,10 +1066,9 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
         return data[0]
 
     # при написании и отладке этой функции использовался готовый проект, который загружался сразу
-    def open_project(self):
-        project_filepath = ""
-
-        project_filepath = self.dialog_open_project()
+    def open_project(self, project_filepath=None, notify=True):
+        if project_filepath is None:
+            project_filepath = self.dialog_open_project()
         if project_filepath == "":
             return
 
@@ -995,7 +1076,8 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
         is_file_extension_ok = project_filepath.lower().endswith(".oxxxyshot")
         is_file = os.path.isfile(project_filepath)
         if not (is_file_exists and is_file_extension_ok and is_file):
-            self.show_notify_dialog("Ошибка: либо файла не существует, либо расширение не то. Отмена!")
+            if notify:
+                self.show_notify_dialog("Ошибка: либо файла не существует, либо расширение не то. Отмена!")
             return
 
         # чтение json
@@ -1008,6 +1090,7 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
             with open(project_filepath, "rb") as file:
                 read_data = file.read()
 
+            import cbor2
             data = cbor2.loads(read_data)
             cbor2_project = True
 
@@ -1024,7 +1107,8 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
                 json_project = True
 
             except:
-                self.show_notify_dialog("Ошибка при чтении файла. Отмена!")
+                if notify:
+                    self.show_notify_dialog("Ошибка при чтении файла. Отмена!")
                 return
 
         # подготовка перед загрузкой данных
@@ -1055,6 +1139,8 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
         # загрузка исходной немодифицированной картинки-фона
         image_path = os.path.join(folder_path, "background.png")
         self.source_pixels = QImage(image_path)
+        # соответствие фону неизвестно, первое сведение в фон будет полным
+        self.source_pixels_background_key = None
 
 
 
@@ -1073,6 +1159,10 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
         self.hex_mask = data.get('hex_mask', False)
 
 
+        # загрузка режима коллажа
+        self.collage_mode = data.get('collage_mode', False)
+
+
         # загрузка области захвата
         rect_tuple = data.get('capture_region_rect', (0, 0, 0, 0))
         if rect_tuple == (0, 0, 0, 0):
@@ -1104,6 +1194,8 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
 
         # загрузка слотов, элементов и их данных
         slots_from_store = data.get('slots', [])
+        # общие для нескольких элементов картинки загружаются один раз и остаются общими
+        loaded_pixmaps = dict()
 
         for slot_attributes in slots_from_store:
 
@@ -1134,6 +1226,10 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
                     elif attr_type in ['QPointF']:
                         attr_value = QPointF(*attr_data)
 
+                    elif attr_name == 'source_filepath' and attr_type == 'str':
+                        # оригинал лежит в папке проекта, в старых проектах это абсолютный путь
+                        attr_value = os.path.join(folder_path, attr_data)
+
                     elif attr_type in ['bool', 'int', 'float', 'str', 'tuple', 'list']:
                         attr_value = attr_data
 
@@ -1147,8 +1243,10 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
                         attr_value = path
 
                     elif attr_type in ['QPixmap']:
-                        filepath = os.path.join(folder_path, attr_data)
-                        attr_value = QPixmap(filepath)
+                        attr_value = loaded_pixmaps.get(attr_data, None)
+                        if attr_value is None:
+                            filepath = os.path.join(folder_path, attr_data)
+                            attr_value = loaded_pixmaps[attr_data] = QPixmap(filepath)
 
                     elif attr_type in ['QColor']:
                         attr_value = QColor()
@@ -1178,7 +1276,16 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
             project_format = 'json'
 
         msg = f'Файл загружен, формат {project_format}'
-        self.show_notify_dialog(msg)
+        missing_sources = set(el.source_filepath for el in self.elementsFilter()
+                    if getattr(el, 'source_filepath', None) and not os.path.exists(el.source_filepath))
+        if missing_sources:
+            msg += (f'\nНе найдено оригиналов: {len(missing_sources)}, '
+                                        'такие картинки попадут в итог уменьшенными копиями')
+            if not notify:
+                print(f'missing source files: {", ".join(sorted(missing_sources))}')
+        if notify:
+            self.show_notify_dialog(msg)
+        return True
 
     def elementsMapToCanvas(self, viewport_pos):
         delta = QPointF(viewport_pos - self.canvas_origin)
@@ -1239,22 +1346,33 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
             if hasattr(element, 'second') and not element.second:
                 self.elementsSetCopiedPixmap(element)
 
-    def elementsFramePicture(self, element=None, frame_rect=None, frame_info=None, pixmap=None, set_selected=True):
+    def elementsFramePicture(self, element=None, frame_rect=None, frame_info=None, pixmap=None,
+                                                        set_selected=True, share_pixmap=False):
         if element is not None:
             ae = element
         else:
             ae = self.active_element
+        # однажды нарезанная без копирования картинка так и продолжает ссылаться на общий pixmap
+        share_pixmap = share_pixmap or ae.pixmap_source_rect is not None
         if frame_rect:
             if ae.backup_pixmap is None:
                 ae.backup_pixmap = ae.pixmap
             if pixmap is not None:
                 ae.pixmap = pixmap.copy(frame_rect)
+                ae.pixmap_source_rect = None
+            elif share_pixmap:
+                ae.pixmap = ae.backup_pixmap
+                ae.pixmap_source_rect = (frame_rect.x(), frame_rect.y(),
+                                                        frame_rect.width(), frame_rect.height())
             else:
                 ae.pixmap = ae.backup_pixmap.copy(frame_rect)
         else:
             # reset
             ae.pixmap = ae.backup_pixmap
             ae.backup_pixmap = None
+            ae.pixmap_source_rect = None
+        if ae.source_size is not None:
+            self.elementsFramePictureSource(ae, frame_rect, pixmap)
         ae.frame_info = frame_info
         ae.calc_local_data()
         ae.scale_x = 1.0
@@ -1283,6 +1401,85 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
             tw.on_parameters_changed()
             self.activateWindow()
 
+    def elementsFramePictureSource(self, element, frame_rect, pixmap):
+        if frame_rect and pixmap is not None:
+            # изображение пришло из просмотрщика уже изменённым, связь с оригиналом теряется
+            self.show_notify_dialog('Изображение изменено в просмотрщике, поэтому в итог '
+                                            'попадёт его уменьшенная копия, а не оригинал')
+            element.source_filepath = None
+            element.source_size = None
+            element.source_frame_rect = None
+            element.source_frame_index = None
+        elif frame_rect:
+            # рамка задана в координатах уменьшенной копии
+            source_width, source_height = element.source_size
+            kx = source_width/element.backup_pixmap.width()
+            ky = source_height/element.backup_pixmap.height()
+            element.source_frame_rect = (
+                frame_rect.x()*kx,
+                frame_rect.y()*ky,
+                frame_rect.width()*kx,
+                frame_rect.height()*ky,
+            )
+        else:
+            element.source_frame_rect = (0, 0, *element.source_size)
+
+    def elementsLoadPictureSource(self, element):
+        # оригинал читается с диска только для финальной отрисовки,
+        # причём сразу в том размере, в котором он попадёт в итоговое изображение
+        if not os.path.exists(element.source_filepath):
+            return None
+        x, y, w, h = element.source_frame_rect
+        region_rect = QRectF(x, y, w, h).toRect()
+        target_size = QSizeF(w*abs(element.scale_x), h*abs(element.scale_y)).toSize()
+        if element.source_frame_index is not None:
+            frame_source = self.elementsGetAnimatedFrameSource(element.source_filepath)
+            image = frame_source.get_frame(element.source_frame_index, wait=True)
+            if image is None or image.isNull():
+                return None
+            image = image.copy(region_rect)
+            if target_size.width() < region_rect.width():
+                image = image.scaled(target_size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+        else:
+            image = load_image_region_respect_orientation(element.source_filepath, region_rect,
+                                                                                    target_size)
+        if image.isNull():
+            return None
+        return QPixmap.fromImage(image)
+
+    def elementsGetAnimatedFrameSource(self, filepath):
+        frame_source = self.animated_frame_sources.get(filepath, None)
+        if frame_source is None:
+            frame_source = AnimatedFrameSource(filepath)
+            self.animated_frame_sources[filepath] = frame_source
+        return frame_source
+
+    def elementsTrackAnimatedFramePlaceholder(self, element):
+        # копии элемента в истории действий тоже должны получить свой кадр
+        pixmap = getattr(element, 'pixmap', None)
+        if pixmap is None:
+            return
+        frames = self.animated_frame_placeholders.get(pixmap.cacheKey(), None)
+        if frames is not None:
+            frames.setdefault(element.source_frame_index, []).append(element)
+
+    def elementsAnimatedFrameReady(self, frame_source, placeholder_key, proxy_size, frame_number):
+        # кадры приходят из рабочего потока по одному, редактор в это время остаётся отзывчивым
+        image = frame_source.get_frame(frame_number)
+        frames = self.animated_frame_placeholders.get(placeholder_key, dict())
+        if image is not None and not image.isNull():
+            if image.size() != proxy_size:
+                image = image.scaled(proxy_size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+            pixmap = QPixmap.fromImage(image)
+            for element in frames.pop(frame_number, []):
+                if element.pixmap.cacheKey() == placeholder_key:
+                    element.pixmap = pixmap
+            if not frames:
+                self.animated_frame_placeholders.pop(placeholder_key, None)
+            self.update()
+        if frame_number + 1 < frame_source.frameCount():
+            frame_source.request(frame_number + 1)
+
     def elementsFramePictures(self, data):
         pictures = []
         for pixmap, frame_rect in data:
@@ -1406,6 +1603,8 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
                 self.elementsTextElementInit(element)
             else:
                 setattr(element, attr_name, final_value)
+        if self.animated_frame_placeholders:
+            self.elementsTrackAnimatedFramePlaceholder(element)
 
     def elementsActiveElementParamsToPanelSliders(self):
         tw = self.tools_window
@@ -1891,6 +2090,7 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
         elif tool == ToolID.arrowstree:
             element.end_point = event_pos
             element.calc_local_data()
+            self.elementsArrowsTreeNodeMoved(element)
             self.elementsArrowsTreeNodeOrientToEdgeNeighbor(element)
         elif tool in [ToolID.zoom_in_region, ToolID.copypaste]:
             self.elementsAdvancedInputMoveEvent(event, event_pos, element)
@@ -1902,6 +2102,10 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
             if element.straight:
                 element.end_point = event_pos
             else:
+                # позиции мыши, отложенные при склейке событий перемещения,
+                # тоже добавляем, иначе штрих станет угловатым
+                for viewport_pos in self.mouse_move_intermediate_positions:
+                    element.path.lineTo(self.elementsMapToCanvas(viewport_pos))
                 element.path.lineTo(event_pos)
                 element.end_point = event_pos
             element.calc_local_data()
@@ -1994,6 +2198,7 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
         elif tool == ToolID.arrowstree:
             element.end_point = event_pos
             element.calc_local_data()
+            self.elementsArrowsTreeNodeMoved(element)
             self.elementsArrowsTreeNodeClearInputData(element)
         elif tool in [ToolID.zoom_in_region, ToolID.copypaste]:
             self.elementsAdvancedInputMoveEvent(event, event_pos, element, finish=True)
@@ -2126,6 +2331,7 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
         self.update()
 
     def elementsUpdateDependentElementsOnTransforms(self):
+        self.elementsArrowsTreesNodesMoved()
         if self.selected_items:
             for se in self.selected_items:
                 if se.oxxxy_type == ToolID.blurring:
@@ -2291,24 +2497,42 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
                 arrow_element.recalc_local_data_for_straight_objects()
                 arrow_element.construct_selection_path(self)
 
-    def elementsDrawDarkening(self, painter, prepare_pixmap=False, final=False):
-        if self.capture_region_rect:
-            darkening_value = 0.0
+    def elementsGetDarkeningZone(self):
+        """
+            Returns united darkening zone in canvas space and darkening value,
+            or None if there are no darkening elements
+        """
+        darkening_areas = []
+        darkening_value = 0.0
+        for element in self.elementsFilter():
+            if element.oxxxy_type == ToolID.darkening:
+                darkening_value = element.size
+                darkening_areas.append(element.get_canvas_space_selection_area())
+        if not darkening_areas:
+            return None
+        # объединение путей дорогое и замедляется с каждой новой областью,
+        # поэтому пересобираем его только когда области действительно изменились
+        cache_key = tuple(tuple((p.x(), p.y()) for p in area) for area in darkening_areas)
+        if cache_key != self.darkening_zone_cache_key:
             darkening_zone = QPainterPath()
             darkening_zone.setFillRule(Qt.WindingFill)
-            at_least_one_exists = False
-            for element in self.elementsFilter():
-                if element.oxxxy_type == ToolID.darkening:
-                    at_least_one_exists = True
-                    darkening_value = element.size
-                    if prepare_pixmap:
-                        element_area = element.get_canvas_space_selection_area()
-                    else:
-                        element_area = element.get_selection_area(canvas=self)
-                    piece = QPainterPath()
-                    piece.addPolygon(element_area)
-                    darkening_zone = darkening_zone.united(piece)
-            if at_least_one_exists:
+            for element_area in darkening_areas:
+                piece = QPainterPath()
+                piece.addPolygon(element_area)
+                darkening_zone = darkening_zone.united(piece)
+            self.darkening_zone_cache_key = cache_key
+            self.darkening_zone_cache = darkening_zone
+        return self.darkening_zone_cache, darkening_value
+
+    def elementsDrawDarkening(self, painter, prepare_pixmap=False, final=False):
+        if self.capture_region_rect:
+            darkening_data = self.elementsGetDarkeningZone()
+            if darkening_data is not None:
+                darkening_zone, darkening_value = darkening_data
+                if not prepare_pixmap:
+                    # переводим из координат холста в координаты вьюпорта
+                    transform = self.elementsGetDrawOffsetAndZoomTransform(self.canvas_origin)
+                    darkening_zone = transform.map(darkening_zone)
                 if final:
                     capture_rect = QRectF(self.capture_region_rect)
                     capture_rect.setTopLeft(QPoint(0,0))
@@ -2341,6 +2565,71 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
         pen.setJoinStyle(Qt.RoundJoin)
         return pen, color, size
 
+    def elementsGetPictureLODLevel(self, element):
+        # размер картинки на экране: берём большую сторону
+        side = max(
+            abs(element.width*element.scale_x*self.canvas_scale_x),
+            abs(element.height*element.scale_y*self.canvas_scale_y),
+        )
+        thumbnail_side = self.Globals.LOD_THUMBNAIL_MAX_SIDE
+        color_side = self.Globals.LOD_COLOR_MAX_SIDE
+        # гистерезис: порог для возврата к более детальному уровню выше порога перехода,
+        # поэтому на границе при плавном зуме картинка не мерцает
+        h = self.Globals.LOD_HYSTERESIS
+        prev_level = self.pictures_lod_levels.get(element.unique_index, PictureLOD.full)
+        if prev_level == PictureLOD.full:
+            if side >= thumbnail_side*(1.0-h):
+                level = PictureLOD.full
+            elif side >= color_side*(1.0-h):
+                level = PictureLOD.thumbnail
+            else:
+                level = PictureLOD.color
+        elif prev_level == PictureLOD.thumbnail:
+            if side > thumbnail_side*(1.0+h):
+                level = PictureLOD.full
+            elif side >= color_side*(1.0-h):
+                level = PictureLOD.thumbnail
+            else:
+                level = PictureLOD.color
+        else:
+            if side > thumbnail_side*(1.0+h):
+                level = PictureLOD.full
+            elif side > color_side*(1.0+h):
+                level = PictureLOD.thumbnail
+            else:
+                level = PictureLOD.color
+        self.pictures_lod_levels[element.unique_index] = level
+        return level
+
+    def elementsPrunePictureLODCache(self, pictures):
+        # записи удалённых и отменённых картинок, а также заменённых пиксмапов не храним
+        if len(self.pictures_lod_levels) > len(pictures):
+            indexes = set(el.unique_index for el in pictures)
+            for index in list(self.pictures_lod_levels.keys()):
+                if index not in indexes:
+                    self.pictures_lod_levels.pop(index)
+        if len(self.pictures_lod_thumbnails) > len(pictures):
+            keys = set((el.pixmap.cacheKey(), el.pixmap_source_rect) for el in pictures
+                                                                            if el.pixmap is not None)
+            for key in list(self.pictures_lod_thumbnails.keys()):
+                if key not in keys:
+                    self.pictures_lod_thumbnails.pop(key)
+
+    def elementsGetPictureLODThumbnail(self, pixmap, source_rect=None):
+        # копии элемента делят один и тот же пиксмап, поэтому ключом служит cacheKey;
+        # кусочки нарезки делят пиксмап целиком, и у каждого своя миниатюра своего участка
+        key = (pixmap.cacheKey(), source_rect)
+        data = self.pictures_lod_thumbnails.get(key, None)
+        if data is None:
+            side = self.Globals.LOD_THUMBNAIL_SIZE
+            if source_rect is not None:
+                pixmap = pixmap.copy(QRectF(*source_rect).toRect())
+            thumbnail = pixmap.scaled(side, side, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            average_color = thumbnail.toImage().scaled(1, 1,
+                                Qt.IgnoreAspectRatio, Qt.SmoothTransformation).pixelColor(0, 0)
+            data = self.pictures_lod_thumbnails[key] = (thumbnail, average_color)
+        return data
+
     def elementsDrawMainElement(self, painter, element, final, ve):
         el_type = element.oxxxy_type
         pen, color, size = self.elementsGetPenFromElement(element)
@@ -2441,13 +2730,34 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
                 painter.setTransform(element.get_transform_obj(canvas=self))
                 painter.setOpacity(min(1.0, picture_opacity))
                 pixmap = element.pixmap
+                if final and element.source_size is not None:
+                    # оригиналы подгружаются по одному и освобождаются сразу после отрисовки
+                    pixmap = self.elementsLoadPictureSource(element) or pixmap
                 r = element.get_size_rect()
                 r.moveCenter(QPointF(0, 0))
-                s = QRectF(QPointF(0,0), QSizeF(pixmap.size()))
-                painter.drawPixmap(r, pixmap, s)
+                if final or element.background_image or not self.collage_mode:
+                    lod_level = PictureLOD.full
+                else:
+                    lod_level = self.elementsGetPictureLODLevel(element)
+                if element.pixmap_source_rect is not None and pixmap is element.pixmap:
+                    source_rect = element.pixmap_source_rect
+                    s = QRectF(*source_rect)
+                else:
+                    source_rect = None
+                    s = QRectF(QPointF(0,0), QSizeF(pixmap.size()))
+                if lod_level == PictureLOD.full:
+                    painter.drawPixmap(r, pixmap, s)
+                else:
+                    thumbnail, average_color = self.elementsGetPictureLODThumbnail(pixmap,
+                                                                            source_rect=source_rect)
+                    if lod_level == PictureLOD.thumbnail:
+                        painter.drawPixmap(r, thumbnail, QRectF(thumbnail.rect()))
+                    else:
+                        painter.fillRect(r, average_color)
                 painter.setOpacity(current_opacity)
                 painter.resetTransform()
-                if not final and self.show_sort_indexes_on_pixmaps:
+                # при сильном отдалении номера всё равно не прочитать
+                if not final and self.show_sort_indexes_on_pixmaps and lod_level == PictureLOD.full:
                     painter.save()
                     painter.setCompositionMode(QPainter.RasterOp_SourceXorDestination)
                     align = Qt.AlignVCenter | Qt.AlignHCenter
@@ -2746,6 +3056,9 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
 
         all_the_rest = [e for e in all_the_rest if e.oxxxy_type != self.ToolID.arrowstree]
 
+        if not final and self.collage_mode:
+            self.elementsPrunePictureLODCache(pictures_first)
+
         for element in pictures_first:
             self.elementsDrawMainElement(painter, element, final, all_visible_elements)
         for element in all_the_rest:
@@ -2858,6 +3171,9 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
         else:
             info = f'No active element: {self.active_element}'
         info += f"\nself.modification_stamp = {self.modification_stamp}"
+        info += (f"\nmouse move events: {self.mouse_move_raw_events_count} raw"
+                 f" / {self.mouse_move_processed_events_count} processed"
+                 f" (coalescing ratio {self.get_mouse_move_coalescing_ratio():.2f})")
 
         r = painter.boundingRect(QRect(), Qt.AlignLeft, info)
         right_underground = QRectF(r)
@@ -2931,66 +3247,7 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
             specials = [el for el in self.elementsFilter() if el.oxxxy_type == ToolID.multiframing]
             any_multiframing_element = any(specials)
             if any_multiframing_element and not no_multiframing and not clean:
-                uvlfm = self.use_vertial_layout_for_multiframing
-                max_width = -1
-                max_height = -1
-                total_height = 0
-                total_width = 0
-                specials_rects = []
-                source_pixmap = QPixmap.fromImage(self.source_pixels)
-                for number, el in enumerate(specials):
-                    br = el.get_canvas_space_selection_rect_with_no_rotation()
-                    capture_pos = el.position
-                    el.bounding_rect = br
-                    capture_pos = el.position
-                    capture_rotation = el.rotation
-                    capture_width = br.width()
-                    capture_height = br.height()
-                    el.before_width = el.width
-                    el.before_height = el.height
-                    el.pixmap = capture_rotated_rect_from_pixmap(source_pixmap, capture_pos,
-                        capture_rotation, capture_width, capture_height)
-                for el in specials:
-                    max_width = max(max_width, el.bounding_rect.width())
-                    max_height = max(max_height, el.bounding_rect.height())
-                for el in specials:
-                    br = el.bounding_rect
-                    if uvlfm:
-                        el.height = max_width/br.width()*br.height()
-                        total_height += el.height
-                    else:
-                        el.width = max_height/br.height()*br.width()
-                        total_width += el.width
-                max_width = int(max_width)
-                max_height = int(max_height)
-                total_height = int(total_height)
-                total_width = int(total_width)
-                if uvlfm:
-                    FINAL_PIXMAP = QPixmap(QSize(max_width, total_height))
-                else:
-                    FINAL_PIXMAP = QPixmap(QSize(total_width, max_height))
-                painter = QPainter()
-                painter.begin(FINAL_PIXMAP)
-                cur_pos = QPointF(0, 0)
-                for el in specials:
-                    if uvlfm:
-                        size = QSizeF(max_width, el.height)
-                    else:
-                        size = QSizeF(el.width, max_height)
-                    dst_rect = QRectF(cur_pos, size)
-                    painter.drawPixmap(dst_rect, el.pixmap, QRectF(el.pixmap.rect()))
-                    if uvlfm:
-                        cur_pos += QPointF(0, el.height)
-                    else:
-                        cur_pos += QPointF(el.width, 0)
-                for el in specials:
-                    el.width = el.before_width
-                    el.height = el.before_height
-                    del el.bounding_rect
-                    del el.pixmap
-                    del el.before_width
-                    del el.before_height
-                painter.end()
+                FINAL_PIXMAP = self.elementsComposeMultiframing(specials)
             else:
                 if capture_region_rect is None:
                     capture_region_rect = self.capture_region_rect
@@ -3028,6 +3285,73 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
                     painter.end()
         return FINAL_PIXMAP
 
+    def elementsGetMultiframingFrame(self, element):
+        # рамка без учёта поворота, её размер и есть размер кадра
+        br = element.get_canvas_space_selection_rect_with_no_rotation()
+        version = (
+            element.position.x(),
+            element.position.y(),
+            element.rotation,
+            br.width(),
+            br.height(),
+            self.source_pixels.cacheKey(),
+        )
+        cached = self.multiframing_frames_cache.get(element.unique_index, None)
+        if cached is not None and cached[0] == version:
+            return cached[1], br
+        # из скриншота копируется только та часть, которую накрывает повёрнутая рамка,
+        # весь скриншот в QPixmap не переводится
+        area_rect = element.get_canvas_space_selection_area().boundingRect().toAlignedRect()
+        source_rect = area_rect.intersected(self.source_pixels.rect())
+        source_pixmap = QPixmap.fromImage(self.source_pixels.copy(source_rect))
+        capture_pos = element.position - QPointF(source_rect.topLeft())
+        frame = capture_rotated_rect_from_pixmap(source_pixmap, capture_pos,
+                                                element.rotation, br.width(), br.height())
+        self.multiframing_frames_cache[element.unique_index] = (version, frame)
+        return frame, br
+
+    def elementsComposeMultiframing(self, specials):
+        """
+            Composes multiframing output without touching the elements,
+            frames are cropped from source_pixels and cached by their geometry
+        """
+        uvlfm = self.use_vertial_layout_for_multiframing
+        frames = [self.elementsGetMultiframingFrame(el) for el in specials]
+        # кадры удалённых или отменённых рамок больше не нужны
+        indexes = [el.unique_index for el in specials]
+        for index in list(self.multiframing_frames_cache.keys()):
+            if index not in indexes:
+                self.multiframing_frames_cache.pop(index)
+
+        max_width = max(br.width() for frame, br in frames)
+        max_height = max(br.height() for frame, br in frames)
+        sizes = []
+        for frame, br in frames:
+            if uvlfm:
+                sizes.append(QSizeF(max_width, max_width/br.width()*br.height()))
+            else:
+                sizes.append(QSizeF(max_height/br.height()*br.width(), max_height))
+        if uvlfm:
+            total_height = sum(size.height() for size in sizes)
+            output_size = QSize(int(max_width), int(total_height))
+        else:
+            total_width = sum(size.width() for size in sizes)
+            output_size = QSize(int(total_width), int(max_height))
+
+        output_pixmap = QPixmap(output_size)
+        output_pixmap.fill(Qt.transparent)
+        painter = QPainter()
+        painter.begin(output_pixmap)
+        cur_pos = QPointF(0, 0)
+        for (frame, br), size in zip(frames, sizes):
+            painter.drawPixmap(QRectF(cur_pos, size), frame, QRectF(frame.rect()))
+            if uvlfm:
+                cur_pos += QPointF(0, size.height())
+            else:
+                cur_pos += QPointF(size.width(), 0)
+        painter.end()
+        return output_pixmap
+
     def elementsPrepareElementCopyForModifications(self, element):
         if self.modification_stamp is None:
             raise Exception('modifcation stamp is not acquired for this modification operation!')
@@ -3248,6 +3572,80 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
 
         self.update()
 
+    def elementsRenderContentToBackgroundIncrementally(self, keep_size):
+        """
+            Composites only the content added since the last flatten onto the current background,
+            restricted to the content bounds. The history gets a patch over the previous background
+            instead of a new full-size copy. Returns False when a full re-render is needed
+        """
+        if self.capture_region_rect is None:
+            return False
+        visible_elements = self.elementsFilter()
+        background_elements = [el for el in visible_elements if el.background_image]
+        content_elements = [el for el in visible_elements if not el.background_image and
+                                    el.oxxxy_type not in [ToolID.removing, ToolID.multiframing]]
+        if not background_elements or not content_elements:
+            return False
+        # затемнение действует на всю картинку, а деревья стрелок рисуются отдельным проходом
+        if any(el.oxxxy_type in [ToolID.darkening, ToolID.arrowstree] for el in content_elements):
+            return False
+
+        background_rect = QRectF()
+        for el in background_elements:
+            background_rect = background_rect.united(el.get_canvas_space_selection_area().boundingRect())
+        background_rect = background_rect.toAlignedRect()
+        # дорисовывать source_pixels на месте можно, только если он в точности совпадает с фоном:
+        # после нарезки кусочки могли переставить в пределах тех же размеров
+        if self.source_pixels_background_key != self.elementsGetBackgroundKey():
+            return False
+        if background_rect.size() != self.source_pixels.size():
+            return False
+        if keep_size:
+            hs = self.modification_slots[0]
+            if background_rect != QRect(QPoint(0, 0), hs.elements[0].pixmap.size()):
+                return False
+
+        content_rect = QRectF()
+        for el in content_elements:
+            content_rect = content_rect.united(el.get_canvas_space_selection_area().boundingRect())
+        if not keep_size and not QRectF(background_rect).contains(content_rect):
+            # фон придётся расширять
+            return False
+        m = FLATTEN_DIRTY_RECT_MARGIN
+        dirty_rect = content_rect.adjusted(-m, -m, m, m).toAlignedRect().intersected(background_rect)
+        if dirty_rect.isEmpty():
+            return False
+
+        patch_pixmap = self.elementsRenderFinal(capture_region_rect=QRectF(dirty_rect), clean=True)
+        if patch_pixmap is None:
+            return False
+
+        # исходник дорисовывается на месте, новая полноразмерная картинка не создаётся
+        painter = QPainter()
+        painter.begin(self.source_pixels)
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        painter.drawPixmap(dirty_rect.topLeft() - background_rect.topLeft(), patch_pixmap)
+        painter.end()
+
+        # в историю пишется только заплатка поверх прежнего фона,
+        # при отмене она скрывается вместе с элементом удаления
+        content_indexes = [el.unique_index for el in content_elements]
+        background_slot = self.elementsFindBackgroundSlot()
+        patch_element = self.elementsCreateNew(ToolID.picture,
+            create_new_slot=False,
+            modification_slot=background_slot,
+        )
+        rmv_element = self.elementsCreateNew(ToolID.removing)
+        rmv_element.source_indexes = content_indexes
+        rmv_element.allowed_indexes = [patch_element.pass2_unique_index]
+        patch_element.pass_through_filter_only_if_allowed = True
+        patch_element.pixmap = patch_pixmap
+        patch_element.background_image = True
+        patch_element.calc_local_data()
+        patch_element.position = QRectF(dirty_rect).center()
+        self.source_pixels_background_key = self.elementsGetBackgroundKey()
+        return True
+
     def elementsDoRenderToBackground(self, for_slicing=False):
         subMenu = QMenu()
         subMenu.setStyleSheet(self.context_menu_stylesheet)
@@ -3293,38 +3691,44 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
             new_height = max(self.source_pixels.height(), content_rect.height())
 
         draw_background_only = for_slicing
-        # рендер картинки
-        if for_slicing:
-            final_pix = self.elementsRenderFinal(capture_region_rect=content_rect, clean=True,
-                                                                        draw_background_only=True)
+
+        # если возможно, дорисовываем на фон только новые пометки и только в их границах
+        incremental = not for_slicing and action in [action_keep, action_extend] and \
+                    self.elementsRenderContentToBackgroundIncrementally(keep_size=action == action_keep)
+
+        if not incremental:
+            # рендер картинки
+            if for_slicing:
+                final_pix = self.elementsRenderFinal(capture_region_rect=content_rect, clean=True,
+                                                                            draw_background_only=True)
+                self.source_pixels = final_pix.toImage()
+                return content_rect
+
+            else:
+                if action == action_crop:
+                    final_pix = self.elementsRenderFinal(clean=True)
+                elif action == action_keep:
+                    hs = self.modification_slots[0]
+                    r = QRectF(QPointF(0, 0), QSizeF(hs.elements[0].pixmap.size()))
+                    final_pix = self.elementsRenderFinal(capture_region_rect=r, clean=True)
+                elif action == action_extend:
+                    final_pix = self.elementsRenderFinal(
+                            capture_region_rect=content_rect, clean=True)
+
+            # заменяем картинку и пишем в историю с удалением содержимого
             self.source_pixels = final_pix.toImage()
-            return content_rect
+            if action == action_extend:
+                offset = content_rect.topLeft()
+            else:
+                offset = None
+            self.elementsCreateBackgroundPictures(self.CreateBackgroundOption.ContentToBackground, offset=offset)
 
-        else:
+            # обновляем рамку, если по ней производилась обрезка
             if action == action_crop:
-                final_pix = self.elementsRenderFinal(clean=True)
-            elif action == action_keep:
-                hs = self.modification_slots[0]
-                r = QRectF(QPointF(0, 0), QSizeF(hs.elements[0].pixmap.size()))
-                final_pix = self.elementsRenderFinal(capture_region_rect=r, clean=True)
-            elif action == action_extend:
-                final_pix = self.elementsRenderFinal(
-                        capture_region_rect=content_rect, clean=True)
-
-        # заменяем картинку и пишем в историю с удалением содержимого
-        self.source_pixels = final_pix.toImage()
-        if action == action_extend:
-            offset = content_rect.topLeft()
-        else:
-            offset = None
-        self.elementsCreateBackgroundPictures(self.CreateBackgroundOption.ContentToBackground, offset=offset)
-
-        # обновляем рамку, если по ней производилась обрезка
-        if action == action_crop:
-            w = self.capture_region_rect.width()
-            h = self.capture_region_rect.height()
-            self.input_POINT2, self.input_POINT1 = get_bounding_pointsF([QPointF(0, 0), QPointF(w, h)])
-            self.capture_region_rect = build_valid_rectF(self.input_POINT1, self.input_POINT2)
+                w = self.capture_region_rect.width()
+                h = self.capture_region_rect.height()
+                self.input_POINT2, self.input_POINT1 = get_bounding_pointsF([QPointF(0, 0), QPointF(w, h)])
+                self.capture_region_rect = build_valid_rectF(self.input_POINT1, self.input_POINT2)
 
         # cleaning
         self.elementsSetSelected(None)
@@ -3395,12 +3799,13 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
     def elementsArrangePictures(self, elements, target_width, target_height):
         points = []
         pos = QPointF(0, 0)
-        for source_element in elements:
 
-            self.elementsStartModificationProcess('arranging')
-            element = self.elementsPrepareElementCopyForModifications(source_element)
-            self.elementsStopModificationProcess()
+        # все перестановки идут в одну запись истории
+        self.elementsStartModificationProcess('arranging')
+        elements = [self.elementsPrepareElementCopyForModifications(el) for el in elements]
+        self.elementsStopModificationProcess()
 
+        for element in elements:
 
             if True:
                 if target_height is not None:
@@ -3426,16 +3831,16 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
                 element.scale_y = scale
 
             br = element.get_canvas_space_selection_area().boundingRect()
-
-            element.position = QPointF(pos) + QPointF(br.width()/2, br.height()/2)
+            # после смены позиции прямоугольник только сдвигается, поэтому заново его не считаем
+            new_position = QPointF(pos) + QPointF(br.width()/2, br.height()/2)
+            br.translate(new_position - element.position)
+            element.position = new_position
             if target_height is not None:
                 pos += QPointF(br.width(), 0)
 
             if target_width is not None:
                 pos += QPointF(0, br.height())
 
-            br = element.get_canvas_space_selection_area().boundingRect()
-
             points.append(br.topLeft())
             points.append(br.bottomRight())
 
@@ -3491,6 +3896,7 @@ class ElementsMixin(ElementsTransformMixin, ElementsTextEditElementMixin, Elemen
         if action == None:
             pass
         elif elements:
+            self.collage_mode = True
 
             m = Element.get_canvas_space_selection_area
             br_getter = lambda el: m(el).boundingRect()
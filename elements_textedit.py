@@ -20,6 +20,7 @@
 
 import sys
 import os
+import math
 
 from PyQt5.QtWidgets import (QApplication,)
 from PyQt5.QtCore import (QPoint, QPointF, QRect, Qt, QRectF, QTimer)
@@ -28,8 +29,6 @@ from PyQt5.QtGui import (QPainterPath, QColor, QBrush, QPixmap, QPainter, QTrans
 
 from _utils import (check_scancode_for,)
 
-from colorpicker import ColorPicker
-
 def elementsTextElementRecalculateGabarit_______________Old(self, element):
     # обновление габаритов виджета трансформации
     s = element.text_doc.size()
@@ -310,8 +309,7 @@ class ElementsTextEditElementMixin():
     def elementsTextElementUpdateAfterInput(self):
         ae = self.active_element
         ae.plain_text = ae.text_doc.toPlainText()
-        if self.Globals.USE_PIXMAP_PROXY_FOR_TEXT_ELEMENTS:
-            self.elementsTextElementUpdateProxyPixmap(ae)
+        self.elementsTextElementUpdateProxyPixmap(ae)
 
         self.elementsTextElementRecalculateGabarit(ae)
         self.elementsFixArrowStartPositionIfNeeded(ae)
@@ -350,6 +348,16 @@ class ElementsTextEditElementMixin():
         pen.setJoinStyle(Qt.RoundJoin)
         return pen, color, size
 
+    def elementsTextElementDrawBackplate(self, painter, element, content_rect):
+        # подложка
+        painter.save()
+        painter.setPen(Qt.NoPen)
+        path = QPainterPath()
+        path.addRoundedRect(QRectF(content_rect), element.margin_value,
+            element.margin_value)
+        painter.fillPath(path, QBrush(element.backplate_color))
+        painter.restore()
+
     def elementsTextElementDraw(self, painter, element):
 
         def tweakedDrawContents(text_document, _painter_, rect):
@@ -376,12 +384,47 @@ class ElementsTextEditElementMixin():
         painter.setOpacity(1.0)
 
     def elementsTextElementUpdateProxyPixmap(self, element):
-        element.proxy_pixmap = QPixmap(element.text_doc.size().toSize())
-        element.proxy_pixmap.fill(Qt.transparent)
-        p = QPainter()
-        p.begin(element.proxy_pixmap)
-        self.elementsTextElementDraw(p, element)
-        p.end()
+        # прокси пересоздаётся при следующей отрисовке
+        element.proxy_pixmap = None
+        element.proxy_pixmap_key = None
+
+    def elementsTextElementGetProxyScale(self, element):
+        scale = max(abs(element.scale_x), abs(element.scale_y))
+        scale *= max(self.canvas_scale_x, self.canvas_scale_y)
+        # разрешение прокси берётся ступенями по степеням двойки,
+        # чтобы перерастеризация происходила только при пересечении порога зума
+        level = 2**math.ceil(math.log2(max(scale, 0.001)))
+        return min(max(level, 0.25), 8.0)
+
+    def elementsTextElementGetProxyPixmap(self, element, content_rect):
+        text_doc = element.text_doc
+        proxy_scale = self.elementsTextElementGetProxyScale(element)
+        key = (
+            id(text_doc),
+            text_doc.revision(),
+            text_doc.defaultFont().key(),
+            element.font_color.rgba(),
+            element.backplate_color.rgba(),
+            element.margin_value,
+            element.size,
+            content_rect.width(),
+            content_rect.height(),
+            proxy_scale,
+        )
+        if element.proxy_pixmap is None or element.proxy_pixmap_key != key:
+            size = content_rect.size()*proxy_scale
+            element.proxy_pixmap = QPixmap(max(1, math.ceil(size.width())), max(1, math.ceil(size.height())))
+            element.proxy_pixmap.fill(Qt.transparent)
+            p = QPainter()
+            p.begin(element.proxy_pixmap)
+            p.setRenderHint(QPainter.HighQualityAntialiasing, True)
+            p.setRenderHint(QPainter.Antialiasing, True)
+            p.scale(proxy_scale, proxy_scale)
+            self.elementsTextElementDrawBackplate(p, element, content_rect)
+            self.elementsTextElementDraw(p, element)
+            p.end()
+            element.proxy_pixmap_key = key
+        return element.proxy_pixmap
 
     def elementsTextElementIsInputEvent(self, event):
         ae = self.active_element
@@ -699,23 +742,16 @@ class ElementsTextEditElementMixin():
         if element.text_doc:
             text_doc = element.text_doc
 
-            # подложка
-            painter.save()
-            painter.setPen(Qt.NoPen)
             content_rect = QRect(QPoint(), s)
 
-            path = QPainterPath()
-            path.addRoundedRect(QRectF(content_rect), element.margin_value,
-                element.margin_value)
-            painter.fillPath(path, QBrush(element.backplate_color))
-            painter.restore()
-
-            # рисуем текст
-            if self.Globals.USE_PIXMAP_PROXY_FOR_TEXT_ELEMENTS:
-                if element.proxy_pixmap is None:
-                    self.elementsTextElementUpdateProxyPixmap(element)
-                painter.drawPixmap(QPoint(0, 0), element.proxy_pixmap)
+            use_proxy = self.Globals.USE_PIXMAP_PROXY_FOR_TEXT_ELEMENTS
+            if use_proxy and not element.editing and not final:
+                # подложка и текст одной картинкой
+                proxy_pixmap = self.elementsTextElementGetProxyPixmap(element, content_rect)
+                painter.drawPixmap(QRectF(content_rect), proxy_pixmap, QRectF(proxy_pixmap.rect()))
             else:
+                self.elementsTextElementDrawBackplate(painter, element, content_rect)
+                # рисуем текст
                 self.elementsTextElementDraw(painter, element)
 
             # рисуем прямоугольники выделения
@@ -791,6 +827,8 @@ class ElementsTextEditElementMixin():
 
     def elementsTextElementColorButtonsHandlers(self, check_code):
         if check_code != -1:
+            # пипетка нужна редко, поэтому модуль грузится только при первом открытии
+            from colorpicker import ColorPicker
             if check_code == 0:
                 def callback(color_value):
                     self.active_element.font_color = color_value
@@ -20,10 +20,11 @@
 
 import sys
 import math
+from collections import defaultdict
 
 from _utils import (build_valid_rectF,)
 
-from PyQt5.QtCore import (Qt, QPointF, QLineF, QRectF)
+from PyQt5.QtCore import (Qt, QPointF, QLineF)
 from PyQt5.QtGui import (QPen, QColor, QCursor, QVector2D)
 
 
@@ -36,10 +37,96 @@ class Element2024Mixin():
         self.local_start_point = QPointF(-50, -50)
         self.local_end_point = QPointF(50, 50)
 
+class ArrowsTreeNodesGrid():
+    """
+        Uniform grid over canvas positions of arrows-tree nodes
+        for fast nearest node lookup
+    """
+    CELL_SIZE = 200.0
+
+    def __init__(self, elements):
+        self.cells = defaultdict(list)
+        self.element_cells = dict()
+        for element in elements:
+            self.insert(element)
+
+    def get_cell(self, pos):
+        return (math.floor(pos.x()/self.CELL_SIZE), math.floor(pos.y()/self.CELL_SIZE))
+
+    def insert(self, element):
+        cell = self.get_cell(element.position)
+        self.cells[cell].append(element)
+        self.element_cells[id(element)] = cell
+
+    def remove(self, element):
+        cell = self.element_cells.pop(id(element), None)
+        if cell is not None:
+            self.cells[cell].remove(element)
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def move(self, element):
+        if id(element) in self.element_cells:
+            self.remove(element)
+            self.insert(element)
+
+    def get_ring_cells(self, cx, cy, ring):
+        # только ячейки на границе кольца, внутренние уже просмотрены
+        if ring == 0:
+            yield (cx, cy)
+            return
+        for x in range(cx - ring, cx + ring + 1):
+            yield (x, cy - ring)
+            yield (x, cy + ring)
+        for y in range(cy - ring + 1, cy + ring):
+            yield (cx - ring, y)
+            yield (cx + ring, y)
+
+    def nearest(self, pos, exclude=None):
+        if not self.cells:
+            return None
+        cx, cy = self.get_cell(pos)
+        nearest_element = None
+        nearest_distance = math.inf
+
+        def check_cell(cell):
+            nonlocal nearest_element, nearest_distance
+            for element in self.cells.get(cell, ()):
+                if element is exclude:
+                    continue
+                distance = QVector2D(pos - element.position).length()
+                if distance < nearest_distance:
+                    nearest_distance = distance
+                    nearest_element = element
+
+        ring = 0
+        while True:
+            # в кольце 8*ring ячеек: если их больше, чем занятых ячеек,
+            # то дешевле просто перебрать все занятые ячейки
+            if 8*ring > len(self.cells):
+                for cell in self.cells.keys():
+                    check_cell(cell)
+                break
+            for cell in self.get_ring_cells(cx, cy, ring):
+                check_cell(cell)
+            # все ячейки следующего кольца заведомо дальше найденного узла
+            if nearest_element is not None and nearest_distance <= ring*self.CELL_SIZE:
+                break
+            ring += 1
+        return nearest_element
+
 class Elements2024ToolsMixin():
 
     def init2024Tools(self):
         self.arrows_trees_edges = []
+        # списки смежности узлов: pass2_unique_index -> индексы соседей
+        self.arrows_trees_adjacency = defaultdict(list)
+        # контуры узлов в координатах холста, пересчитываются только при перемещении узлов
+        self.arrows_trees_outlines_cache = dict()
+        self.arrows_trees_nodes_stamp = 0
+        self.arrows_trees_index_key = None
+        self.arrows_trees_index_elements = dict()
+        self.arrows_trees_grid = None
 
     def elementsDrawArrowsTreeNode(self, painter, element, final):
         if not final:
@@ -74,18 +161,15 @@ class Elements2024ToolsMixin():
     def elementsGetNearestArrowsTreeNode(self, viewport_pos, new_element):
         if viewport_pos is None:
             viewport_pos = QCursor().pos()
-        at_ve = self.elementsGetArrowsTrees()
-        if new_element is not None:
-            at_ve.remove(new_element)
         cursor_pos = self.elementsMapToCanvas(viewport_pos)
-        distances = dict()
-        if at_ve:
-            for el in at_ve:
-                distances[el] = QVector2D(cursor_pos-el.position).length()
-            nearest_element = sorted(at_ve, key=lambda x: distances[x])[0]
-            return nearest_element
-        else:
-            return None
+        self.elementsGetArrowsTreesIndexElements()
+        return self.arrows_trees_grid.nearest(cursor_pos, exclude=new_element)
+
+    def elementsArrowsTreeNodeMoved(self, element):
+        # во время создания узел двигается мышкой без записи в историю,
+        # поэтому обновляем только его ячейку, не пересобирая всю сетку
+        if self.arrows_trees_grid is not None:
+            self.arrows_trees_grid.move(element)
 
     def elementsArrowsTreeNodeOrientToEdgeNeighbor(self, element):
         if hasattr(element, 'orient_to_element'):
@@ -100,148 +184,165 @@ class Elements2024ToolsMixin():
             del element.orient_to_element
 
     def elementsAddArrowsTreeEdge(self, el1, el2):
-        self.arrows_trees_edges.append((el1.pass2_unique_index, el2.pass2_unique_index))
+        index1 = el1.pass2_unique_index
+        index2 = el2.pass2_unique_index
+        self.arrows_trees_edges.append((index1, index2))
+        self.arrows_trees_adjacency[index1].append(index2)
+        self.arrows_trees_adjacency[index2].append(index1)
+
+    def elementsArrowsTreesNodesMoved(self):
+        self.arrows_trees_nodes_stamp += 1
+
+    def elementsGetArrowsTreesIndexElements(self):
+        # пересобираем только при изменении истории, количества элементов
+        # или после трансформаций, иначе берём из кэша
+        key = (
+            self.elements_modification_index,
+            len(self.modification_slots),
+            len(self.elements),
+            self.arrows_trees_nodes_stamp,
+        )
+        if key != self.arrows_trees_index_key:
+            els = self.elementsGetArrowsTrees()
+            self.arrows_trees_index_elements = {el.pass2_unique_index:el for el in els}
+            self.arrows_trees_grid = ArrowsTreeNodesGrid(els)
+            self.arrows_trees_index_key = key
+        return self.arrows_trees_index_elements
 
     def elementsMarkRoot(self, element):
         element.oxxxy_subtype = 'root'
 
     def elementsDrawArrowTrees(self, painter, final):
-        els = self.elementsGetArrowsTrees()
-        index_elements = {el.pass2_unique_index:el for el in els}
-
-        if False:
-            for node1_index, node2_index in self.arrows_trees_edges:
-
-                node1 = index_elements.get(node1_index, None)
-                node2 = index_elements.get(node2_index, None)
-                if node1 and node2:
-                    painter.setPen(QPen(Qt.red, 5))
-                    a = node1.position
-                    b = node2.position
-                    a = self.elementsMapToViewport(a)
-                    b = self.elementsMapToViewport(b)
-                    painter.drawLine(a, b)
+        index_elements = self.elementsGetArrowsTreesIndexElements()
 
         painter.setPen(QPen(Qt.green, 1))
         painter.setBrush(Qt.NoBrush)
 
-        HALF_WIDTH = 10
-
-        for el in els:
-
-            if False and el.oxxxy_subtype == 'root':
-                rect = QRectF(0, 0, 50, 50)
-                rect.moveCenter(self.elementsMapToViewport(el.position))
-                painter.drawEllipse(rect)
+        # контур считается в координатах холста, а на экран переводится трансформацией,
+        # поэтому при панорамировании кэш остаётся валидным
+        transform = self.elementsGetDrawOffsetAndZoomTransform(self.canvas_origin)
+        canvas_scale = self.canvas_scale_x
 
+        outlines_cache = self.arrows_trees_outlines_cache
+        actual_cache_keys = set()
+        for index, el in index_elements.items():
             neighbors = []
+            for neighbor_index in self.arrows_trees_adjacency.get(index, ()):
+                neighbor = index_elements.get(neighbor_index, None)
+                if neighbor is not None:
+                    neighbors.append(neighbor)
 
-            for node1_index, node2_index in self.arrows_trees_edges:
-                node1 = index_elements.get(node1_index, None)
-                node2 = index_elements.get(node2_index, None)
-                if node1 and node2:
-                    if node1 is el:
-                        other = node2
-                        neighbors.append(other)
-                    elif node2 is el:
-                        other = node1
-                        neighbors.append(other)
-
-
-            local_directions = []
-            for neighbor in neighbors:
-                s = QPointF(0, 0)
-                e = self.elementsMapToViewport(neighbor.position) - self.elementsMapToViewport(el.position)
-                middle = QLineF(s, e).pointAt(0.5)
-                local_directions.append(QLineF(s, middle))
-
-            if not local_directions:
+            if not neighbors:
                 continue
 
-            node_root_pos = self.elementsMapToViewport(el.position)
+            cache_key = (
+                el.position.x(), el.position.y(), el.oxxxy_subtype, canvas_scale,
+                tuple((n.position.x(), n.position.y()) for n in neighbors),
+            )
+            actual_cache_keys.add(index)
+            cached = outlines_cache.get(index, None)
+            if cached is None or cached[0] != cache_key:
+                lines = self.elementsBuildArrowsTreeNodeOutline(el, neighbors, canvas_scale)
+                cached = outlines_cache[index] = (cache_key, lines)
+
+            for line in cached[1]:
+                painter.drawLine(transform.map(line))
+
+        for index in list(outlines_cache.keys()):
+            if index not in actual_cache_keys:
+                outlines_cache.pop(index)
 
-            if len(local_directions) == 1:
+    def elementsBuildArrowsTreeNodeOutline(self, el, neighbors, canvas_scale):
+        # ширина задаётся в пикселях экрана, поэтому в координатах холста её надо поделить на зум
+        HALF_WIDTH = 10/canvas_scale
 
-                rect = QRectF(0, 0, 50, 50)
-                rect.moveCenter(self.elementsMapToViewport(el.position))
+        lines = []
 
-                # startAngle = (0 -int(el.rotation)) * 16
-                # spanAngle = 180 * 16
-                # painter.drawArc(rect, startAngle, spanAngle)
+        local_directions = []
+        for neighbor in neighbors:
+            s = QPointF(0, 0)
+            e = neighbor.position - el.position
+            middle = QLineF(s, e).pointAt(0.5)
+            local_directions.append(QLineF(s, middle))
 
+        node_root_pos = el.position
 
-                line = local_directions[0]
+        if len(local_directions) == 1:
 
-                nv = line.normalVector()
-                nv = QVector2D(QPointF(nv.p2().x(), nv.p2().y()))
-                offset = (nv.normalized()*HALF_WIDTH).toPointF()
-                line1 = line.translated(offset)
-                painter.drawLine(line1.translated(node_root_pos))
-                line2 = line.translated(-offset)
-                painter.drawLine(line2.translated(node_root_pos))
+            line = local_directions[0]
 
+            nv = line.normalVector()
+            nv = QVector2D(QPointF(nv.p2().x(), nv.p2().y()))
+            offset = (nv.normalized()*HALF_WIDTH).toPointF()
+            line1 = line.translated(offset)
+            lines.append(line1.translated(node_root_pos))
+            line2 = line.translated(-offset)
+            lines.append(line2.translated(node_root_pos))
 
-                if el.oxxxy_subtype != 'root':
 
-                    arrow_line = line.translated(node_root_pos)
+            if el.oxxxy_subtype != 'root':
 
-                    tip = arrow_line.pointAt(-.5)
-                    tip_start = arrow_line.pointAt(0)
+                arrow_line = line.translated(node_root_pos)
 
-                    direction = QVector2D(tip - tip_start).normalized()
+                tip = arrow_line.pointAt(-.5)
+                tip_start = arrow_line.pointAt(0)
 
-                    p = tip_start + (direction*40).toPointF()
+                direction = QVector2D(tip - tip_start).normalized()
 
-                    p1 = tip_start + offset*3 - (direction*6).toPointF()
-                    painter.drawLine(p, p1)
+                p = tip_start + (direction*40/canvas_scale).toPointF()
 
-                    p2 = tip_start + -offset*3 - (direction*6).toPointF()
-                    painter.drawLine(p, p2)
+                p1 = tip_start + offset*3 - (direction*6/canvas_scale).toPointF()
+                lines.append(QLineF(p, p1))
 
-                    painter.drawLine(p2, line2.translated(node_root_pos).p1())
-                    painter.drawLine(p1, line1.translated(node_root_pos).p1())
+                p2 = tip_start + -offset*3 - (direction*6/canvas_scale).toPointF()
+                lines.append(QLineF(p, p2))
+
+                lines.append(QLineF(p2, line2.translated(node_root_pos).p1()))
+                lines.append(QLineF(p1, line1.translated(node_root_pos).p1()))
+
+        else:
 
-            else:
 
+            angles_per_dir = dict()
+            for direction_line in local_directions:
+                p2 = direction_line.p2()
+                angles_per_dir[id(direction_line)] = math.atan2(p2.y(), p2.x())
+            ordered_directions = sorted(local_directions, key=lambda x: angles_per_dir[id(x)])
 
-                angles_per_dir = dict()
-                for direction_line in local_directions:
-                    p2 = direction_line.p2()
-                    angles_per_dir[id(direction_line)] = math.atan2(p2.y(), p2.x())
-                ordered_directions = sorted(local_directions, key=lambda x: angles_per_dir[id(x)])
 
+            # draw node center
+            ordered_directions.append(ordered_directions[0])
+            for n, direction_line in enumerate(ordered_directions[:-1]):
 
-                # draw node center
-                ordered_directions.append(ordered_directions[0])
-                for n, direction_line in enumerate(ordered_directions[:-1]):
+                line_translated = direction_line.translated(node_root_pos)
+                dir_end1 = line_translated.p2()
 
-                    line_translated = direction_line.translated(node_root_pos)
-                    dir_end1 = line_translated.p2()
+                normal_to_dir1 = direction_line.normalVector()
+                vec = -QVector2D(QPointF(normal_to_dir1.p2().x(), normal_to_dir1.p2().y()))
+                end_point1 = dir_end1 + (vec.normalized()*HALF_WIDTH).toPointF()
 
-                    normal_to_dir1 = direction_line.normalVector()
-                    vec = -QVector2D(QPointF(normal_to_dir1.p2().x(), normal_to_dir1.p2().y()))
-                    end_point1 = dir_end1 + (vec.normalized()*HALF_WIDTH).toPointF()
 
+                next_direction_line = ordered_directions[n+1]
+                other_line_translated = next_direction_line.translated(node_root_pos)
+                dir_end2 = other_line_translated.p2()
 
-                    next_direction_line = ordered_directions[n+1]
-                    other_line_translated = next_direction_line.translated(node_root_pos)
-                    dir_end2 = other_line_translated.p2()
+                normal_to_dir2 = next_direction_line.normalVector()
+                vec = QVector2D(QPointF(normal_to_dir2.p2().x(), normal_to_dir2.p2().y()))
+                end_point2 = dir_end2 + (vec.normalized()*HALF_WIDTH).toPointF()
 
-                    normal_to_dir2 = next_direction_line.normalVector()
-                    vec = QVector2D(QPointF(normal_to_dir2.p2().x(), normal_to_dir2.p2().y()))
-                    end_point2 = dir_end2 + (vec.normalized()*HALF_WIDTH).toPointF()
 
+                ray1 = line_translated.translated(end_point1 - dir_end1)
+                ray2 = other_line_translated.translated(end_point2 - dir_end2)
 
-                    ray1 = line_translated.translated(end_point1 - dir_end1)
-                    ray2 = other_line_translated.translated(end_point2 - dir_end2)
+                i = ray1.intersects(ray2)
+                if i[0] != QLineF.NoIntersection:
+                    cross_point = i[1]
+                    lines.append(QLineF(end_point1, cross_point))
+                    lines.append(QLineF(cross_point, end_point2))
+                else:
+                    lines.append(QLineF(end_point1, end_point2))
 
-                    i = ray1.intersects(ray2)
-                    if i[0] != QLineF.NoIntersection:
-                        cross_point = i[1]
-                        painter.drawLine(end_point1, cross_point)
-                        painter.drawLine(cross_point, end_point2)
-                    else:
-                        painter.drawLine(end_point1, end_point2)
+        return lines
 
     def elementsGetArrowsTrees(self):
         all_visible_elements = self.elementsFilter()
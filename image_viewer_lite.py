@@ -27,10 +27,11 @@ from collections import namedtuple
 from PyQt5.QtWidgets import (QApplication, QMenu, QFileDialog, QWidget, QDesktopWidget)
 from PyQt5.QtCore import (QTimer, Qt, QRect, QRectF, QPoint, QPointF, QSize)
 from PyQt5.QtGui import (QPixmap, QPainterPath, QPainter, QCursor, QBrush, QPen, QColor,
-                                             QTransform, QMovie, QPolygonF, QRegion, QVector2D)
+                                             QTransform, QPolygonF, QRegion, QVector2D)
 
 from _utils import (build_valid_rect, load_image_respect_orientation, is_webp_file_animated, fit,
-    interpolate_values, draw_shadow, webRGBA, draw_thirds, check_scancode_for, fit_rect_into_rect)
+    interpolate_values, draw_shadow, webRGBA, draw_thirds, check_scancode_for, fit_rect_into_rect,
+    AnimatedFrameSource)
 
 __all__ = (
     'ViewerWindow',
@@ -48,6 +49,70 @@ class Globals:
 RegionInfo = namedtuple('RegionInfo', 'setter coords getter')
 
 
+class AnimatedFramesPlayer():
+    # та часть интерфейса QMovie, которой пользуется просмотрщик;
+    # кадры берутся из AnimatedFrameSource, поэтому в памяти не копятся все кадры сразу.
+    # Пока нужный кадр декодируется, показывается последний готовый, а о готовности кадра
+    # сообщает сигнал frame_ready
+
+    def __init__(self, filepath):
+        self.source = AnimatedFrameSource(filepath)
+        self.frame_ready = self.source.frame_ready
+        self.current_frame = 0
+        self.current_pixmap = None
+        self.current_pixmap_frame = None
+        self._speed = 100
+        self.source.request(0)
+
+    def frameCount(self):
+        return self.source.frameCount()
+
+    def currentFrameNumber(self):
+        return self.current_frame
+
+    def jumpToFrame(self, frame_number):
+        if not (0 <= frame_number < self.frameCount()):
+            return False
+        self.current_frame = frame_number
+        return True
+
+    def jumpToNextFrame(self):
+        return self.jumpToFrame((self.current_frame + 1) % self.frameCount())
+
+    def isCurrentFrameReady(self):
+        return self.current_pixmap_frame == self.current_frame
+
+    def currentPixmap(self, wait=False):
+        if not self.isCurrentFrameReady():
+            image = self.source.get_frame(self.current_frame, wait=wait)
+            if image is not None:
+                self.current_pixmap = QPixmap.fromImage(image)
+                self.current_pixmap_frame = self.current_frame
+            elif self.current_pixmap is None:
+                # ни одного кадра ещё нет, вместо него пустая картинка того же размера
+                self.current_pixmap = QPixmap(self.source.frame_size)
+                self.current_pixmap.fill(Qt.transparent)
+        return self.current_pixmap
+
+    def frameRect(self):
+        return QRect(QPoint(0, 0), self.source.frame_size)
+
+    def nextFrameDelay(self):
+        # задержка кадра становится известна только после его декодирования,
+        # до тех пор берётся задержка по умолчанию
+        self.currentPixmap()
+        return int(self.source.frame_delay(self.current_frame)*100/self._speed)
+
+    def speed(self):
+        return self._speed
+
+    def setSpeed(self, speed):
+        self._speed = speed
+
+    def deleteLater(self):
+        self.source.stop()
+
+
 
 class ViewerWindow(QWidget):
 
@@ -433,15 +498,15 @@ class ViewerWindow(QWidget):
         self.movie.jumpToFrame(0)
         self.animation_stamp()
         fr = self.movie.frameRect()
-        if fr.width() == 0 or fr.height() == 0:
+        if fr.width() <= 0 or fr.height() <= 0:
             self.invalid_movie = True
             self.tranformations_allowed = False
 
     def show_animated(self, filepath):
         if filepath is not None:
             self.invalid_movie = False
-            self.movie = QMovie(filepath)
-            self.movie.setCacheMode(QMovie.CacheAll)
+            self.movie = AnimatedFramesPlayer(filepath)
+            self.movie.frame_ready.connect(self.animated_frame_ready)
             self.image_filepath = filepath
             self.tranformations_allowed = True
             self.animated = True
@@ -452,6 +517,18 @@ class ViewerWindow(QWidget):
                 self.movie.deleteLater()
                 self.movie = None
 
+    def animated_frame_ready(self, frame_number):
+        # кадр декодирован в фоне: до этого на экране оставался предыдущий готовый кадр
+        if self.movie is None or frame_number != self.movie.currentFrameNumber():
+            return
+        if self.movie.isCurrentFrameReady():
+            return
+        if frame_number in self.transformed_frames_for_animated:
+            return
+        self.pixmap = self.movie.currentPixmap()
+        self.get_rotated_pixmap(force_update=True)
+        self.update()
+
     def animation_stamp(self):
         self.frame_delay = self.movie.nextFrameDelay()
         self.frame_time = time.time()
@@ -739,7 +816,8 @@ class ViewerWindow(QWidget):
                 self.movie.jumpToFrame(i)
                 current_pixmap = self.transformed_frames_for_animated.get(i, None)
                 if current_pixmap is None:
-                    current_pixmap = self.movie.currentPixmap()
+                    # кадры уходят в редактор, поэтому здесь их дожидаемся
+                    current_pixmap = self.movie.currentPixmap(wait=True)
                 pictures_and_frame_data.append((current_pixmap, data['frame_rect']))
             self.main_window.elementsFramePictures(pictures_and_frame_data)
         else:
@@ -2190,7 +2268,7 @@ class ViewerWindow(QWidget):
             return mapped_pos
 
         if self.animated:
-            source = self.movie.currentPixmap()
+            source = self.movie.currentPixmap(wait=True)
         else:
             if self.pixmap_backup is None:
                 self.pixmap_backup = QPixmap(self.pixmap)
@@ -0,0 +1,128 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+#  Author: Sergei Krumas (github.com/sergkrumas)
+#
+# ##### END GPL LICENSE BLOCK #####
+
+import os
+import sys
+import subprocess
+
+# Проверяет время импорта для каждой точки входа через python -X importtime.
+# Если импорт дольше бюджета или при запуске подгрузился модуль,
+# который должен грузиться лениво, то скрипт завершается с ненулевым кодом.
+
+ENTRY_POINTS = (
+    'oxxxy.pyw',
+    'oxxxy_notification.py',
+    'start_editor.pyw',
+    'oxxxy_batch.py',
+)
+
+# бюджет на импорт в миллисекундах, для каждой точки входа
+IMPORT_BUDGET_MSEC = 1500
+
+# эти модули должны импортироваться только тогда, когда они действительно нужны
+LAZY_MODULES = (
+    'PIL',
+    'psutil',
+    'cbor2',
+    'image_viewer_lite',
+    'colorpicker',
+    'win32com',
+    'numpy',
+)
+
+# эти модули не должны импортироваться при запуске отдельных точек входа
+ENTRY_POINT_LAZY_MODULES = {
+    'oxxxy_notification.py': (
+        'oxxxy_main',
+        'oxxxy_editor_ui',
+        'elements',
+    ),
+    'oxxxy_batch.py': (
+        'oxxxy_main',
+        'PyQt5',
+    ),
+}
+
+# точка входа загружается как модуль, поэтому main() не вызывается
+LOADER_CODE = """
+import sys
+import importlib.util
+from importlib.machinery import SourceFileLoader
+sys.path.insert(0, {root!r})
+loader = SourceFileLoader('entry_point', {filepath!r})
+spec = importlib.util.spec_from_loader('entry_point', loader)
+module = importlib.util.module_from_spec(spec)
+loader.exec_module(module)
+"""
+
+def parse_importtime_output(output):
+    total_usec = 0
+    imported_modules = set()
+    for line in output.splitlines():
+        if not line.startswith('import time:') or '[us]' in line:
+            continue
+        _, cumulative_usec, name = line.split('|')
+        cumulative_usec = int(cumulative_usec.strip())
+        # модули верхнего уровня имеют отступ ровно в один пробел
+        if not name[1:].startswith(' '):
+            total_usec += cumulative_usec
+        imported_modules.add(name.strip())
+    return total_usec/1000, imported_modules
+
+def check_entry_point(root, filename, budget_msec):
+    filepath = os.path.join(root, filename)
+    code = LOADER_CODE.format(root=root, filepath=filepath)
+    env = dict(os.environ)
+    env['QT_QPA_PLATFORM'] = env.get('QT_QPA_PLATFORM', 'offscreen')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                                    capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        print(f'{filename}: ошибка')
+        last_line = result.stderr.strip().splitlines()[-1]
+        return [f'не удалось импортировать: {last_line}']
+    total_msec, imported_modules = parse_importtime_output(result.stderr)
+    errors = []
+    if total_msec > budget_msec:
+        errors.append(f'время импорта {total_msec:.0f} мс превышает бюджет {budget_msec} мс')
+    for module_name in LAZY_MODULES + ENTRY_POINT_LAZY_MODULES.get(filename, ()):
+        loaded = [m for m in imported_modules if m == module_name or m.startswith(f'{module_name}.')]
+        if loaded:
+            errors.append(f'модуль {module_name} импортируется при запуске')
+    print(f'{filename}: {total_msec:.0f} мс')
+    return errors
+
+def scan(budget_msec=IMPORT_BUDGET_MSEC):
+    root = os.path.dirname(os.path.abspath(__file__))
+    failed = False
+    for filename in ENTRY_POINTS:
+        errors = check_entry_point(root, filename, budget_msec)
+        for error in errors:
+            failed = True
+            print(f'    [!] {error}')
+    if failed:
+        print('\nПроверка провалена')
+        sys.exit(1)
+    print('\nПроверка пройдена')
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        scan(budget_msec=int(sys.argv[1]))
+    else:
+        scan()
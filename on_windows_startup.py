@@ -21,11 +21,12 @@
 
 
 import os
-from win32com.client import Dispatch
 
 REL_PATH = r'%APPDATA%\Microsoft\Windows\Start Menu\Programs\Startup'
 
 def create_windows_shortcut(src, dst):
+    # COM подгружается только когда ярлык действительно создаётся
+    from win32com.client import Dispatch
     shell = Dispatch('WScript.Shell')
     shortcut = shell.CreateShortCut(dst)
     shortcut.Targetpath = src
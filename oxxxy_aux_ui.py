@@ -33,7 +33,7 @@ from PyQt5.QtWidgets import (QWidget, QMessageBox, QMenu, QFileDialog, QHBoxLayo
                                     QListWidgetItem, QSpacerItem, QToolButton, QSizePolicy, )
 from PyQt5.QtCore import (QPoint, QRect, QTimer, Qt, QSize, QRectF, pyqtSignal, QSignalBlocker, )
 from PyQt5.QtGui import (QPainterPath, QColor, QBrush, QPainter, QPen, QCursor, QVector2D,
-                                                                QFontMetrics, QPixmap)
+                                                                QFontMetrics, QPixmap, QImage)
 
 from _utils import (SettingsJson, get_creation_date, open_link_in_browser, open_in_google_chrome, RoundedQMenu)
 
@@ -43,6 +43,7 @@ from on_windows_startup import (add_to_startup, is_app_in_startup, remove_from_s
 import sip
 
 __all__ = (
+    'NotificationGlobals',
     'SettingsWindow',
     'NotificationOrMenu',
     'NotifyDialog',
@@ -50,6 +51,20 @@ __all__ = (
 )
 
 
+class NotificationGlobals():
+    # минимальный набор глобальных переменных, нужный окну уведомления;
+    # облегчённая точка входа oxxxy_notification.py обходится им вместо Globals из oxxxy_main
+    DEBUG = False
+    DEBUG_INPUT_FILES_TRAY_WINDOW = False
+    FULL_STOP = False
+
+    VERSION_INFO = "v0.94"
+    AUTHOR_INFO = "by Sergei Krumas"
+
+    CLIPBOARD_FILEPATH = 'clipboard'
+    SCREENSHOT_FOLDER_PATH = ""
+
+
 class StylizedUIBase():
 
     button_style = """
@@ -518,8 +533,10 @@ class NotificationOrMenu(QWidget, StylizedUIBase):
     CLOSE_BUTTON_RADIUS = 50
     WIDTH = 300
 
+    THUMBNAIL_HEIGHT = 200
+
     instance = None
-    def __init__(self, menu=False, notification=False, filepath=None):
+    def __init__(self, menu=False, notification=False, filepath=None, thumbnail=None):
         super().__init__()
         if not (notification != menu):
             raise
@@ -591,6 +608,15 @@ class NotificationOrMenu(QWidget, StylizedUIBase):
 
             self.layout.addSpacing(10)
             self.layout.addWidget(self.label)
+            if thumbnail is not None and not thumbnail.isNull():
+                # миниатюру присылает сохранивший скриншот процесс,
+                # поэтому файл с диска здесь не читается
+                thumbnail_label = QLabel()
+                thumbnail_label.setPixmap(thumbnail)
+                thumbnail_label.setAlignment(Qt.AlignCenter)
+                thumbnail_label.setFixedWidth(self.WIDTH)
+                self.layout.addWidget(thumbnail_label)
+                self.layout.addSpacing(10)
             if not self.image_stored_in_clipboard:
                 self.layout.addWidget(open_image_btn_gchr)
                 self.layout.addSpacing(10)
@@ -966,9 +992,14 @@ class InputFilesTrayWindow(QWidget, StylizedUIBase):
                 break
 
     def updatePreview(self, image_data):
+        if image_data not in self.gl.PrepareThreadImageData.input_list:
+            # список успели очистить, пока файл обрабатывался
+            return
         if image_data.error:
             pixmap = PreviewStatusWidget.gen_error_pixmap()
         else:
+            if isinstance(image_data.preview, QImage):
+                image_data.preview = QPixmap.fromImage(image_data.preview)
             pixmap = image_data.preview
         image_data._ui_list_item_widget.setPreview(pixmap)
         self.update()
@@ -992,10 +1023,8 @@ class InputFilesTrayWindow(QWidget, StylizedUIBase):
             image_data_index = item.data(Qt.UserRole)
             image_data = _list[image_data_index]
             if not image_data.error:
-                if image_data.filepath.lower().endswith('.gif'):
-                    paths.append(image_data.filepath)
-                else:
-                    paths.append(image_data.source)
+                # полное изображение загружается уже редактором
+                paths.append(image_data.filepath)
         return paths
 
     def reverse_list_widget_items(self):
@@ -1042,6 +1071,8 @@ class InputFilesTrayWindow(QWidget, StylizedUIBase):
         self.add_item(item, image_data, index=index)
 
     def clearlist_btn_handler(self):
+        self.gl.FolderScanThread.cancel_all()
+        self.gl.DownloadsManager.cancel_all()
         if self.gl.PrepareThread.instance:
             self.gl.PrepareThread.instance.terminate()
         self.ifl.clear()
@@ -0,0 +1,310 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+#  Author: Sergei Krumas (github.com/sergkrumas)
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""
+Oxxxy BATCH RUNNING MODE Entry Point
+
+Рендер проектов .oxxxyshot без показа окон: Qt запускается на платформе offscreen,
+проекты раскидываются по нескольким процессам-обработчикам.
+
+    python oxxxy_batch.py render ПАПКА_ИЛИ_ПРОЕКТ ... [-output ПАПКА] [-workers N] [-frames]
+
+Пометки проекта-шаблона можно наложить на множество картинок: фон шаблона заменяется
+на очередную картинку так же, как при пересъёмке скриншота.
+
+    python oxxxy_batch.py template ПРОЕКТ ПАПКА_ИЛИ_КАРТИНКА ... -output ПАПКА [-workers N] [-frames]
+"""
+
+import sys
+import os
+import argparse
+import multiprocessing
+import queue
+
+PROJECT_FILE_EXTENSION = '.oxxxyshot'
+
+# после стольких проектов процесс-обработчик пересоздаётся, чтобы не копилась память
+TASKS_PER_WORKER = 50
+# столько задач на каждый процесс-обработчик отдаётся пулу заранее,
+# остальные берутся из генератора только по мере выполнения
+PENDING_TASKS_PER_WORKER = 4
+
+def init_headless():
+    # платформу нужно задать до создания QApplication; заданная пользователем xcb или windows
+    # не подходит, иначе каждый обработчик создавал бы настоящие окна
+    os.environ['QT_QPA_PLATFORM'] = 'offscreen'
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance()
+    if app is None:
+        app = QApplication([sys.argv[0]])
+        import oxxxy_main
+        oxxxy_main.Globals.DEBUG = False
+        oxxxy_main.read_settings_file()
+        oxxxy_main.Globals.generate_icons()
+        oxxxy_main.Globals.load_fonts()
+    return app
+
+def create_headless_editor():
+    import oxxxy_main
+    from PyQt5.QtGui import QImage
+    # редактор никогда не показывается, он нужен только как холст для рендера
+    return oxxxy_main.CanvasEditor(QImage(), ("", ""), "")
+
+def dispose_headless_editor(editor):
+    import oxxxy_main
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtCore import QEvent
+    # open_project складывает картинки проекта из папки in_memory в глобальный список,
+    # при рендере они не нужны, а копиться от проекта к проекту не должны
+    oxxxy_main.Globals.images_in_memory.clear()
+    if editor.tools_window:
+        editor.tools_window.deleteLater()
+    if editor.dialog:
+        editor.dialog.deleteLater()
+    editor.deleteLater()
+    QApplication.sendPostedEvents(None, QEvent.DeferredDelete)
+
+def render_editor_outputs(editor, output_filepath, frames=False):
+    import oxxxy_main
+    Globals = oxxxy_main.Globals
+    pixmap = editor.elementsRenderFinal(force_no_datetime_stamp=Globals.save_to_memory_mode)
+    if pixmap is None:
+        raise Exception('capture region is not defined')
+    if not pixmap.save(output_filepath):
+        raise Exception(f'unable to write {output_filepath}')
+    filepaths = [output_filepath]
+    if frames:
+        # каждый кадр мультифрейминга отдельным файлом
+        specials = [el for el in editor.elementsFilter() if el.oxxxy_type == editor.ToolID.multiframing]
+        base, ext = os.path.splitext(output_filepath)
+        for number, element in enumerate(specials):
+            frame, _ = editor.elementsGetMultiframingFrame(element)
+            frame_filepath = f'{base}_frame{number:02}{ext}'
+            if not frame.save(frame_filepath):
+                raise Exception(f'unable to write {frame_filepath}')
+            filepaths.append(frame_filepath)
+    return filepaths
+
+def get_output_name(filepath, root):
+    # имя результата повторяет путь исходника относительно папки, переданной на вход,
+    # вместе с самой этой папкой: проекты обычно называются одинаково и различаются только папками
+    relative_path = os.path.relpath(filepath, os.path.dirname(root))
+    return relative_path.replace(os.sep, '__')
+
+class OutputFilepaths():
+    """
+        Hands out output filepaths in the main process,
+        a name that is already taken gets a counter suffix
+    """
+
+    def __init__(self):
+        self.used = set()
+
+    def get(self, output_folder, name):
+        candidate = name
+        counter = 1
+        while os.path.normcase(os.path.join(output_folder, candidate)) in self.used:
+            counter += 1
+            candidate = f'{name}_{counter}'
+        output_filepath = os.path.join(output_folder, f'{candidate}.png')
+        self.used.add(os.path.normcase(os.path.join(output_folder, candidate)))
+        return output_filepath
+
+def render_project(project_filepath, output_filepath, frames=False):
+    init_headless()
+    editor = create_headless_editor()
+    try:
+        if not editor.open_project(project_filepath, notify=False):
+            raise Exception('unable to read project')
+        return render_editor_outputs(editor, output_filepath, frames=frames)
+    finally:
+        dispose_headless_editor(editor)
+
+def render_template(image_filepath, template_filepath, output_filepath, frames=False):
+    from _utils import load_image_respect_orientation
+    init_headless()
+    editor = create_headless_editor()
+    try:
+        # шаблон загружается заново для каждой картинки:
+        # так история действий не разрастается и память не копится
+        if not editor.open_project(template_filepath, notify=False):
+            raise Exception('unable to read template project')
+        image = load_image_respect_orientation(image_filepath).toImage()
+        if image.isNull():
+            raise Exception('unable to read image')
+        # как при пересъёмке: новый фон и пересчёт размытия, копирования и лупы
+        editor.source_pixels = image
+        editor.elementsCreateBackgroundPictures(editor.CreateBackgroundOption.Reshoot)
+        editor.elementsUpdateDependentElementsAfterReshot()
+        return render_editor_outputs(editor, output_filepath, frames=frames)
+    finally:
+        dispose_headless_editor(editor)
+
+def iterate_images(paths):
+    # возвращает пары (картинка, папка, от которой считается имя результата);
+    # пути должны быть уже абсолютными, генератор может выполняться позже
+    from _utils import ImageFilesScanner, sniff_image_format
+    scanner = ImageFilesScanner('folders_listings')
+    for path in paths:
+        if os.path.isdir(path):
+            # картинки отдаются по мере сканирования, весь список заранее не собирается
+            for batch in scanner.scan(path):
+                for image_filepath in batch:
+                    yield image_filepath, path
+        elif sniff_image_format(path):
+            yield path, os.path.dirname(path)
+
+def find_projects(paths):
+    # возвращает пары (проект, папка, от которой считается имя результата)
+    projects = []
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            for cur_folder, folders, files in os.walk(path):
+                for filename in sorted(files):
+                    if filename.lower().endswith(PROJECT_FILE_EXTENSION):
+                        projects.append((os.path.join(cur_folder, filename), path))
+        elif path.lower().endswith(PROJECT_FILE_EXTENSION):
+            projects.append((path, os.path.dirname(path)))
+    return projects
+
+def init_worker():
+    # относительные пути к ресурсам считаются от папки программы,
+    # пути к проектам к этому моменту уже абсолютные
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    init_headless()
+
+def run_task(task):
+    func, args = task
+    try:
+        return args[0], func(*args), None
+    except Exception as e:
+        return args[0], None, f'{type(e).__name__}: {e}'
+
+def run_tasks(tasks, workers=None):
+    """
+        Runs (func, args) tasks in worker processes and yields (first arg, result, error)
+        as soon as each task is done
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        # в своём процессе папку не меняем: пути из командной строки могут быть относительными
+        init_headless()
+        for task in tasks:
+            yield run_task(task)
+        return
+    # spawn везде, как на Windows: Qt не переносит fork уже запущенного процесса
+    context = multiprocessing.get_context('spawn')
+    # imap_unordered сразу вычитывает весь генератор задач, поэтому задачи отдаются пулу
+    # порциями: новая берётся из генератора только когда готов результат одной из прежних
+    results = queue.Queue()
+    tasks = iter(tasks)
+    pending = 0
+    tasks_exhausted = False
+    with context.Pool(processes=workers, initializer=init_worker,
+                                                    maxtasksperchild=TASKS_PER_WORKER) as pool:
+        while True:
+            while not tasks_exhausted and pending < workers*PENDING_TASKS_PER_WORKER:
+                task = next(tasks, None)
+                if task is None:
+                    tasks_exhausted = True
+                    break
+                pool.apply_async(run_task, (task,), callback=results.put,
+                    error_callback=lambda e, task=task: results.put(
+                                                (task[1][0], None, f'{type(e).__name__}: {e}')),
+                )
+                pending += 1
+            if pending == 0:
+                break
+            yield results.get()
+            pending -= 1
+
+def render_projects(paths, output_folder=None, frames=False, workers=None):
+    if output_folder is not None:
+        output_folder = os.path.abspath(output_folder)
+        os.makedirs(output_folder, exist_ok=True)
+    output_filepaths = OutputFilepaths()
+    tasks = []
+    for project_filepath, root in find_projects(paths):
+        name = get_output_name(project_filepath, root)[:-len(PROJECT_FILE_EXTENSION)]
+        # без -output результат кладётся рядом с проектом
+        folder = output_folder or os.path.dirname(project_filepath)
+        output_filepath = output_filepaths.get(folder, name)
+        tasks.append((render_project, (project_filepath, output_filepath, frames)))
+    return run_tasks(tasks, workers=workers)
+
+def render_template_images(template_filepath, paths, output_folder, frames=False, workers=None):
+    template_filepath = os.path.abspath(template_filepath)
+    output_folder = os.path.abspath(output_folder)
+    os.makedirs(output_folder, exist_ok=True)
+    # пути разрешаются сразу, а не когда генератор дойдёт до них
+    paths = [os.path.abspath(path) for path in paths]
+    output_filepaths = OutputFilepaths()
+    # расширение остаётся в имени, чтобы shot.jpg и shot.png не затёрли друг друга
+    tasks = ((render_template, (image_filepath, template_filepath,
+                    output_filepaths.get(output_folder, get_output_name(image_filepath, root)), frames))
+                                            for image_filepath, root in iterate_images(paths))
+    return run_tasks(tasks, workers=workers)
+
+def report(results):
+    failed = 0
+    done = 0
+    for source, filepaths, error in results:
+        if error:
+            failed += 1
+            print(f'[!] {source}: {error}')
+        else:
+            done += 1
+            print(f'{source} -> {", ".join(filepaths)}')
+    print(f'\nГотово: {done}, с ошибками: {failed}')
+    return failed == 0
+
+def main():
+    parser = argparse.ArgumentParser(description='Oxxxy batch rendering')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    render_parser = subparsers.add_parser('render', help='render .oxxxyshot projects')
+    render_parser.add_argument('paths', nargs='+', help='projects or folders with projects')
+    render_parser.add_argument('-output', default=None, help='output folder')
+    render_parser.add_argument('-workers', type=int, default=None)
+    render_parser.add_argument('-frames', action='store_true',
+                                                    help='also write every multiframing frame')
+
+    template_parser = subparsers.add_parser('template',
+                                    help='apply annotations of a project to many images')
+    template_parser.add_argument('template', help='.oxxxyshot project used as a template')
+    template_parser.add_argument('paths', nargs='+', help='images or folders with images')
+    template_parser.add_argument('-output', required=True, help='output folder')
+    template_parser.add_argument('-workers', type=int, default=None)
+    template_parser.add_argument('-frames', action='store_true',
+                                                    help='also write every multiframing frame')
+
+    args = parser.parse_args(sys.argv[1:])
+    if args.command == 'render':
+        results = render_projects(args.paths, output_folder=args.output,
+                                                frames=args.frames, workers=args.workers)
+    elif args.command == 'template':
+        results = render_template_images(args.template, args.paths, args.output,
+                                                frames=args.frames, workers=args.workers)
+    ok = report(results)
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
@@ -26,10 +26,10 @@ from functools import partial
 
 from PyQt5.QtWidgets import (QWidget, QFileDialog, QHBoxLayout, QCheckBox, QVBoxLayout,
                                     QGridLayout, QPushButton, QApplication, QScrollArea)
-from PyQt5.QtCore import (pyqtSignal, QPoint, QPointF, QRect, QTimer, Qt, QRectF, QThread)
+from PyQt5.QtCore import (pyqtSignal, QPoint, QPointF, QRect, Qt, QRectF, QThread)
 from PyQt5.QtGui import (QPainterPath, QColor, QKeyEvent, QBrush, QPixmap, QPaintEvent, QPainter,
                                                 QPolygon, QTransform, QPen, QLinearGradient, QCursor)
-from _utils import (build_valid_rectF, apply_blur_effect)
+from _utils import (build_valid_rectF, apply_blur_effect, PixmapsDiskCache)
 
 from elements import (ToolID,)
 from _sliders import (CustomSlider,)
@@ -50,6 +50,10 @@ class CheckBoxCustom(QCheckBox):
 
 class CustomPushButton(QPushButton):
     right_clicked = pyqtSignal()
+    faces_cache = None
+    # увеличивать при каждом изменении кода draw_button, иначе останутся старые битмапы из кэша
+    FACES_CACHE_VERSION = 1
+
     def __init__(self, *args, tool_id=False, checkable=False, checked=True):
         super().__init__(*args)
 
@@ -68,28 +72,64 @@ class CustomPushButton(QPushButton):
 
         self.small_d = 1.5
 
-        self._draw_checked = True
-        self.pixmap_checked = QPixmap(self.BUTTON_SIZE, self.BUTTON_SIZE)
-        self.pixmap_checked.fill(Qt.transparent)
-        painter = QPainter()
-        painter.begin(self.pixmap_checked)
-        painter.setRenderHint(QPainter.Antialiasing)
-        self.draw_button(painter)
-        painter.end()
-
-        self._draw_checked = False
-        self.pixmap = QPixmap(self.BUTTON_SIZE, self.BUTTON_SIZE)
-        self.pixmap.fill(Qt.transparent)
-        painter = QPainter()
-        painter.begin(self.pixmap)
-        painter.setRenderHint(QPainter.Antialiasing)
-        self.draw_button(painter)
-        painter.end()
+        self.pixmap_checked = self.get_cached_face(True)
+        self.pixmap = self.get_cached_face(False)
+        self.state_dependent_faces = dict()
 
         if tool_id in [ToolID.FORWARDS, ToolID.BACKWARDS]:
             self.setFixedWidth(int(self.BUTTON_SIZE/self.small_d))
             self.setFixedHeight(int(self.BUTTON_SIZE/self.small_d))
 
+    def get_cached_face(self, checked):
+        # лица кнопок рисуются кодом, поэтому готовые битмапы берём из дискового кэша
+        if CustomPushButton.faces_cache is None:
+            CustomPushButton.faces_cache = PixmapsDiskCache('tools_buttons',
+                                                            CustomPushButton.FACES_CACHE_VERSION)
+        ui_type = 'flat' if self.Globals.ENABLE_FLAT_EDITOR_UI else 'gradient'
+        state = 'checked' if checked else 'normal'
+        memory_mode = 'memory' if self.Globals.save_to_memory_mode else 'disk'
+        key = f'{self.property("tool_id")}_{state}_{ui_type}_{memory_mode}'
+
+        def draw_func(painter):
+            self._draw_checked = checked
+            painter.setRenderHint(QPainter.Antialiasing)
+            self.draw_button(painter)
+
+        dpr = QApplication.primaryScreen().devicePixelRatio()
+        return self.faces_cache.get_pixmap(key, self.BUTTON_SIZE, self.BUTTON_SIZE, draw_func, dpr)
+
+    def get_state_dependent_face(self, checked):
+        # все варианты отрисовки кнопки запоминаются, чтобы не рисовать их заново на каждый paintEvent
+        modifiers = QApplication.queryKeyboardModifiers()
+        key = (checked, bool(modifiers & Qt.ControlModifier), self.Globals.save_to_memory_mode,
+                                            self.width(), self.height(), self.devicePixelRatioF())
+        face = self.state_dependent_faces.get(key, None)
+        if face is None:
+            dpr = self.devicePixelRatioF()
+            face = QPixmap(int(self.width()*dpr), int(self.height()*dpr))
+            face.fill(Qt.transparent)
+            painter = QPainter()
+            painter.begin(face)
+            painter.setRenderHint(QPainter.HighQualityAntialiasing, True)
+            painter.setRenderHint(QPainter.Antialiasing, True)
+            painter.setRenderHint(QPainter.SmoothPixmapTransform, True)
+            painter.scale(dpr, dpr)
+            self._draw_checked = checked
+            self.draw_button(painter)
+            painter.end()
+            face.setDevicePixelRatio(dpr)
+            self.state_dependent_faces[key] = face
+        return face
+
+    def enterEvent(self, event):
+        # подсветка при наведении, раньше кнопки перерисовывались по таймеру
+        self.update()
+        super().enterEvent(event)
+
+    def leaveEvent(self, event):
+        self.update()
+        super().leaveEvent(event)
+
     def mouseReleaseEvent(self, event):
         select_window = self.parent().select_window
         if select_window and select_window.isVisible():
@@ -129,16 +169,14 @@ class CustomPushButton(QPushButton):
             painter.drawPath(path)
 
         if tool_id in [ToolID.oval, ToolID.rect, ToolID.line]:
-            # эти кнопки рисуем наживую из-за того,
-            # что нажатая клавиша Ctrl модифицирует их отрисовку
-            self._draw_checked = self.isChecked()
-            self.draw_button(painter)
+            # вид этих кнопок зависит от нажатой клавиши Ctrl
+            face = self.get_state_dependent_face(self.isChecked())
+            painter.drawPixmap(QRectF(self.rect()), face, QRectF(face.rect()))
         elif tool_id in [ToolID.DONE, ToolID.DONE_MOVE_TO_CLIPBOARD]:
             # это нужно здесь для поддержки изменения цвета в режиме self.Globals.save_to_memory_mode
-            self._draw_checked = self.underMouse()
-            self.draw_button(painter)
+            face = self.get_state_dependent_face(self.underMouse())
+            painter.drawPixmap(QRectF(self.rect()), face, QRectF(face.rect()))
         else:
-            src_rect = QRect(0, 0, self.BUTTON_SIZE, self.BUTTON_SIZE)
             forwards_backwards_btns = tool_id in [ToolID.FORWARDS, ToolID.BACKWARDS]
             if forwards_backwards_btns:
                 rect_w = int(self.BUTTON_SIZE/self.small_d)
@@ -148,6 +186,7 @@ class CustomPushButton(QPushButton):
                 trgt_rect = QRect(0, 0, self.BUTTON_SIZE, self.BUTTON_SIZE)
                 flag = self.isChecked()
             pixmap = self.pixmap_checked if flag else self.pixmap
+            src_rect = pixmap.rect()
             if forwards_backwards_btns:
                 if self.underMouse():
                     painter.setOpacity(1.0)
@@ -742,7 +781,7 @@ class PictureSelectButton(QPushButton):
         painter.end()
 
     def mouseReleaseEvent(self, event):
-        if self.picture_data.pixmap:
+        if self.picture_data.get_pixmap():
             main_window = self.main_window
             tools_window = main_window.tools_window
             if self.picture_data.id == PictureInfo.TYPE_FROM_FILE:
@@ -753,7 +792,7 @@ class PictureSelectButton(QPushButton):
                 else:
                     main_window.current_picture_pixmap = PictureInfo.PIXMAP_BROKEN
             else:
-                main_window.current_picture_pixmap = self.picture_data.pixmap
+                main_window.current_picture_pixmap = self.picture_data.get_pixmap()
             main_window.current_picture_id = self.picture_data.id
             main_window.current_picture_angle = 0
             # tools_window.on_parameters_changed()  # закоменчено, чтобы не делало модификации пометок
@@ -768,6 +807,11 @@ class PictureInfo():
     TYPE_FROM_MAGAZIN = "from_magazin"
     BUTTON_SIZE = 100
 
+    thumbnails_cache = None
+    images_scanner = None
+    # сканер находит любые картинки, а штампы и стикеры берутся только этих форматов
+    PICTURE_EXTENSIONS = (".jpg", ".png", ".jpeg", ".webp")
+
     @classmethod
     def create_default_pixmaps(cls):
         if hasattr(cls, "PIXMAP_BROKEN"):
@@ -919,6 +963,26 @@ class PictureInfo():
                 Qt.SmoothTransformation
         )
 
+    def load_preview(self):
+        # для картинок из файлов сначала смотрим в кэш миниатюр,
+        # а само изображение загружается только при выборе
+        if self.picture_type in [self.TYPE_STAMP, self.TYPE_STICKER] and self.thumbnails_cache:
+            size_key = f"{self.BUTTON_SIZE}x{self.BUTTON_SIZE}_expanding"
+            preview = self.thumbnails_cache.load(self.filepath, size_key)
+            if preview is not None:
+                self.display_pixmap = QPixmap.fromImage(preview)
+                return
+            self.load_from_file()
+            if self.pixmap is not None:
+                self.thumbnails_cache.store(self.filepath, size_key, self.display_pixmap.toImage())
+        else:
+            self.load_from_file()
+
+    def get_pixmap(self):
+        if self.pixmap is None and self.display_pixmap is not self.PIXMAP_BROKEN:
+            self.load_from_file()
+        return self.pixmap
+
     @classmethod
     def get_module_functions(cls, script_filename, full_path):
         spec = importlib.util.spec_from_file_location(script_filename, full_path)
@@ -948,12 +1012,11 @@ class PictureInfo():
         ############################################################
         # scan pictures
         ############################################################
-        for cur_folder, folders, files in os.walk(cls.PIC_FOLDER):
-            for filename in files:
-                filepath = os.path.join(cur_folder, filename)
-                if filepath.lower().endswith((".jpg", ".png", ".jpeg", ".webp")):
-                    picture_info = PictureInfo(cls.TYPE_STAMP, filepath)
-                    pictures.append(picture_info)
+        for filepath in cls.images_scanner.scan_all(cls.PIC_FOLDER):
+            if not filepath.lower().endswith(cls.PICTURE_EXTENSIONS):
+                continue
+            picture_info = PictureInfo(cls.TYPE_STAMP, filepath)
+            pictures.append(picture_info)
         ############################################################
         # scan scripts
         ############################################################
@@ -974,12 +1037,11 @@ class PictureInfo():
         ############################################################
         # scan stickers
         ############################################################
-        for cur_folder, folders, files in os.walk(cls.STICKERS_FOLDER):
-            for filename in files:
-                filepath = os.path.join(cur_folder, filename)
-                if filepath.lower().endswith((".jpg", ".png", ".jpeg", ".webp")):
-                    picture_info = PictureInfo(cls.TYPE_STICKER, filepath)
-                    pictures.append(picture_info)
+        for filepath in cls.images_scanner.scan_all(cls.STICKERS_FOLDER):
+            if not filepath.lower().endswith(cls.PICTURE_EXTENSIONS):
+                continue
+            picture_info = PictureInfo(cls.TYPE_STICKER, filepath)
+            pictures.append(picture_info)
         ############################################################
         # end of scan
         ############################################################
@@ -998,7 +1060,7 @@ class PreviewsThread(QThread):
 
     def run(self):
         for picture_info in self.pictures:
-            picture_info.load_from_file()
+            picture_info.load_preview()
             self.msleep(1)
             self.update_signal.emit(None)
 
@@ -1397,9 +1459,11 @@ class ToolsWindow(QWidget):
         if self.current_tool != ToolID.transform:
             self.set_ui_on_toolchange()
 
-    def update_timer_handler(self):
+    def update_modifiers_dependent_buttons(self):
+        # кнопки овала, прямоугольника и линии выглядят иначе при зажатом Ctrl
         for but in self.tools_buttons:
-            but.update()
+            if but.property("tool_id") in [ToolID.oval, ToolID.rect, ToolID.line]:
+                but.update()
 
     def __init__(self, *args):
         super().__init__(*args)
@@ -1692,11 +1756,6 @@ class ToolsWindow(QWidget):
 
         self.setLayout(main_layout)
 
-        self.update_timer = QTimer()
-        self.update_timer.timeout.connect(self.update_timer_handler)
-        self.update_timer.setInterval(100)
-        self.update_timer.start()
-
         tool_id = tool_id_default = ToolID.pen
         if tools_settings:
             tool_id = tools_settings.get("active_tool", tool_id_default)
@@ -1748,9 +1807,11 @@ class ToolsWindow(QWidget):
         tools_window = self
         if not self.select_window:
             PictureInfo.create_default_pixmaps()
+            PictureInfo.images_scanner = self.Globals.image_files_scanner
             pictures = PictureInfo.scan()
             self.select_window = PictureSelectWindow(main_window, pictures=pictures)
             PreviewsThread.Globals = self.Globals
+            PictureInfo.thumbnails_cache = self.Globals.thumbnails_cache
             PreviewsThread(pictures, self.select_window).start()
         else:
             self.select_window.show_at()
@@ -1838,6 +1899,10 @@ class ToolsWindow(QWidget):
         app = QApplication.instance()
         app.sendEvent(self.parent(), event)
 
+    def keyReleaseEvent(self, event):
+        app = QApplication.instance()
+        app.sendEvent(self.parent(), event)
+
     def do_autopositioning(self, screenshot_rect):
         if not self.auto_positioning:
             return
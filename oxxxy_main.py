@@ -25,13 +25,13 @@ import sys
 import os
 import subprocess
 import time
+import math
 import ctypes
 import itertools
 import traceback
 import locale
+import json
 import argparse
-import urllib.request
-import http
 
 from functools import partial
 
@@ -41,22 +41,26 @@ from key_seq_edit import KeySequenceEdit
 from PyQt5.QtWidgets import (QSystemTrayIcon, QWidget, QMessageBox, QMenu, QFileDialog,
     QCheckBox, QWidgetAction, QApplication, QDesktopWidget, QActionGroup, QSpinBox)
 from PyQt5.QtCore import (pyqtSignal, QPoint, QPointF, pyqtSlot, QRect, QEvent, QDataStream, QIODevice,
-    Qt, QSize, QRectF, QAbstractNativeEventFilter, QAbstractEventDispatcher, QThread, QByteArray, QMimeData, QTimer)
+    Qt, QSize, QRectF, QAbstractNativeEventFilter, QAbstractEventDispatcher, QThread, QByteArray, QMimeData, QTimer,
+    QBuffer, QRunnable, QThreadPool, QObject)
 from PyQt5.QtGui import (QPainterPath, QColor, QKeyEvent, QMouseEvent, QBrush, QPixmap,
-    QPainter, QWindow, QImage, QPen, QIcon, QFont, QCursor, QPolygonF, QFontDatabase, QMovie)
+    QPainter, QWindow, QImage, QPen, QIcon, QFont, QCursor, QPolygonF, QFontDatabase,
+    QGuiApplication)
 
 from _utils import (check_scancode_for, SettingsJson, generate_metainfo, build_valid_rect,
     build_valid_rectF, copy_image_file_to_clipboard, open_link_in_browser, save_meta_info,
     make_screenshot_pyqt, webRGBA, draw_shadow, draw_cyberpunk, get_bounding_pointsF,
-    generate_datetime_stamp, get_work_area_rect, load_image_respect_orientation,
-    is_windows_dark_mode, change_color_of_non_transparent_pixels, RoundedQMenu)
+    generate_datetime_stamp, get_work_area_rect,
+    load_image_preview_respect_orientation, load_image_proxy_respect_orientation, is_webp_file_animated,
+    download_url_to_folder,
+    is_windows_dark_mode, change_color_of_non_transparent_pixels, RoundedQMenu, PixmapsDiskCache,
+    ThumbnailsDiskCache, ImageFilesScanner)
 
 from elements import ElementsMixin, ToolID
 from editor_autotest import EditorAutotestMixin
-from image_viewer_lite import ViewerWindow
 
 from oxxxy_aux_ui import (SettingsWindow, NotificationOrMenu, NotifyDialog, QuitDialog,
-                                                                        InputFilesTrayWindow)
+                                                    InputFilesTrayWindow, NotificationGlobals)
 from oxxxy_editor_ui import (PictureInfo, ToolsWindow)
 
 
@@ -96,7 +100,9 @@ class Globals():
     SCREENSHOT_FOLDER_PATH = ""
     USE_PRINT_KEY = True
 
-    USE_PIXMAP_PROXY_FOR_TEXT_ELEMENTS = False
+    USE_PIXMAP_PROXY_FOR_TEXT_ELEMENTS = True
+
+    COALESCE_MOUSE_MOVE_EVENTS = True
 
     ANTIALIASING_AND_SMOOTH_PIXMAP_TRANSFORM = True
 
@@ -118,16 +124,36 @@ class Globals():
     handle_global_hotkeys = True
     registred_key_seqs = []
 
-    VERSION_INFO = "v0.94"
-    AUTHOR_INFO = "by Sergei Krumas"
+    VERSION_INFO = NotificationGlobals.VERSION_INFO
+    AUTHOR_INFO = NotificationGlobals.AUTHOR_INFO
 
     _canvas_editor = None
 
     background_threads = []
 
+    single_instance_server = None
+
+    thumbnails_cache = ThumbnailsDiskCache('thumbnails')
+
+    image_files_scanner = ImageFilesScanner('folders_listings')
+
+    # сколько пикселей в сумме могут занимать кадры GIF, открытого в редакторе
+    ANIMATED_FRAMES_PIXELS_BUDGET = 64*1024*1024
+
+    # картинки, которые на экране меньше LOD_THUMBNAIL_MAX_SIDE пикселей,
+    # рисуются из миниатюры размером LOD_THUMBNAIL_SIZE,
+    # а меньше LOD_COLOR_MAX_SIDE — прямоугольником среднего цвета
+    LOD_THUMBNAIL_MAX_SIDE = 64
+    LOD_THUMBNAIL_SIZE = 64
+    LOD_COLOR_MAX_SIDE = 8
+    LOD_HYSTERESIS = 0.2
+
+    # увеличивать при каждом изменении кода draw_icon_*, иначе останутся старые битмапы из кэша
+    ICONS_CACHE_VERSION = 1
+
     COPY_SELECTED_CANVAS_ITEMS_STR = '~#~OXXXY:SCREENSHOTER:COPY:SELECTED:CANVAS:ITEMS~#~'
 
-    CLIPBOARD_FILEPATH = 'clipboard'
+    CLIPBOARD_FILEPATH = NotificationGlobals.CLIPBOARD_FILEPATH
 
     burst_mode_screenshots = []
     _burst_mode_release_timer = None
@@ -158,26 +184,18 @@ class Globals():
         brush.setTexture(pixmap)
         return brush
 
-    @classmethod
-    def generate_icons(cls):
-
-        bitmap_cancel = QPixmap(50, 50)
-        bitmap_cancel.fill(Qt.transparent)
-        painter = QPainter()
-        painter.begin(bitmap_cancel)
-        inner_rect = bitmap_cancel.rect().adjusted(13, 13, -13, -13)
+    @staticmethod
+    def draw_icon_cancel(painter):
+        inner_rect = QRect(0, 0, 50, 50).adjusted(13, 13, -13, -13)
         pen = QPen(QColor(200, 100, 0), 10)
         pen.setCapStyle(Qt.RoundCap)
         painter.setPen(pen)
         painter.drawLine(inner_rect.topLeft(), inner_rect.bottomRight())
         painter.drawLine(inner_rect.bottomLeft(), inner_rect.topRight())
-        painter.end()
 
-        bitmap_halt = QPixmap(50, 50)
-        bitmap_halt.fill(Qt.transparent)
-        painter = QPainter()
-        painter.begin(bitmap_halt)
-        inner_rect = bitmap_halt.rect().adjusted(13, 13, -13, -13)
+    @staticmethod
+    def draw_icon_halt(painter):
+        inner_rect = QRect(0, 0, 50, 50).adjusted(13, 13, -13, -13)
         painter.setBrush(QBrush(QColor(200, 0, 0)))
         path = QPainterPath()
         path.addRoundedRect(QRectF(0, 0, 50, 50), 10, 10)
@@ -188,18 +206,15 @@ class Globals():
         painter.setPen(pen)
         painter.drawLine(inner_rect.topLeft(), inner_rect.bottomRight())
         painter.drawLine(inner_rect.bottomLeft(), inner_rect.topRight())
-        painter.end()
 
-        bitmap_refresh = QPixmap(50, 50)
-        bitmap_refresh.fill(Qt.transparent)
-        painter = QPainter()
-        painter.begin(bitmap_refresh)
+    @staticmethod
+    def draw_icon_refresh(painter):
         pen = painter.pen()
         pen.setWidth(5)
         pen.setColor(Qt.white)
         pen.setCapStyle(Qt.RoundCap)
         painter.setPen(pen)
-        rectangle = QRectF(bitmap_refresh.rect().adjusted(13, 13, -13, -13))
+        rectangle = QRectF(QRect(0, 0, 50, 50).adjusted(13, 13, -13, -13))
         painter.setBrush(QBrush(Qt.white))
         startAngle = 60 * 16
         spanAngle = (180-60) * 16
@@ -207,7 +222,7 @@ class Globals():
         startAngle = (180+60) * 16
         spanAngle = (360-180-60) * 16
         painter.drawArc(rectangle, startAngle, spanAngle)
-        w = bitmap_refresh.rect().width()
+        w = 50
         points = [
             QPointF(50, 50) - QPointF(44, w/2),
             QPointF(50, 50) - QPointF(31, w/2),
@@ -224,36 +239,9 @@ class Globals():
         poly = QPolygonF(points)
         painter.setPen(Qt.NoPen)
         painter.drawPolygon(poly, fillRule=Qt.WindingFill)
-        painter.end()
-
-        cls.icon_cancel = QIcon(bitmap_cancel)
-        cls.icon_halt = QIcon(bitmap_halt)
-        cls.icon_refresh = QIcon(bitmap_refresh)
-
 
-        path = os.path.join(os.path.dirname(__file__), "icon.png")
-        icon_multiframing = QPixmap(path)
-        p = QPainter()
-        p.begin(icon_multiframing)
-        offset = (icon_multiframing.size().width()/3, icon_multiframing.size().height()/3)
-        p.drawPixmap(QPointF(*offset), QPixmap(icon_multiframing))
-        p.end()
-        cls.icon_multiframing = QIcon(icon_multiframing)
-
-        icon_content_bound = QPixmap(path)
-        p = QPainter()
-        p.begin(icon_content_bound)
-        r = QRect(0, 0, 150, 150)
-        r.moveCenter(icon_content_bound.rect().center())
-        p.setBrush(Qt.white)
-        p.drawRect(r)
-        p.end()
-        cls.icon_content_bound = QIcon(icon_content_bound)
-
-        icon_bake = QPixmap(255, 255)
-        icon_bake.fill(Qt.transparent)
-        p = QPainter()
-        p.begin(icon_bake)
+    @staticmethod
+    def draw_icon_bake(p):
         font = p.font()
         font.setPixelSize(int(255/2))
         font.setBold(True)
@@ -263,20 +251,13 @@ class Globals():
         p.setPen(pen)
         p.drawText(QRectF(0, 0, 255, 255/2), Qt.AlignVCenter | Qt.AlignHCenter, 'BA')
         p.drawText(QRectF(0, 255/2, 255, 255/2), Qt.AlignVCenter | Qt.AlignHCenter, 'KE')
-        p.end()
-        cls.icon_bake = QIcon(icon_bake)
 
-        size = 20
-        cls.icon_halt_mini_pixmap = bitmap_halt.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-
-        icon_slice_background = QPixmap(512, 512)
-        icon_slice_background.fill(Qt.transparent)
-        p = QPainter()
-        p.begin(icon_slice_background)
+    @staticmethod
+    def draw_icon_slice_background(p):
         p.setBrush(Qt.red)
         p.setPen(Qt.NoPen)
         path = QPainterPath()
-        r = icon_slice_background.rect()
+        r = QRect(0, 0, 512, 512)
         c = r.center()
         # blade
         path.moveTo(c)
@@ -298,7 +279,51 @@ class Globals():
         path.lineTo(c0)
 
         p.drawPath(path)
+
+    @classmethod
+    def generate_icons(cls):
+        # иконки рисуются кодом, а приложение перезапускается после каждого скриншота,
+        # поэтому готовые битмапы берутся из дискового кэша
+        icons_cache = PixmapsDiskCache('icons', cls.ICONS_CACHE_VERSION)
+        dpr = QGuiApplication.primaryScreen().devicePixelRatio()
+
+        bitmap_cancel = icons_cache.get_pixmap('cancel', 50, 50, cls.draw_icon_cancel, dpr)
+        bitmap_halt = icons_cache.get_pixmap('halt', 50, 50, cls.draw_icon_halt, dpr)
+        bitmap_refresh = icons_cache.get_pixmap('refresh', 50, 50, cls.draw_icon_refresh, dpr)
+
+        cls.icon_cancel = QIcon(bitmap_cancel)
+        cls.icon_halt = QIcon(bitmap_halt)
+        cls.icon_refresh = QIcon(bitmap_refresh)
+
+
+        path = os.path.join(os.path.dirname(__file__), "icon.png")
+        icon_multiframing = QPixmap(path)
+        p = QPainter()
+        p.begin(icon_multiframing)
+        offset = (icon_multiframing.size().width()/3, icon_multiframing.size().height()/3)
+        p.drawPixmap(QPointF(*offset), QPixmap(icon_multiframing))
         p.end()
+        cls.icon_multiframing = QIcon(icon_multiframing)
+
+        icon_content_bound = QPixmap(path)
+        p = QPainter()
+        p.begin(icon_content_bound)
+        r = QRect(0, 0, 150, 150)
+        r.moveCenter(icon_content_bound.rect().center())
+        p.setBrush(Qt.white)
+        p.drawRect(r)
+        p.end()
+        cls.icon_content_bound = QIcon(icon_content_bound)
+
+        icon_bake = icons_cache.get_pixmap('bake', 255, 255, cls.draw_icon_bake)
+        cls.icon_bake = QIcon(icon_bake)
+
+        size = 20
+        cls.icon_halt_mini_pixmap = icons_cache.get_pixmap('halt', 50, 50, cls.draw_icon_halt).scaled(
+                                            size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+        icon_slice_background = icons_cache.get_pixmap('slice_background', 512, 512,
+                                                            cls.draw_icon_slice_background)
         cls.icon_slice_background = QIcon(icon_slice_background)
 
     @staticmethod
@@ -318,6 +343,8 @@ class LayerOpacity(Enum):
     HalfTransparent = 2
     Opaque = 3
 
+SINGLE_INSTANCE_TIMEOUT_MSEC = 500
+
 class RequestType(Enum):
     Fragment = 0
     Fullscreen = 1
@@ -1165,6 +1192,8 @@ class CanvasEditor(QWidget, ElementsMixin, EditorAutotestMixin):
 
         self.monitors_rects_snapping = True
 
+        self.init_mouse_move_coalescing()
+
     def set_saved_capture_frame(self):
         if self.tools_settings.get("savecaptureframe", False):
             rect_params = self.tools_settings.get("capture_frame", None)
@@ -1192,7 +1221,14 @@ class CanvasEditor(QWidget, ElementsMixin, EditorAutotestMixin):
         self.update_tools_window()
         self.update()
 
+    def get_proxy_max_side(self):
+        # уменьшенные копии больших изображений не больше экрана
+        screen = QApplication.primaryScreen()
+        size = screen.size()*screen.devicePixelRatio()
+        return max(size.width(), size.height())
+
     def request_images_editor_mode(self, paths_or_pixmaps, burstmode=False):
+        self.collage_mode = True
         pixmaps = []
         self.input_POINT2 = QPoint(0, 0)
         self.input_POINT1 = self.frameGeometry().bottomRight()
@@ -1207,22 +1243,30 @@ class CanvasEditor(QWidget, ElementsMixin, EditorAutotestMixin):
         elementTopLeft = QPointF(0, 0)
         elementBottomRight = QPointF(0, 0)
 
-        def append_pixmap(pixmap):
+        def append_pixmap(pixmap, source_filepath=None, source_size=None, source_frame_index=None):
             nonlocal elementBottomRight, elementTopLeft, first_pixmap_center
             if pixmap.width() != 0:
                 element = self.elementsCreateNew(ToolID.picture)
                 element.pixmap = pixmap
-                elementBottomRight = elementTopLeft + QPointF(pixmap.width(), pixmap.height())
+                element.source_filepath = source_filepath
+                element.source_frame_index = source_frame_index
+                self.elementsTrackAnimatedFramePlaceholder(element)
+                if source_size is not None:
+                    # в элементе уменьшенная копия, размеры же соответствуют оригиналу
+                    element.source_size = (source_size.width(), source_size.height())
+                    element.source_frame_rect = (0, 0, source_size.width(), source_size.height())
+                element.calc_local_data()
+                width, height = element.width, element.height
+                elementBottomRight = elementTopLeft + QPointF(width, height)
                 points.append(QPointF(elementTopLeft))
                 points.append(QPointF(elementBottomRight))
                 element.position = (elementTopLeft + elementBottomRight) / 2.0
                 if first_pixmap_center is None:
                     first_pixmap_center = element.position
-                element.calc_local_data()
                 if burstmode:
-                    elementTopLeft += QPointF(0, pixmap.height())
+                    elementTopLeft += QPointF(0, height)
                 else:
-                    elementTopLeft += QPointF(pixmap.width(), 0)
+                    elementTopLeft += QPointF(width, 0)
                 pixmaps.append(pixmap)
 
         for path_or_pix in paths_or_pixmaps:
@@ -1235,15 +1279,40 @@ class CanvasEditor(QWidget, ElementsMixin, EditorAutotestMixin):
             elif path_or_pix == self.Globals.CLIPBOARD_FILEPATH:
                 pixmap = QPixmap.fromImage(QApplication.clipboard().image())
                 append_pixmap(pixmap)
-            elif path_or_pix.lower().endswith(".gif"):
-                movie = QMovie(path_or_pix)
-                for i in range(movie.frameCount()):
-                    movie.jumpToFrame(i)
-                    pixmap = movie.currentPixmap()
-                    append_pixmap(pixmap)
+            elif path_or_pix.lower().endswith(".gif") or \
+                    (path_or_pix.lower().endswith(".webp") and is_webp_file_animated(path_or_pix)):
+                # кадры декодируются в фоне, а пока вместо них показываются заглушки
+                filepath = os.path.abspath(path_or_pix)
+                frame_source = self.elementsGetAnimatedFrameSource(filepath)
+                frame_size = frame_source.frame_size
+                if frame_size.isEmpty():
+                    continue
+                frames_count = frame_source.frameCount()
+                # на уменьшенные копии всех кадров отводится ограниченный объём памяти
+                scale = min(1.0, math.sqrt(Globals.ANIMATED_FRAMES_PIXELS_BUDGET/frames_count/
+                                                        (frame_size.width()*frame_size.height())))
+                proxy_size = QSize(max(1, int(frame_size.width()*scale)),
+                                                        max(1, int(frame_size.height()*scale)))
+                placeholder = QPixmap(proxy_size)
+                placeholder.fill(QColor(128, 128, 128))
+                self.animated_frame_placeholders[placeholder.cacheKey()] = dict()
+                for frame_number in range(frames_count):
+                    append_pixmap(placeholder, source_filepath=filepath,
+                        source_size=frame_size if scale < 1.0 else None,
+                        source_frame_index=frame_number,
+                    )
+                frame_source.frame_ready.connect(partial(self.elementsAnimatedFrameReady,
+                                                    frame_source, placeholder.cacheKey(), proxy_size))
+                frame_source.request(0)
             else:
-                pixmap = load_image_respect_orientation(path_or_pix)
-                append_pixmap(pixmap)
+                proxy_image, source_size = load_image_proxy_respect_orientation(path_or_pix,
+                                                                            self.get_proxy_max_side())
+                pixmap = QPixmap.fromImage(proxy_image)
+                if source_size != proxy_image.size():
+                    append_pixmap(pixmap, source_filepath=os.path.abspath(path_or_pix),
+                                                                        source_size=source_size)
+                else:
+                    append_pixmap(pixmap)
 
         if pixmaps:
             self.input_POINT2, self.input_POINT1 = get_bounding_pointsF(points)
@@ -1292,6 +1361,7 @@ class CanvasEditor(QWidget, ElementsMixin, EditorAutotestMixin):
             self.view_window.show()
             self.view_window.activateWindow()
         else:
+            from image_viewer_lite import ViewerWindow
             self.view_window = ViewerWindow(self, main_window=self, _type=_type, data=data)
             self.place_view_window()
             pixmap = get_pixmap_callback_func()
@@ -1299,6 +1369,7 @@ class CanvasEditor(QWidget, ElementsMixin, EditorAutotestMixin):
             self.view_window.activateWindow()
 
     def show_view_window_for_animated(self, filepath):
+        from image_viewer_lite import ViewerWindow
         self.view_window = ViewerWindow(self, main_window=self, _type="final", data=None)
         self.place_view_window()
         self.view_window.show_image(filepath)
@@ -1346,7 +1417,7 @@ class CanvasEditor(QWidget, ElementsMixin, EditorAutotestMixin):
         if restart:
             # restart
             if grabbed_image or not Globals.save_to_memory_mode:
-                restart_app_in_notification_mode(filepath)
+                restart_app_in_notification_mode(filepath, thumbnail_source=grabbed_image or pix)
 
     def create_tools_window_if_needed(self):
         if not self.tools_window:
@@ -1479,7 +1550,65 @@ class CanvasEditor(QWidget, ElementsMixin, EditorAutotestMixin):
         else:
             raise Exception('Deprecated')
 
+    def init_mouse_move_coalescing(self):
+        # мышки с высокой частотой опроса присылают событий перемещения
+        # намного больше, чем успевает отрисоваться кадров, поэтому
+        # обрабатываем не чаще одного события за кадр, а промежуточные
+        # позиции сохраняем для свободного рисования пером и маркером
+        refresh_rate = QGuiApplication.primaryScreen().refreshRate() or 60.0
+        self.mouse_move_coalesce_timer = QTimer()
+        self.mouse_move_coalesce_timer.setSingleShot(True)
+        self.mouse_move_coalesce_timer.setInterval(max(1, int(1000/refresh_rate)))
+        self.mouse_move_coalesce_timer.timeout.connect(self.mouse_move_coalesce_tick)
+        self.mouse_move_pending_event = None
+        self.mouse_move_intermediate_positions = []
+        self.mouse_move_raw_events_count = 0
+        self.mouse_move_processed_events_count = 0
+
+    def copy_mouse_event(self, event):
+        # Qt переиспользует объекты событий, поэтому для отложенной обработки нужна копия
+        return QMouseEvent(event.type(), event.localPos(), event.windowPos(), event.screenPos(),
+                                        event.button(), event.buttons(), event.modifiers())
+
+    def mouse_move_coalesce_tick(self):
+        if self.mouse_move_pending_event is not None:
+            event = self.mouse_move_pending_event
+            self.mouse_move_pending_event = None
+            self.process_mouse_move_event(event)
+            self.mouse_move_coalesce_timer.start()
+
+    def flush_coalesced_mouse_move(self):
+        # вызывается перед нажатием и отпусканием кнопок мыши,
+        # чтобы отложенное перемещение не обработалось после них
+        self.mouse_move_coalesce_timer.stop()
+        self.mouse_move_coalesce_tick()
+        self.mouse_move_coalesce_timer.stop()
+
     def mouseMoveEvent(self, event):
+        self.mouse_move_raw_events_count += 1
+        if not Globals.COALESCE_MOUSE_MOVE_EVENTS:
+            self.process_mouse_move_event(event)
+        elif self.mouse_move_coalesce_timer.isActive():
+            if self.mouse_move_pending_event is not None:
+                self.mouse_move_intermediate_positions.append(self.mouse_move_pending_event.localPos())
+            self.mouse_move_pending_event = self.copy_mouse_event(event)
+        else:
+            self.process_mouse_move_event(event)
+            self.mouse_move_coalesce_timer.start()
+
+    def get_mouse_move_coalescing_ratio(self):
+        if self.mouse_move_processed_events_count == 0:
+            return 1.0
+        return self.mouse_move_raw_events_count/self.mouse_move_processed_events_count
+
+    def process_mouse_move_event(self, event):
+        self.mouse_move_processed_events_count += 1
+        self.do_mouse_move(event)
+        # промежуточные позиции забирает только свободное рисование,
+        # для остальных случаев достаточно последней позиции
+        self.mouse_move_intermediate_positions.clear()
+
+    def do_mouse_move(self, event):
         if self.tools_window:
             select_window = self.tools_window.select_window
             if select_window and select_window.isVisible():
@@ -1584,6 +1713,8 @@ class CanvasEditor(QWidget, ElementsMixin, EditorAutotestMixin):
         # super().mouseMoveEvent(event)
 
     def mousePressEvent(self, event):
+        self.flush_coalesced_mouse_move()
+
         if event.button() == Qt.MiddleButton:
             self.start_canvas_origin = QPointF(self.canvas_origin)
             self.ocp = event.pos()
@@ -1615,6 +1746,7 @@ class CanvasEditor(QWidget, ElementsMixin, EditorAutotestMixin):
         super().mousePressEvent(event)
 
     def mouseReleaseEvent(self, event):
+        self.flush_coalesced_mouse_move()
 
         if self.elementsTextElementMouseReleaseEvent(event):
             return
@@ -1721,8 +1853,10 @@ class CanvasEditor(QWidget, ElementsMixin, EditorAutotestMixin):
         self.set_spinboxes_to_menu(menu, spinboxes)
 
         menu.addSeparator()
-        do_action = menu.addAction('Выложить')
-        do_action.triggered.connect(self.elementsArrangeInGrid)
+        do_action = menu.addAction('Выложить рядами')
+        do_action.triggered.connect(lambda: self.elementsArrangeInGrid())
+        columns_action = menu.addAction('Выложить колонками')
+        columns_action.triggered.connect(lambda: self.elementsArrangeInGrid(columns=True))
         cancel_action = menu.addAction('Отмена')
 
         action = menu.exec_(QCursor().pos())
@@ -1793,7 +1927,8 @@ class CanvasEditor(QWidget, ElementsMixin, EditorAutotestMixin):
 
         sel_elem = self.active_element
         if sel_elem and sel_elem.oxxxy_type == ToolID.picture:
-            if sel_elem.backup_pixmap is not None:
+            # кусок нарезанного фона ссылается на весь фон, отмена обрезки превратила бы его в весь фон
+            if sel_elem.backup_pixmap is not None and sel_elem.pixmap_source_rect is None:
                 addItem("Отменить обрезку выделенного изображения", self.elementsFramePicture)
             addItem("Обрезать выделенное изображение", do_set_image_frame)
             sep()
@@ -1872,6 +2007,7 @@ class CanvasEditor(QWidget, ElementsMixin, EditorAutotestMixin):
             ("Показывать дебаг-отрисовку для виджета трансформации", self.canvas_debug_transform_widget, partial(toggle_boolean_var_generic, self, 'canvas_debug_transform_widget')),
             ("Антиальясинг и сглаживание пиксмапов", Globals.ANTIALIASING_AND_SMOOTH_PIXMAP_TRANSFORM, partial(toggle_boolean_var_generic, Globals, 'ANTIALIASING_AND_SMOOTH_PIXMAP_TRANSFORM')),
             ("Pixmap-прокси для пометок типа «Текст»", Globals.USE_PIXMAP_PROXY_FOR_TEXT_ELEMENTS, partial(toggle_boolean_var_generic, Globals, 'USE_PIXMAP_PROXY_FOR_TEXT_ELEMENTS')),
+            ("Обрабатывать перемещения мыши не чаще частоты обновления экрана", Globals.COALESCE_MOUSE_MOVE_EVENTS, partial(toggle_boolean_var_generic, Globals, 'COALESCE_MOUSE_MOVE_EVENTS')),
             ("DEBUG", Globals.DEBUG, partial(toggle_boolean_var_generic, Globals, 'DEBUG')),
         )
 
@@ -2006,7 +2142,6 @@ class CanvasEditor(QWidget, ElementsMixin, EditorAutotestMixin):
             self.save_tools_settings()
         if Globals.close_editor_on_done or force_close:
             if self.tools_window:
-                self.tools_window.update_timer.stop()
                 self.tools_window.hide()
             self.close()
         else:
@@ -2087,6 +2222,9 @@ class CanvasEditor(QWidget, ElementsMixin, EditorAutotestMixin):
         self.update()
 
     def keyReleaseEvent(self, event):
+        if event.key() == Qt.Key_Control and self.tools_window:
+            self.tools_window.update_modifiers_dependent_buttons()
+
         if not event.isAutoRepeat():
             # сюда попадём только когда отпускается клавиша,
             # во вне условия будет срабатывать постоянно пока зажата клавиша
@@ -2111,6 +2249,9 @@ class CanvasEditor(QWidget, ElementsMixin, EditorAutotestMixin):
     def keyPressEvent(self, event):
         key = event.key()
 
+        if key == Qt.Key_Control and self.tools_window:
+            self.tools_window.update_modifiers_dependent_buttons()
+
         if self.elementsTextElementKeyPressEventHandler(event):
             return
 
@@ -2356,15 +2497,45 @@ def unregister_global_hotkeys():
         pass
     Globals.registred_key_seqs.clear()
 
-def restart_app_in_notification_mode(filepath):
+def get_notification_thumbnail_data(image):
+    if image is None or image.isNull():
+        return None
+    image = image.scaled(NotificationOrMenu.WIDTH, NotificationOrMenu.THUMBNAIL_HEIGHT,
+                                                    Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    byte_array = QByteArray()
+    buffer = QBuffer(byte_array)
+    buffer.open(QIODevice.WriteOnly)
+    image.save(buffer, "JPG", 90)
+    buffer.close()
+    return bytes(byte_array)
+
+def restart_app_in_notification_mode(filepath, thumbnail_source=None):
 
     notification_entry_point_filepath = os.path.join(
         os.path.dirname(__file__),
         'oxxxy_notification.py'
     )
     args = [sys.executable, notification_entry_point_filepath,
-                                                         filepath, "-notification", '-user_mode']
-    subprocess.Popen(args)
+                                                         filepath, "-notification", '-user_mode',
+                                                         '-launch_time', str(time.time())]
+    # миниатюра уходит процессу уведомления через stdin,
+    # чтобы ему не пришлось заново читать и декодировать сохранённый файл
+    thumbnail_data = get_notification_thumbnail_data(thumbnail_source)
+    if thumbnail_data:
+        args.append('-thumbnail')
+    if Globals.DEBUG:
+        args.append('-debug')
+    SettingsJson().flush()
+    if thumbnail_data:
+        process = subprocess.Popen(args, stdin=subprocess.PIPE)
+        try:
+            process.stdin.write(thumbnail_data)
+            process.stdin.close()
+        except OSError:
+            # процесс уведомления завершился раньше, чем прочитал миниатюру
+            pass
+    else:
+        subprocess.Popen(args)
 
 def show_system_tray(app, icon):
     sti = QSystemTrayIcon(app)
@@ -2510,6 +2681,101 @@ def invoke_screenshot_editor(request_type=None, filepaths_or_pixmaps=None, save_
             app = QApplication.instance()
             app.exit()
 
+def get_single_instance_server_name():
+    # имя зависит от пользователя, чтобы разные сеансы на одной машине не мешали друг другу
+    user = os.environ.get('USERNAME', os.environ.get('USER', ''))
+    return f'oxxxy_screenshoter_{user}'
+
+def forward_request_to_running_instance(paths):
+    # если приложение уже висит в трее, то отдаём ему запрос и сразу выходим,
+    # тогда не придётся заново поднимать Qt в этом процессе
+    from PyQt5.QtNetwork import QLocalSocket
+    socket = QLocalSocket()
+    socket.connectToServer(get_single_instance_server_name())
+    if not socket.waitForConnected(SINGLE_INSTANCE_TIMEOUT_MSEC):
+        return False
+    request = {'paths': [os.path.abspath(path) for path in paths]}
+    socket.write(json.dumps(request).encode('utf8') + b'\n')
+    socket.waitForBytesWritten(SINGLE_INSTANCE_TIMEOUT_MSEC)
+    accepted = socket.waitForReadyRead(SINGLE_INSTANCE_TIMEOUT_MSEC) and \
+                                            bytes(socket.readAll()).startswith(b'ok')
+    socket.disconnectFromServer()
+    return accepted
+
+def start_single_instance_server():
+    from PyQt5.QtNetwork import QLocalServer, QLocalSocket
+    name = get_single_instance_server_name()
+    server = QLocalServer()
+    if not server.listen(name):
+        # имя занято: либо другой экземпляр жив, либо от упавшего процесса остался сокет
+        socket = QLocalSocket()
+        socket.connectToServer(name)
+        if socket.waitForConnected(SINGLE_INSTANCE_TIMEOUT_MSEC):
+            # живой сервер не трогаем
+            socket.disconnectFromServer()
+            return None
+        QLocalServer.removeServer(name)
+        if not server.listen(name):
+            return None
+    server.newConnection.connect(partial(single_instance_server_new_connection, server))
+    Globals.single_instance_server = server
+    return server
+
+def stop_single_instance_server():
+    if Globals.single_instance_server:
+        Globals.single_instance_server.close()
+        Globals.single_instance_server = None
+
+def single_instance_server_new_connection(server):
+    while server.hasPendingConnections():
+        socket = server.nextPendingConnection()
+        buffer = bytearray()
+        def on_ready_read(socket=socket, buffer=buffer):
+            buffer.extend(bytes(socket.readAll()))
+            if b'\n' not in buffer:
+                return
+            data = bytes(buffer).split(b'\n', 1)[0]
+            if is_editor_busy():
+                # второй редактор в этом процессе не создаётся, поэтому отказываем,
+                # и запросивший процесс откроет файлы сам
+                socket.write(b'busy\n')
+                socket.flush()
+                socket.disconnectFromServer()
+                return
+            socket.write(b'ok\n')
+            socket.flush()
+            socket.disconnectFromServer()
+            # запрос обрабатываем уже после ответа, чтобы клиент не ждал открытия редактора
+            QTimer.singleShot(0, partial(handle_single_instance_request, data))
+        socket.readyRead.connect(on_ready_read)
+        socket.disconnected.connect(socket.deleteLater)
+
+def is_editor_busy():
+    return bool(Globals._canvas_editor and Globals._canvas_editor.isVisible())
+
+def handle_single_instance_request(data):
+    try:
+        request = json.loads(data.decode('utf8'))
+    except ValueError:
+        return
+    paths = [path for path in request.get('paths', []) if os.path.exists(path)]
+    open_paths_in_editor(paths)
+
+def open_paths_in_editor(paths):
+    if not paths:
+        return
+    if is_editor_busy():
+        # редактор уже открыт, второй в этом процессе не создаём;
+        # запросы от других процессов сюда не попадают, им отказывает сервер
+        Globals._canvas_editor.activateWindow()
+        return
+    projects_paths = [path for path in paths if path.lower().endswith('.oxxxyshot')]
+    if projects_paths:
+        invoke_screenshot_editor(request_type=RequestType.Fragment)
+        Globals._canvas_editor.open_project(project_filepath=projects_paths[0])
+    else:
+        invoke_screenshot_editor(request_type=RequestType.Editor, filepaths_or_pixmaps=paths)
+
 def show_crash_log(alert=True):
     path = get_crashlog_filepath()
     if os.path.exists(path):
@@ -2592,6 +2858,8 @@ def exit_threads():
 
 def _restart_app(aftercrash=False):
     # Обязательный перезапуск после созданного скриншота или отмены!
+    # настройки сохраняем до запуска нового процесса, иначе он может прочитать старые
+    SettingsJson().flush()
     if aftercrash:
         subprocess.Popen([sys.executable, sys.argv[0], "-aftercrash"])
     else:
@@ -2640,6 +2908,7 @@ class PrepareThreadImageData():
         self._ui_list_item_widget = None
 
         self.error = False
+        self.scheduled = False
 
         self.__class__.input_list.append(self)
         InputFilesTrayWindow.instance.add_image_data_to_ui(self,
@@ -2664,6 +2933,41 @@ class PrepareThreadImageData():
             stream >> self
 
 
+class PrepareImageTask(QRunnable):
+
+    def __init__(self, image_data, prepare_thread):
+        super().__init__()
+        self.image_data = image_data
+        self.prepare_thread = prepare_thread
+
+    def run(self):
+        image_data = self.image_data
+        PREVIEW_WIDTH = Globals.PREVIEW_WIDTH
+        size_key = f"{PREVIEW_WIDTH}w"
+        try:
+            preview = Globals.thumbnails_cache.load(image_data.filepath, size_key)
+            if preview is not None and preview.text('source_size'):
+                source_size = QSize(*(int(v) for v in preview.text('source_size').split('x')))
+            else:
+                # полное изображение здесь не декодируется, его загрузит редактор
+                preview, source_size = load_image_preview_respect_orientation(image_data.filepath,
+                                                                                    PREVIEW_WIDTH)
+                if not preview.isNull():
+                    # размер оригинала хранится прямо в PNG миниатюры
+                    preview.setText('source_size', f'{source_size.width()}x{source_size.height()}')
+                    Globals.thumbnails_cache.store(image_data.filepath, size_key, preview)
+            if preview.isNull():
+                image_data.error = True
+            else:
+                image_data.source_width = source_size.width()
+                image_data.source_height = source_size.height()
+                image_data.preview_size = preview.size()
+                # QPixmap из QImage делается уже в главном потоке
+                image_data.preview = preview
+        except:
+            image_data.error = True
+        self.prepare_thread.update_signal.emit(image_data)
+
 class PrepareThread(QThread):
     update_signal = pyqtSignal(object)
 
@@ -2673,41 +2977,31 @@ class PrepareThread(QThread):
         super().__init__()
         self.__class__.instance = self
         self.update_signal.connect(InputFilesTrayWindow.instance.updatePreview)
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(max(1, QThread.idealThreadCount()))
 
     def start(self):
         super().start(QThread.IdlePriority)
 
     def run(self):
-        for image_data in PrepareThreadImageData.input_list[:]:
-            if image_data.source or image_data.error:
-                continue
-
-            self.msleep(1) # switch to main thread to simulate (cause Python's GIL) multithreading
-
-            try:
-                source = load_image_respect_orientation(image_data.filepath)
-                if source.isNull():
-                    image_data.error = True
-                else:
-                    image_data.source = source
-            except:
-                image_data.error = True
-
-
-            # preview
-            image_data.source_width = ow = source.width()
-            image_data.source_height = oh = source.height()
-
-            PREVIEW_WIDTH = Globals.PREVIEW_WIDTH
-            preview_height = int(oh*PREVIEW_WIDTH/ow) if ow > 0 else 0
-            image_data.preview_size = QSize(PREVIEW_WIDTH, preview_height)
-            if ow != 0:
-                preview = source.scaled(PREVIEW_WIDTH, preview_height,
-                    Qt.KeepAspectRatioByExpanding, Qt.SmoothTransformation
-                )
-                image_data.preview = preview
+        # файлы могут добавляться и во время обработки, поэтому крутимся, пока есть новые
+        while True:
+            scheduled = False
+            for image_data in PrepareThreadImageData.input_list[:]:
+                if image_data.scheduled or image_data.error:
+                    continue
+                image_data.scheduled = True
+                scheduled = True
+                self.pool.start(PrepareImageTask(image_data, self))
+            if not scheduled:
+                break
+            self.pool.waitForDone()
 
-            self.update_signal.emit(image_data)
+    def terminate(self):
+        # задачи, которые ещё не начались, выбрасываем,
+        # а результаты уже запущенных отбросит InputFilesTrayWindow.updatePreview
+        self.pool.clear()
+        super().terminate()
 
 def kick_prepare_thread():
     pt_instance = PrepareThread.instance
@@ -2718,6 +3012,49 @@ def kick_prepare_thread():
     if pt_instance and not pt_instance.isRunning():
         pt_instance.start()
 
+class FolderScanThread(QThread):
+    # папки сканируются в фоне, найденные картинки
+    # отдаются на подготовку превью порциями, не дожидаясь конца сканирования
+    batch_ready = pyqtSignal(list)
+
+    instances = []
+
+    def __init__(self, folder_path, recursive):
+        super().__init__()
+        self.folder_path = folder_path
+        self.recursive = recursive
+        self.cancelled = False
+        self.batch_ready.connect(self.on_batch_ready)
+        self.finished.connect(self.on_finished)
+        self.instances.append(self)
+        Globals.background_threads.append(self)
+
+    def run(self):
+        batches = Globals.image_files_scanner.scan(self.folder_path,
+            recursive=self.recursive, is_cancelled=lambda: self.cancelled)
+        for batch in batches:
+            self.batch_ready.emit(batch)
+
+    def on_batch_ready(self, paths):
+        if self.cancelled or InputFilesTrayWindow.instance is None:
+            return
+        if Globals.DEBUG:
+            print(f'Folder scan batch: {len(paths)} files from {self.folder_path}')
+        for path in paths:
+            PrepareThreadImageData(path)
+        kick_prepare_thread()
+
+    def on_finished(self):
+        if self in self.instances:
+            self.instances.remove(self)
+        if self in Globals.background_threads:
+            Globals.background_threads.remove(self)
+
+    @classmethod
+    def cancel_all(cls):
+        for thread in cls.instances:
+            thread.cancelled = True
+
 class BurstModeThread(QThread):
 
     update_signal = pyqtSignal(object)
@@ -2785,40 +3122,73 @@ def burst_mode_dispatcher():
         update_sys_tray_icon(len(Globals.burst_mode_screenshots), divider=2.0)
     burst_mode_timer()
 
-def download_file(url):
-    try:
-        response = urllib.request.urlopen(url)
-    except http.client.InvalidURL:
-        try:
-            url = url.replace(" ", "%20")
-            response = urllib.request.urlopen(url)
-        except Exception as e:
-            return None
-    except Exception as e:
-        return
-    filename = os.path.basename(response.url)
-    name, ext = os.path.splitext(filename)
-    if "?" in ext:
-        ext = ext[:ext.index("?")]
-    if True:
-        # assuming that fileext is supported
-        mime_type = response.headers.get('content-type', '')
-        if mime_type == '':
-            ext = 'unknown'
-        else:
-            if ';' in mime_type:
-                mime_type = mime_type.split(";")[0]
-            ext = mime_type.split("/")[1]
-    SettingsWindow.set_screenshot_folder_path()
-    downloads_folder = os.path.join(Globals.SCREENSHOT_FOLDER_PATH, 'oxxxy_download')
-    if not os.path.exists(downloads_folder):
-        os.makedirs(downloads_folder)
-    if not ext.startswith("."):
-        ext = f'.{ext}'
-    filepath = os.path.join(downloads_folder, f'{time.time()}{ext}')
-    # downloads the file
-    urllib.request.urlretrieve(url, filepath)
-    return filepath
+class DownloadTask(QRunnable):
+
+    def __init__(self, url, folder_path, name, manager):
+        super().__init__()
+        self.url = url
+        self.folder_path = folder_path
+        self.name = name
+        self.manager = manager
+        # закачки, начатые до отмены, прерываются
+        self.generation = manager.generation
+
+    def run(self):
+        filepath = download_url_to_folder(self.url, self.folder_path, self.name,
+                            is_cancelled=lambda: self.generation != self.manager.generation)
+        self.manager.download_finished.emit(self.url, filepath or "")
+
+class DownloadsManager(QObject):
+    # ссылки качаются в фоне по несколько штук сразу,
+    # готовые файлы по мере скачивания отдаются на подготовку превью
+    download_finished = pyqtSignal(str, str)
+
+    MAX_CONCURRENT_DOWNLOADS = 4
+
+    instance = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls.instance is None:
+            cls.instance = cls()
+        return cls.instance
+
+    def __init__(self):
+        super().__init__()
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(self.MAX_CONCURRENT_DOWNLOADS)
+        self.download_finished.connect(self.on_download_finished)
+        self.downloads_counter = 0
+        self.generation = 0
+
+    @classmethod
+    def cancel_all(cls):
+        if cls.instance is None:
+            return
+        # ещё не начатые закачки убираются из очереди, начатые прервутся на следующей порции
+        cls.instance.pool.clear()
+        cls.instance.generation += 1
+
+    def add_urls(self, urls):
+        # папку спрашиваем заранее, в главном потоке, так как может понадобиться диалог
+        SettingsWindow.set_screenshot_folder_path()
+        downloads_folder = os.path.join(Globals.SCREENSHOT_FOLDER_PATH, 'oxxxy_download')
+        if not os.path.exists(downloads_folder):
+            os.makedirs(downloads_folder)
+        for url in urls:
+            self.downloads_counter += 1
+            name = f'{time.time()}_{self.downloads_counter}'
+            self.pool.start(DownloadTask(url, downloads_folder, name, self))
+
+    def on_download_finished(self, url, filepath):
+        if not filepath:
+            if Globals.DEBUG:
+                print(f'Download failed: {url}')
+            return
+        if InputFilesTrayWindow.instance is None:
+            return
+        PrepareThreadImageData(filepath)
+        kick_prepare_thread()
 
 def compile_mode_input_files_drop_event(drop_event_data=None):
 
@@ -2830,23 +3200,16 @@ def compile_mode_input_files_drop_event(drop_event_data=None):
 
     if drop_event_data is not None:
         paths = []
+        urls = []
         for url in drop_event_data.mimeData().urls():
             if url.isLocalFile():
                 path = str(url.toLocalFile())
                 if os.path.isdir(path):
-                    for cur_dir, folders, files in os.walk(path):
-                        for filename in files:
-                            filepath = os.path.join(cur_dir, filename)
-                            paths.append(filepath)
-                        if not deep_scan:
-                            break
+                    FolderScanThread(path, deep_scan).start()
                 elif os.path.isfile(path):
                     paths.append(path)
             else:
-                url = url.url()
-                filepath = download_file(url)
-                if filepath:
-                    paths.append(filepath)
+                urls.append(url.url())
         if Globals.DEBUG:
             to_print = f'Drop Event Data Local Paths: {paths}'
             print(to_print)
@@ -2854,6 +3217,8 @@ def compile_mode_input_files_drop_event(drop_event_data=None):
             for path in paths:
                 PrepareThreadImageData(path)
             kick_prepare_thread()
+        if urls:
+            DownloadsManager.get_instance().add_urls(urls)
 
 def compile_mode_input_files_start():
     inst = InputFilesTrayWindow.instance
@@ -2886,6 +3251,8 @@ NotificationOrMenu.gl.compile_mode_input_files_drop_event = compile_mode_input_f
 NotificationOrMenu.gl.compile_mode_input_files_start = compile_mode_input_files_start
 NotificationOrMenu.gl.PrepareThreadImageData = PrepareThreadImageData
 NotificationOrMenu.gl.PrepareThread = PrepareThread
+NotificationOrMenu.gl.FolderScanThread = FolderScanThread
+NotificationOrMenu.gl.DownloadsManager = DownloadsManager
 InputFilesTrayWindow.gl = NotificationOrMenu.gl
 NotifyDialog.Globals = Globals
 QuitDialog.Globals = Globals
@@ -2933,23 +3300,27 @@ def _main():
     if Globals.CRASH_SIMULATOR:
         1 / 0
 
-    RERUN_ARG = '-rerun'
-    if not Globals.DEBUG:
-        if (RERUN_ARG not in sys.argv) and ("-aftercrash" not in sys.argv):
-            subprocess.Popen([sys.executable, *sys.argv, RERUN_ARG])
-            sys.exit()
-
     # разбор аргументов
     parser = argparse.ArgumentParser()
-    parser.add_argument('path', nargs='?', default=None)
-    # введения переменной this_filepath ниже
+    parser.add_argument('paths', nargs='*', default=None)
     parser.add_argument('-user_mode', help="", action="store_true")
     parser.add_argument('-notification', help="", action="store_true")
     parser.add_argument('-aftercrash', help="", action="store_true")
     parser.add_argument('-rerun', help="", action="store_true")
     args = parser.parse_args(sys.argv[1:])
-    if args.path:
-        path = args.path
+    path = args.paths[0] if args.paths else None
+
+    if args.paths and not args.notification and not (Globals.DEBUG or Globals.RUN_ONCE):
+        # файлы открывает уже запущенный экземпляр, если он есть
+        if forward_request_to_running_instance(args.paths):
+            sys.exit(0)
+
+    RERUN_ARG = '-rerun'
+    if not Globals.DEBUG:
+        if (RERUN_ARG not in sys.argv) and ("-aftercrash" not in sys.argv):
+            subprocess.Popen([sys.executable, *sys.argv, RERUN_ARG])
+            sys.exit()
+
     if args.user_mode:
         Globals.DEBUG = False
     if args.aftercrash:
@@ -2984,7 +3355,7 @@ def _main():
     registred_hotkeys = False
     if args.notification:
         # notification mode
-        notification = NotificationOrMenu(notification=True, filepath=args.path)
+        notification = NotificationOrMenu(notification=True, filepath=path)
         notification.place_window()
     else:
         # editor mode
@@ -3006,8 +3377,11 @@ def _main():
             init_global_hotkeys_base()
             register_user_global_hotkeys()
             stray_icon = show_system_tray(app, icon)
+            start_single_instance_server()
+            open_paths_in_editor(args.paths)
     # вход в петлю сообщений
     app.exec_()
+    stop_single_instance_server()
     # после закрытия апликухи
     stray_icon = app.property("stray_icon")
     if stray_icon:
@@ -20,10 +20,141 @@
 
 """
 Oxxxy NOTIFICATION RUNNING MODE Entry Point
+
+Точка входа облегчённая: для показа уведомления импортируется только окно уведомления,
+а редактор со всеми элементами подгружается лишь тогда, когда пользователь его запросит
 """
 
-import oxxxy_main
+import time
+START_TIME = time.time()
+
+import sys
+import os
+import argparse
+import traceback
+
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import QTimer
+from PyQt5.QtGui import QPixmap, QIcon
+
+from _utils import SettingsJson
+from oxxxy_aux_ui import NotificationGlobals, NotificationOrMenu, SettingsWindow
+
+
+def import_oxxxy_main():
+    # полноценное приложение нужно только для открытия скриншота в редакторе
+    import oxxxy_main
+    if not getattr(import_oxxxy_main, 'initialized', False):
+        import_oxxxy_main.initialized = True
+        oxxxy_main.Globals.DEBUG = False
+        oxxxy_main.read_settings_file()
+        app = QApplication.instance()
+        if app:
+            oxxxy_main.Globals.generate_icons()
+            oxxxy_main.Globals.load_fonts()
+            app.aboutToQuit.connect(oxxxy_main.exit_threads)
+    return oxxxy_main
+
+class LazyRequestType():
+    # имена совпадают с oxxxy_main.RequestType
+    Fragment = 'Fragment'
+    Fullscreen = 'Fullscreen'
+    Editor = 'Editor'
+
+class LazyGlobalFunctions():
+
+    @staticmethod
+    def invoke_screenshot_editor(request_type=None, **kwargs):
+        oxxxy_main = import_oxxxy_main()
+        request_type = oxxxy_main.RequestType[request_type]
+        oxxxy_main.invoke_screenshot_editor(request_type=request_type, **kwargs)
+
+    @staticmethod
+    def _restart_app(*args, **kwargs):
+        import_oxxxy_main()._restart_app(*args, **kwargs)
+
+    @staticmethod
+    def show_crash_log(*args, **kwargs):
+        import_oxxxy_main().show_crash_log(*args, **kwargs)
+
+    @staticmethod
+    def get_crashlog_filepath():
+        return import_oxxxy_main().get_crashlog_filepath()
+
+def read_thumbnail_data():
+    if sys.stdin is None:
+        return None
+    try:
+        return sys.stdin.buffer.read()
+    except OSError:
+        return None
+
+def report_latency(launch_time):
+    shown_time = time.time()
+    msg = f'notification shown: {(shown_time - START_TIME)*1000:.0f} ms after process start'
+    if launch_time is not None:
+        msg += f', {(shown_time - launch_time)*1000:.0f} ms after save'
+    if NotificationGlobals.DEBUG:
+        print(msg)
+
+def excepthook(exc_type, exc_value, exc_tb):
+    # oxxxy_main подгружается только при краше: пишет краш-лог и перезапускает приложение
+    oxxxy_main = import_oxxxy_main()
+    oxxxy_main.excepthook(exc_type, exc_value, exc_tb)
+
+def _main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', nargs='?', default=None)
+    parser.add_argument('-user_mode', help="", action="store_true")
+    parser.add_argument('-notification', help="", action="store_true")
+    parser.add_argument('-thumbnail', help="", action="store_true")
+    parser.add_argument('-launch_time', type=float, default=None)
+    parser.add_argument('-debug', help="", action="store_true")
+    args, _ = parser.parse_known_args(sys.argv[1:])
+
+    if not args.notification:
+        oxxxy_main = import_oxxxy_main()
+        oxxxy_main.main()
+        return
+
+    os.chdir(os.path.dirname(__file__))
+    sys.excepthook = excepthook
+
+    # миниатюру читаем сразу, сохраняющий процесс ждёт, пока мы её заберём
+    thumbnail_data = read_thumbnail_data() if args.thumbnail else None
+
+    # задержку показа уведомления печатаем, только если сохраняющий процесс запущен в отладке
+    NotificationGlobals.DEBUG = args.debug
+    SettingsJson().init(NotificationGlobals)
+    NotificationOrMenu.Globals = NotificationGlobals
+    SettingsWindow.Globals = NotificationGlobals
+    NotificationOrMenu.RequestType = LazyRequestType
+    NotificationOrMenu.context_menu_stylesheet = ""
+    NotificationOrMenu.gl = LazyGlobalFunctions
+
+    app = QApplication(sys.argv)
+    icon_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "icon.png"))
+    app.setWindowIcon(QIcon(icon_path))
+
+    thumbnail = None
+    if thumbnail_data:
+        thumbnail = QPixmap()
+        if not thumbnail.loadFromData(thumbnail_data):
+            thumbnail = None
+
+    notification = NotificationOrMenu(notification=True, filepath=args.path, thumbnail=thumbnail)
+    notification.place_window()
+    QTimer.singleShot(0, lambda: report_latency(args.launch_time))
+
+    app.exec_()
+    sys.exit(0)
+
+def main():
+    try:
+        _main()
+    except Exception as e:
+        oxxxy_main = import_oxxxy_main()
+        oxxxy_main.excepthook(type(e), e, traceback.format_exc())
 
 if __name__ == '__main__':
-    oxxxy_main.Globals.DEBUG = False
-    oxxxy_main.main()
+    main()